@@ -1,5 +1,9 @@
 """SnapReady MVP — FastAPI application."""
 
+import hashlib
+import json
+import math
+import shutil
 import uuid
 from pathlib import Path
 import os
@@ -8,39 +12,62 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from fastapi import BackgroundTasks, FastAPI, File, Form, HTTPException, UploadFile
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from PIL import Image
-import io
 
-from crop import detect_face, crop_headshot_square
-from retouch import retouch_image
-from export import build_zip
+from authcache import start_cert_prefetch, token_cache, verify_id_token_cached
+from blobfetch import storage_fetcher
+from crop import detect_face, detect_face_async, detect_face_draft, MAX_ZOOM, MIN_ZOOM
+from events import PIPELINE_STAGES, TERMINAL, job_events
+from export import cached_export, write_export
+from faceindex import face_index
+from gemini import GEMINI_CONCURRENCY, gemini_backpressure, gemini_stats
+from intake import UploadSizeLimitMiddleware, probe_size, sniff_format
+from scheduler import AsyncJobScheduler, JobScheduler, SchedulerOverloaded, PRIORITY_REPROCESS, PRIORITY_UPLOAD
+from jobqueue import SqliteJobQueue
+from metrics import render as render_metrics, span
+from originals import originals_cache
+from pipeline import CANVAS_RETOUCH, run_job, run_job_aio
+from retouch import retouch_cache_stats
+from services import db, bucket
 from feedback import (
     save_rating, get_feedback_stats, get_current_prompt_version,
-    check_and_trigger_analysis,
+    request_analysis, analysis_status,
 )
 import asyncio
-import urllib.request
-from datetime import datetime
-import firebase_admin
-from firebase_admin import credentials, auth, firestore, storage
+from firebase_admin import firestore
 import fastapi
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from fastapi.staticfiles import StaticFiles
 
 UPLOAD_DIR = Path(__file__).parent / "uploads"
 UPLOAD_DIR.mkdir(exist_ok=True)
 
 MAX_UPLOAD_BYTES = 20 * 1024 * 1024  # 20 MB
+UPLOAD_CHUNK_BYTES = 1024 * 1024
 ALLOWED_TYPES = {"image/jpeg", "image/png"}
 
+SSE_KEEPALIVE_SECONDS = 15.0
+SSE_QUEUE_POLL_SECONDS = 1.0  # sqlite backend: how often the stream checks the local queue
+
+# "memory": jobs run on threads in this process. "sqlite": jobs go to a durable
+# queue served by separate `python worker.py` processes.
+QUEUE_BACKEND = os.environ.get("SNAPREADY_QUEUE", "memory")
+# With the memory queue, run jobs as coroutines on the async Gemini client, so a
+# retouch in flight holds no thread and hundreds can run from one process
+ASYNC_PIPELINE = os.environ.get("SNAPREADY_ASYNC_PIPELINE", "0") == "1"
+
 app = FastAPI(title="SnapReady API")
 
+# Stop oversized uploads while they stream in, not after they are buffered
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    max_body_bytes=MAX_UPLOAD_BYTES + 64 * 1024,  # room for the other form fields
+    paths={"/process"},
+    detail="File exceeds 20 MB limit.",
+)
+
 # Configure CORS
 origins = [
     "http://localhost:3000",             # Local development frontend
@@ -57,97 +84,139 @@ app.add_middleware(
 
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
-# --- Firebase Initialization ---
-firebase_cred_path = Path(__file__).parent / "yphoto-firebase-adminsdk.json"
-if not firebase_cred_path.exists():
-    print("WARNING: Firebase Admin SDK JSON not found. Auth will fail.")
-
-cred = credentials.Certificate(str(firebase_cred_path))
-firebase_app = firebase_admin.initialize_app(cred, {
-    'storageBucket': 'yphoto-d4f64.firebasestorage.app'
-})
-
-db = firestore.client()
-bucket = storage.bucket()
 security = HTTPBearer()
+start_cert_prefetch()
 
 def verify_token(credentials: HTTPAuthorizationCredentials = fastapi.Depends(security)):
     """FastAPI Dependency to verify Firebase Auth Tokens"""
     token = credentials.credentials
     try:
-        decoded_token = auth.verify_id_token(token)
-        return decoded_token['uid']
+        # Cached until the token's own expiry, so hot endpoints skip JWT verification
+        return verify_id_token_cached(token)
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Invalid authentication token: {e}")
 
-# Job state tracking (In-memory for MVP, ideally Redis/DB in production)
-# We will still use this for fast polling, but source of truth is Firestore
-JOB_STATUSES = {}
+# Job state tracking: job_events keeps each recent job's full status payload in a
+# bounded TTL store for /status and the SSE stream, but source of truth is Firestore
+def _set_job_status(job_id: str, status: str):
+    job_events.publish(job_id, status)
 
-def upload_to_firebase(file_path: Path, destination_path: str) -> str:
-    """Uploads a file to Firebase Storage and returns the public URL."""
-    blob = bucket.blob(destination_path)
-    blob.upload_from_filename(str(file_path))
-    blob.make_public()
-    return blob.public_url
 
-def async_process_job(job_id: str, intensity: str, pil_image: Image.Image, face: dict, job_dir: Path, zoom: float, user_id: str):
-    """Background task to crop, retouch, upload to Firebase, and update Firestore."""
-    JOB_STATUSES[job_id] = "processing"
-    
-    # 1. Update Firestore status
-    doc_ref = db.collection('users').document(user_id).collection('jobs').document(job_id)
-    doc_ref.set({
-        'job_id': job_id,
-        'status': 'processing',
-        'intensity': intensity,
-        'zoom': zoom,
-        'created_at': datetime.utcnow(),
-    }, merge=True)
-    
+# Fields of the stored job document that /status returns
+_URL_FIELDS = ("retouched_url", "cropped_url", "preview_url", "thumb_url", "cropped_thumb_url")
+
+
+# Bounded queue for crop/retouch/upload jobs. Reprocess jobs jump ahead of fresh uploads.
+_MAX_QUEUE = int(os.environ.get("SNAPREADY_MAX_QUEUE", 32))
+_MAX_JOBS_PER_USER = int(os.environ.get("SNAPREADY_MAX_JOBS_PER_USER", 4))
+
+if QUEUE_BACKEND == "sqlite":
+    scheduler = SqliteJobQueue(max_queue=_MAX_QUEUE, max_per_owner=_MAX_JOBS_PER_USER)
+elif ASYNC_PIPELINE:
+    # Jobs spend part of their time downloading, cropping and uploading, so run a few
+    # per Gemini slot; more would only queue for the model
+    scheduler = AsyncJobScheduler(
+        workers=int(os.environ.get("SNAPREADY_ASYNC_JOBS", GEMINI_CONCURRENCY * 4)),
+        max_queue=_MAX_QUEUE,
+        max_per_owner=_MAX_JOBS_PER_USER,
+        on_status=_set_job_status,
+        cpu_threads=int(os.environ.get("SNAPREADY_WORKERS", 4)),
+    )
+else:
+    scheduler = JobScheduler(
+        workers=int(os.environ.get("SNAPREADY_WORKERS", 4)),
+        max_queue=_MAX_QUEUE,
+        max_per_owner=_MAX_JOBS_PER_USER,
+        on_status=_set_job_status,
+    )
+
+# Whether the job-state store sees every transition. Workers of the sqlite queue
+# run in other processes, so only a shared store hears about their progress.
+LIVE_STATE = QUEUE_BACKEND == "memory" or job_events.store.shared
+
+
+def _overloaded(e: SchedulerOverloaded) -> HTTPException:
+    return HTTPException(e.status_code, str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+def _check_retouch_admission():
+    """Refuse a job that needs the model while this process's Gemini calls can't keep up.
+
+    Queue workers call Gemini in their own processes, so with the sqlite
+    backend this only sees the API process's client, usually unused.
+    """
+    wait = gemini_backpressure()
+    if wait is not None:
+        raise _overloaded(SchedulerOverloaded("The retouching service is busy, please retry shortly.", 503, max(1, math.ceil(wait))))
+
+
+def _submit_job(
+    kind: str, job_id: str, user_id: str, payload: dict, priority: int, state: dict,
+    pil_image: Image.Image | None = None,
+) -> str:
+    """Queue a pipeline job on the configured backend, mapping overload to an HTTP error.
+
+    state seeds the job's status payload (intensity, zoom, current URLs).
+    It replaces the previous run's state and is recorded before submitting,
+    since a worker may start right away. Returns the render id the run's
+    result will carry, so a client can tell its events from an earlier run's.
+    """
+    render_id = uuid.uuid4().hex[:12]
+    payload = {**payload, "run_id": render_id}
+    previous = job_events.latest(job_id)
+    job_events.restart(job_id, "queued", user_id=user_id, render_id=render_id, **state)
     try:
-        # Crop with zoom
-        cropped = crop_headshot_square(pil_image, face, zoom=zoom)
-        cropped_path = job_dir / "cropped_square.jpg"
-        cropped.save(cropped_path, "JPEG", quality=95)
-        
-        # Retouch
-        retouched = retouch_image(cropped, intensity)
-        retouched_path = job_dir / "retouched.jpg"
-        retouched.save(retouched_path, "JPEG", quality=95)
-        
-        # Upload to Firebase Storage
-        original_url = upload_to_firebase(job_dir / "original.jpg", f"users/{user_id}/{job_id}/original.jpg")
-        cropped_url = upload_to_firebase(cropped_path, f"users/{user_id}/{job_id}/cropped.jpg")
-        retouched_url = upload_to_firebase(retouched_path, f"users/{user_id}/{job_id}/retouched.jpg")
-
-        # Save face coordinates to Firestore instead of a text file
-        face_data = {"x": face['x'], "y": face['y'], "w": face['w'], "h": face['h']}
-
-        # Update Firestore with completion data
-        doc_ref.update({
-            'status': 'completed',
-            'original_url': original_url,
-            'cropped_url': cropped_url,
-            'retouched_url': retouched_url,
-            'face': face_data,
-            'prompt_version': get_current_prompt_version()
-        })
-        
-        JOB_STATUSES[job_id] = "completed"
+        if QUEUE_BACKEND == "sqlite":
+            scheduler.enqueue(kind, job_id, user_id, payload, priority=priority)
+        else:
+            runner = run_job_aio if ASYNC_PIPELINE else run_job
+            scheduler.submit(job_id, user_id, runner, kind, job_id, user_id, payload, pil_image, priority=priority)
+    except SchedulerOverloaded as e:
+        if previous is not None:
+            job_events.remember(job_id, previous)
+        else:
+            job_events.forget(job_id)
+        raise _overloaded(e)
+    return render_id
+
+def _detect_upload(fp, digest: str) -> tuple[dict | None, dict | None, Image.Image | None]:
+    """Find the face in a spooled upload, reusing the result for a previously seen upload.
+
+    Returns (face, index entry if seen before, full image if one had to be
+    decoded). Only the header and a reduced-size draft are decoded unless
+    detection has to fall back to full resolution. Raises ValueError if the
+    image can't be read or is too large.
+    """
+    size = probe_size(fp)
+    cached = face_index.get(digest)
+    if cached is not None and tuple(cached["size"]) == size:
+        return cached["face"], cached, None
+
+    full = None
+    try:
+        # Detection only needs a reduced-size decode; the full decode happens in the job
+        face = detect_face_draft(fp)
+        fp.seek(0)
+        if face is None:
+            full = Image.open(fp).convert("RGB")
+            fp.seek(0)
     except Exception as e:
-        print(f"Job {job_id} failed: {e}")
-        JOB_STATUSES[job_id] = "failed"
-        doc_ref.update({
-            'status': 'failed',
-            'error': str(e)
-        })
-        (job_dir / "error.txt").write_text(str(e))
+        raise ValueError(f"Could not read image: {e}")
+
+    if face is None:
+        face = detect_face(full, fast=False)
+    face_index.put(digest, face, size)
+    return face, None, full
+
+
+def _store_upload(fp, fmt: str, job_dir: Path):
+    """Copy the spooled upload into the job dir as-is. The job decodes it and writes original.jpg."""
+    with open(job_dir / f"upload.{fmt}", "wb") as out:
+        shutil.copyfileobj(fp, out, UPLOAD_CHUNK_BYTES)
 
 
 @app.post("/process")
 async def process_photo(
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     intensity: str = Form("medium"),
     zoom: float = Form(1.0),
@@ -156,16 +225,39 @@ async def process_photo(
     if file.content_type not in ALLOWED_TYPES:
         raise HTTPException(400, "Only JPG and PNG files are accepted.")
 
-    data = await file.read()
-    if len(data) > MAX_UPLOAD_BYTES:
-        raise HTTPException(400, "File exceeds 20 MB limit.")
-
+    # Refuse before reading and decoding the upload if we can't take the job anyway
     try:
-        pil_image = Image.open(io.BytesIO(data)).convert("RGB")
-    except Exception:
-        raise HTTPException(400, "Could not read image file.")
+        scheduler.check_admission(user_id)
+    except SchedulerOverloaded as e:
+        raise _overloaded(e)
+    _check_retouch_admission()
+
+    # Trust the bytes, not the declared content type
+    fmt = sniff_format(await file.read(16))
+    if fmt is None:
+        raise HTTPException(400, "Only JPG and PNG files are accepted.")
+    await file.seek(0)
+
+    # The upload is already spooled (to disk past 1 MB). Hash it in chunks, never
+    # holding the whole file in memory, so a duplicate upload can skip detection.
+    hasher = hashlib.sha256()
+    total = 0
+    with span("request_hash"):
+        while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+            total += len(chunk)
+            if total > MAX_UPLOAD_BYTES:
+                raise HTTPException(413, "File exceeds 20 MB limit.")
+            hasher.update(chunk)
+    digest = hasher.hexdigest()
+    await file.seek(0)
+
+    # Probe and detect on the detector pool so the event loop keeps serving other requests
+    try:
+        with span("request_detect"):
+            face, seen, pil_image = await detect_face_async(file.file, digest, detect=_detect_upload)
+    except ValueError as e:
+        raise HTTPException(400, f"Could not read image file. {e}")
 
-    face = detect_face(pil_image)
     if face is None:
         raise HTTPException(422, "No face detected in the photo. Try a different image.")
 
@@ -179,42 +271,187 @@ async def process_photo(
     job_dir.mkdir(parents=True, exist_ok=True)
     
     # Save locally temporarily for background worker
-    pil_image.save(job_dir / "original.jpg", "JPEG", quality=95)
+    with span("request_store"):
+        await asyncio.to_thread(_store_upload, file.file, fmt, job_dir)
 
     # Queue background processing
-    background_tasks.add_task(async_process_job, job_id, intensity, pil_image, face, job_dir, zoom, user_id)
+    payload = {"intensity": intensity, "face": face, "zoom": zoom, "upload_hash": digest}
+    if seen and seen["user_id"] == user_id and seen["original_path"]:
+        # Same user uploaded this exact file before; copy that original instead of re-uploading
+        payload["original_source"] = seen["original_path"]
+    state = {"intensity": intensity, "zoom": zoom}
+    render_id = _submit_job("process", job_id, user_id, payload, PRIORITY_UPLOAD, state, pil_image)
 
-    return JSONResponse({"job_id": job_id, "status": "processing"})
+    return JSONResponse({"job_id": job_id, "status": "queued", "render_id": render_id})
+
+
+@app.get("/queue/metrics")
+async def queue_metrics():
+    return JSONResponse({
+        **scheduler.metrics(),
+        "job_state": job_events.store.stats(),
+        "auth": token_cache.stats(),
+        "gemini": gemini_stats(),
+        "storage_cache": storage_fetcher.cache.stats(),
+        "originals_cache": originals_cache.stats(),
+    })
+
+
+_CACHES = {
+    "retouch": retouch_cache_stats,
+    "originals": originals_cache.stats,
+    "storage": storage_fetcher.cache.stats,
+    "auth_token": token_cache.stats,
+    "job_state": job_events.store.stats,
+    "face_index": face_index.stats,
+}
+
+
+def _hit_ratio(stats: dict) -> float:
+    lookups = stats["hits"] + stats["misses"]
+    return stats["hits"] / lookups if lookups else 0.0
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Stage latency histograms plus queue, Gemini and cache gauges in Prometheus text format."""
+    queue = await asyncio.to_thread(scheduler.metrics)
+    gemini = gemini_stats() or {"in_flight": 0, "calls": 0, "retries": 0, "failures": 0, "rejected": 0, "hedges": 0}
+    caches = {name: stats() for name, stats in _CACHES.items()}
+    samples = [
+        ("snapready_queue_depth", "gauge", "Jobs waiting to run.", [({}, queue["queued"])]),
+        ("snapready_jobs_running", "gauge", "Jobs running now.", [({}, queue["running"])]),
+        ("snapready_jobs_total", "counter", "Jobs finished, by outcome.", [
+            ({"status": "completed"}, queue["completed"]),
+            ({"status": "failed"}, queue["failed"]),
+        ]),
+        ("snapready_gemini_in_flight", "gauge", "Gemini requests in flight in this process.", [({}, gemini["in_flight"])]),
+        ("snapready_gemini_total", "counter", "Gemini calls and their retries, failures, rejections and hedges.", [
+            ({"event": event}, gemini[event]) for event in ("calls", "retries", "failures", "rejected", "hedges")
+        ]),
+        ("snapready_cache_hits_total", "counter", "Cache hits.", [({"cache": name}, s["hits"]) for name, s in caches.items()]),
+        ("snapready_cache_misses_total", "counter", "Cache misses.", [({"cache": name}, s["misses"]) for name, s in caches.items()]),
+        ("snapready_cache_hit_ratio", "gauge", "Lifetime hit ratio of each cache.", [({"cache": name}, round(_hit_ratio(s), 4)) for name, s in caches.items()]),
+    ]
+    return PlainTextResponse(render_metrics(samples), media_type="text/plain; version=0.0.4")
+
+
+def _status_payload(job_id: str, status: str, data: dict | None) -> dict:
+    """Client-facing job state, from a stored job state or job document."""
+    data = data or {}
+    return {
+        "job_id": job_id,
+        # Pipeline stages are finer-grained than the statuses /status reports
+        "status": "processing" if status in PIPELINE_STAGES else status,
+        **{key: data.get(key) for key in _URL_FIELDS},
+        "intensity": data.get('intensity', 'medium'),
+        "zoom": data.get('zoom', 1.0),
+        "error": data.get('error') if status == "failed" else None,
+        "render_id": data.get('render_id'),
+    }
+
+
+def _owned_state(job_id: str, user_id: str) -> dict | None:
+    """The job's state from the job-state store, if it is live and belongs to this user."""
+    if not LIVE_STATE:
+        return None
+    state = job_events.latest(job_id)
+    if state is None or state.get("user_id") != user_id:
+        return None
+    return state
+
+
+def _stored_status(user_id: str, job_id: str) -> dict | None:
+    """Job state from Firestore, with a job in the local sqlite queue taking precedence."""
+    status = scheduler.active_status(job_id) if QUEUE_BACKEND == "sqlite" else None
+    doc = db.collection('users').document(user_id).collection('jobs').document(job_id).get()
+    if not doc.exists:
+        return _status_payload(job_id, status, None) if status else None
+    data = doc.to_dict()
+    # A job queued or running on this node is fresher than the stored document
+    if status not in ("queued", "processing"):
+        status = data.get('status', 'unknown')
+    payload = _status_payload(job_id, status, data)
+    if LIVE_STATE and status in TERMINAL:
+        # Only settled states are cached; anything in flight is still changing
+        job_events.remember(job_id, {**payload, "user_id": user_id})
+    return payload
 
 
 @app.get("/status/{job_id}")
 async def check_status(job_id: str, user_id: str = fastapi.Depends(verify_token)):
-    # 1. Check fast memory cache first
-    status = JOB_STATUSES.get(job_id)
-    retouched_url = None
-    cropped_url = None
+    state = _owned_state(job_id, user_id)
+    if state is not None:
+        return JSONResponse(_status_payload(job_id, state["status"], state))
 
-    # 2. Check Firestore as source of truth
-    doc_ref = db.collection('users').document(user_id).collection('jobs').document(job_id)
-    doc = doc_ref.get()
-    
-    if doc.exists:
-        data = doc.to_dict()
-        status = data.get('status', 'unknown')
-        retouched_url = data.get('retouched_url')
-        cropped_url = data.get('cropped_url')
-    elif not status:
+    payload = await asyncio.to_thread(_stored_status, user_id, job_id)
+    if payload is None:
         raise HTTPException(404, "Job not found.")
-            
-    return JSONResponse({
-        "job_id": job_id, 
-        "status": status,
-        "retouched_url": retouched_url,
-        "cropped_url": cropped_url,
-        "intensity": data.get('intensity', 'medium') if doc.exists else 'medium',
-        "zoom": data.get('zoom', 1.0) if doc.exists else 1.0,
-        "error": data.get('error') if doc.exists and status == "failed" else None
-    })
+    return JSONResponse(payload)
+
+
+def _sse(event: dict) -> str:
+    event = {key: value for key, value in event.items() if key != "user_id"}
+    return f"event: status\ndata: {json.dumps(event)}\n\n"
+
+
+@app.get("/status/{job_id}/stream")
+async def stream_status(job_id: str, user_id: str = fastapi.Depends(verify_token)):
+    """Push the job's stage transitions as Server-Sent Events, ending at completed or failed.
+
+    Stages published in this process arrive immediately through job_events.
+    Updates made elsewhere (sqlite queue workers, other replicas sharing a
+    Redis store) are picked up by checking every SSE_QUEUE_POLL_SECONDS:
+    the shared store if there is one, else the local queue and then
+    Firestore once the job leaves it.
+    """
+    if _owned_state(job_id, user_id) is not None:
+        initial = None  # subscribe() starts with the current stage
+    else:
+        initial = await asyncio.to_thread(_stored_status, user_id, job_id)
+        if initial is None:
+            raise HTTPException(404, "Job not found.")
+
+    local_only = QUEUE_BACKEND == "memory" and not job_events.store.shared
+    timeout = SSE_KEEPALIVE_SECONDS if local_only else SSE_QUEUE_POLL_SECONDS
+
+    async def refresh(last: str | None) -> dict | None:
+        """Fallback when no event arrived in time: a new state, or None if unchanged."""
+        if LIVE_STATE:
+            state = job_events.latest(job_id)
+            if state is not None:
+                return state if state["status"] != last else None
+        else:
+            status = scheduler.active_status(job_id)
+            if status is not None:
+                return {"job_id": job_id, "status": status} if status != last else None
+        # Not (or no longer) tracked here, e.g. evicted or running on another instance
+        event = await asyncio.to_thread(_stored_status, user_id, job_id)
+        return event if event and event["status"] != last else None
+
+    async def stream():
+        last = None
+        if initial is not None:
+            yield _sse(initial)
+            last = initial["status"]
+            if last in TERMINAL:
+                return
+        async for event in job_events.subscribe(job_id, timeout):
+            if event is None:
+                event = await refresh(last)
+                if event is None:
+                    yield ": keepalive\n\n"
+                    continue
+            yield _sse(event)
+            last = event["status"]
+            if last in TERMINAL:
+                return
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.get("/jobs")
 async def get_user_jobs(user_id: str = fastapi.Depends(verify_token)):
@@ -230,6 +467,8 @@ async def get_user_jobs(user_id: str = fastapi.Depends(verify_token)):
                 "job_id": data['job_id'],
                 "retouched_url": data.get('retouched_url'),
                 "cropped_url": data.get('cropped_url'),
+                "thumb_url": data.get('thumb_url'),
+                "cropped_thumb_url": data.get('cropped_thumb_url'),
                 "intensity": data.get('intensity'),
                 "zoom": data.get('zoom')
             })
@@ -256,13 +495,15 @@ async def delete_job(job_id: str, user_id: str = fastapi.Depends(verify_token)):
     
     # Delete Firestore document
     doc_ref.delete()
+    face_index.forget_job(job_id)
+    job_events.forget(job_id)
+    originals_cache.delete(job_id)
     
     return JSONResponse({"status": "deleted", "job_id": job_id})
 
 @app.post("/reprocess/{job_id}")
 async def reprocess(
     job_id: str, 
-    background_tasks: BackgroundTasks,
     intensity: str = Form("medium"),
     zoom: float = Form(1.0),
     user_id: str = fastapi.Depends(verify_token)
@@ -284,26 +525,44 @@ async def reprocess(
     if intensity not in ("light", "medium", "strong"):
         intensity = "medium"
 
-    # Download original image back from Firebase Storage to memory
     try:
-        req = urllib.request.Request(original_url, headers={'User-Agent': 'Mozilla/5.0'})
-        with urllib.request.urlopen(req) as response:
-            image_data = response.read()
-        pil_image = Image.open(io.BytesIO(image_data)).convert("RGB")
-    except Exception as e:
-        raise HTTPException(500, f"Could not download original image for reprocessing: {e}")
+        scheduler.check_admission(user_id, job_id)
+    except SchedulerOverloaded as e:
+        raise _overloaded(e)
 
-    # Set up temp dir for background worker
     job_dir = UPLOAD_DIR / job_id
     job_dir.mkdir(parents=True, exist_ok=True)
-    
-    # Keep the local copy of original so the worker can use it
-    pil_image.save(job_dir / "original.jpg", "JPEG", quality=95)
 
+    # The current images stay visible until the new ones are ready
+    state = {"intensity": intensity, "zoom": zoom, **{key: data.get(key) for key in _URL_FIELDS}}
+
+    # Zoom-only change on a canvas job: re-crop the retouched canvas, skip Gemini
+    canvas_face = data.get('canvas_face')
+    if (
+        CANVAS_RETOUCH
+        and canvas_face
+        and data.get('canvas_intensity') == intensity
+        and data.get('prompt_version') == get_current_prompt_version()
+        and MIN_ZOOM <= zoom <= MAX_ZOOM
+    ):
+        payload = {
+            "zoom": zoom,
+            "canvas_face": canvas_face,
+            "canvas_url": data.get('canvas_url'),
+            "retouched_canvas_url": data.get('retouched_canvas_url'),
+            "render_id": data.get('render_id'),
+        }
+        render_id = _submit_job("recrop", job_id, user_id, payload, PRIORITY_REPROCESS, state)
+        return JSONResponse({"job_id": job_id, "status": "queued", "render_id": render_id})
+
+    # The job loads the original itself: the cached canvas on this node, else original.jpg,
+    # else a download, so a queue worker doesn't decode it a second time
     # Queue background reprocessing
-    background_tasks.add_task(async_process_job, job_id, intensity, pil_image, face, job_dir, zoom, user_id)
+    _check_retouch_admission()
+    payload = {"intensity": intensity, "face": face, "zoom": zoom, "original_url": original_url}
+    render_id = _submit_job("process", job_id, user_id, payload, PRIORITY_REPROCESS, state)
 
-    return JSONResponse({"job_id": job_id, "status": "processing"})
+    return JSONResponse({"job_id": job_id, "status": "queued", "render_id": render_id})
 
 
 
@@ -322,26 +581,36 @@ async def download_zip(job_id: str, user_id: str = fastapi.Depends(verify_token)
     if not retouched_url:
         raise HTTPException(404, "Retouched image not found.")
 
-    # Download from Firebase to memory
-    try:
-        req = urllib.request.Request(retouched_url, headers={'User-Agent': 'Mozilla/5.0'})
-        with urllib.request.urlopen(req) as response:
-            image_data = response.read()
-        retouched = Image.open(io.BytesIO(image_data)).convert("RGB")
-    except Exception as e:
-        raise HTTPException(500, f"Could not download image: {e}")
-        
     job_dir = UPLOAD_DIR / job_id
-    job_dir.mkdir(parents=True, exist_ok=True)
-    
-    zip_bytes = build_zip(retouched, job_id)
-
-    zip_path = job_dir / f"{job_id}.zip"
-    with open(zip_path, "wb") as f:
-        f.write(zip_bytes.getvalue())
-
+    # Jobs from before render ids existed are keyed by their URL's hash instead
+    render_id = data.get('render_id') or hashlib.sha256(retouched_url.encode()).hexdigest()[:12]
+
+    cached = cached_export(job_dir, render_id)
+    if cached is not None:
+        zip_path, zip_stat = cached
+    else:
+        # Not built on this node yet (or the job was reprocessed, possibly just now
+        # dropping this bundle): build once and cache
+        # Frame from the retouched canvas when there is one; plain jobs only have the square
+        source_url, face = retouched_url, None
+        if data.get('retouched_canvas_url') and data.get('canvas_face'):
+            source_url, face = data['retouched_canvas_url'], data['canvas_face']
+        try:
+            with span("request_fetch"):
+                source = await storage_fetcher.fetch_image(source_url, version=render_id)
+        except Exception as e:
+            raise HTTPException(500, f"Could not download image: {e}")
+        job_dir.mkdir(parents=True, exist_ok=True)
+        with span("export"):
+            zip_path = await asyncio.to_thread(
+                write_export, source, job_id, job_dir, render_id, face, data.get('zoom', 1.0),
+            )
+        zip_stat = None
+
+    # Streamed from disk in chunks; repeat downloads cost no image work
     return FileResponse(
         path=zip_path,
+        stat_result=zip_stat,
         media_type="application/zip",
         filename=f"snapready_{job_id}.zip",
     )
@@ -355,9 +624,10 @@ async def rate_job(job_id: str, rating: str = Form(...), background_tasks: Backg
     if not job_dir.exists():
         raise HTTPException(404, "Job not found.")
 
-    record = save_rating(job_id, rating)
+    # How the rated image was made is read from the job dir, where the pipeline left it
+    record = await asyncio.to_thread(save_rating, job_id, rating)
     if background_tasks:
-        background_tasks.add_task(check_and_trigger_analysis)
+        background_tasks.add_task(request_analysis)
     return JSONResponse(record)
 
 
@@ -368,7 +638,14 @@ async def feedback_stats():
 
 @app.post("/feedback/analyze")
 async def manual_analyze():
-    result = check_and_trigger_analysis()
-    if result is None:
-        return JSONResponse({"status": "no_action", "message": "Threshold not met or no improvements needed."})
-    return JSONResponse({"status": "updated", **result})
+    """Start analysis now for every group over the threshold. Progress is at GET /feedback/analysis."""
+    analyses = await asyncio.to_thread(request_analysis, 0)
+    active = [a for a in analyses.values() if a["status"] in ("pending", "running")]
+    if not active:
+        return JSONResponse({"status": "no_action", "message": "Threshold not met or no improvements needed.", "analyses": analyses})
+    return JSONResponse({"status": "scheduled", "analyses": analyses}, status_code=202)
+
+
+@app.get("/feedback/analysis")
+async def feedback_analysis():
+    return JSONResponse(analysis_status())
@@ -0,0 +1,135 @@
+"""Firebase ID token verification with a cache of verified tokens and prefetched signing certs."""
+
+import functools
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# Local stand-in for load tests; see fakes.py
+FAKE_AUTH = os.environ.get("SNAPREADY_FAKES") == "1"
+if FAKE_AUTH:
+    from fakes import FakeAuth
+    auth = FakeAuth()
+else:
+    import cachecontrol
+    import requests
+    from firebase_admin import auth
+    from google.auth.transport.requests import Request
+
+TOKEN_CACHE_MAX_ENTRIES = int(os.environ.get("SNAPREADY_TOKEN_CACHE_MAX", 10_000))
+
+# Google's public keys for ID tokens. They rotate a few times a day and are served with a max-age.
+ID_TOKEN_CERT_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+CERT_REFRESH_FRACTION = 0.8  # refetch when this much of the advertised max-age has passed
+CERT_RETRY_SECONDS = 60.0
+CERT_FETCH_TIMEOUT = 10.0
+
+
+class TokenCache:
+    """LRU map of verified ID tokens to uids. An entry is dropped at its token's own exp.
+
+    Keys are token hashes, so raw bearer tokens are not kept in memory.
+    """
+
+    def __init__(self, max_entries: int = TOKEN_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[bytes, tuple[str, float]] = OrderedDict()  # hash -> (uid, exp)
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> str | None:
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, token: str, uid: str, expires_at: float):
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (uid, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = len(self._entries)
+        return {"entries": entries, "hits": self.hits, "misses": self.misses}
+
+
+token_cache = TokenCache()
+
+
+def verify_id_token_cached(token: str) -> str:
+    """Return the uid for a valid ID token. Raises like auth.verify_id_token on an invalid one."""
+    uid = token_cache.get(token)
+    if uid is not None:
+        return uid
+    decoded = auth.verify_id_token(token)
+    token_cache.put(token, decoded["uid"], decoded["exp"])
+    return decoded["uid"]
+
+
+def _cert_request():
+    """Our own HTTP-caching transport for the cert fetches, handed to firebase_admin's verifier.
+
+    firebase_admin has no public way to share or warm its cert cache, so the
+    hand-over sets an internal attribute. If that moves in a later release the
+    AttributeError propagates and the caller skips prefetching; verification
+    then fetches certs on its own as before.
+    """
+    # Verification fetches through it too, so it carries the timeout
+    request = functools.partial(Request(cachecontrol.CacheControl(requests.Session())), timeout=CERT_FETCH_TIMEOUT)
+    auth._get_client(None)._token_verifier.request = request
+    return request
+
+
+def _refresh_certs(request) -> float:
+    """Fetch the signing certs past any cached copy. Returns seconds until the next refresh."""
+    response = request(ID_TOKEN_CERT_URL, headers={"Cache-Control": "no-cache"})
+    if response.status != 200:
+        raise RuntimeError(f"HTTP {response.status}")
+    match = re.search(r"max-age=(\d+)", response.headers.get("cache-control", ""))
+    max_age = int(match.group(1)) if match else 3600
+    return max(CERT_RETRY_SECONDS, max_age * CERT_REFRESH_FRACTION)
+
+
+def start_cert_prefetch():
+    """Keep the token verifier's cert cache fresh from a background thread.
+
+    Without this the first request after the cached certs expire pays for
+    the fetch, and during a key rotation that can stall verification.
+    """
+    if FAKE_AUTH:
+        return
+    try:
+        request = _cert_request()
+    except AttributeError as e:
+        print(f"[auth] Cert prefetch disabled, firebase_admin's verifier changed: {e}")
+        return
+
+    def loop():
+        while True:
+            try:
+                delay = _refresh_certs(request)
+            except Exception as e:
+                print(f"[auth] Cert prefetch failed: {e}")
+                delay = CERT_RETRY_SECONDS
+            time.sleep(delay)
+
+    threading.Thread(target=loop, name="cert-prefetch", daemon=True).start()
@@ -0,0 +1,364 @@
+"""Offline benchmarks of face detection, cropping, export and the full processing job.
+
+Firebase and Gemini are replaced by the fakes in fakes.py, with fixed latency
+and no injected errors, so a run needs no credentials or network. Inputs are
+the photos in test-photos and synthetic portraits from 1 to 48 megapixels.
+Each case runs in a fresh interpreter, so the peak RSS it reports is its own.
+
+    python bench.py                                     # every case and input
+    python bench.py --cases detect,build_zip --sizes 1,12
+    python bench.py --save                              # bench-results/<commit>.json
+    python bench.py --compare bench-results/abc1234.json
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+from metrics import percentile
+
+ROOT = Path(__file__).parent
+PHOTOS_DIR = ROOT / "test-photos"
+RESULTS_DIR = ROOT / "bench-results"
+# Synthetic inputs are deterministic, so they are generated once and kept
+INPUTS_DIR = ROOT / "cache" / "bench-inputs"
+SYNTHETIC_SOURCE = PHOTOS_DIR / "headshot.jpg"
+SYNTHETIC_SIZES = (1, 4, 12, 24, 48)  # megapixels
+
+CASES = ("detect", "detect_draft", "crop_square", "crop_canvas", "build_zip", "pipeline", "pipeline_aio")
+
+
+def _synthetic_input(megapixels: int) -> Path:
+    """A JPEG portrait of about this many megapixels: the sample headshot upscaled, with fixed grain.
+
+    The grain keeps encode and decode costs close to those of a real photo,
+    which a smooth upscale would understate.
+    """
+    import numpy as np
+    from PIL import Image
+
+    path = INPUTS_DIR / f"synthetic-{megapixels}mp.jpg"
+    if path.exists():
+        return path
+    INPUTS_DIR.mkdir(parents=True, exist_ok=True)
+
+    with Image.open(SYNTHETIC_SOURCE) as source:
+        aspect = source.width / source.height
+        height = round(math.sqrt(megapixels * 1_000_000 / aspect))
+        width = round(height * aspect)
+        pixels = np.array(source.convert("RGB").resize((width, height), Image.LANCZOS))
+
+    tile = np.random.default_rng(megapixels).integers(-6, 7, size=(256, 256, 3), dtype=np.int16)
+    row = np.tile(tile, (1, -(-width // 256), 1))[:, :width]
+    for top in range(0, height, 256):
+        strip = pixels[top:top + 256]
+        strip[:] = np.clip(strip.astype(np.int16) + row[:len(strip)], 0, 255)
+
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    Image.fromarray(pixels).save(tmp, "JPEG", quality=92)
+    os.replace(tmp, path)
+    return path
+
+
+def _inputs(sizes: list[int], photos: bool) -> list[Path]:
+    found = []
+    if photos and PHOTOS_DIR.is_dir():
+        found += sorted(p for p in PHOTOS_DIR.iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png"))
+    for megapixels in sizes:
+        print(f"[bench] Preparing {megapixels} MP input")
+        found.append(_synthetic_input(megapixels))
+    return found
+
+
+def _peak_rss_mb() -> float:
+    # Linux carries ru_maxrss across exec, so a child would report the driver's peak; VmHWM is this image's own
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+# --- Case runner (child process) ---
+
+def _case(name: str, image, data: bytes, face: dict, workdir: Path):
+    """The function one iteration of a case calls, given its index."""
+    from crop import crop_headshot_canvas, crop_headshot_square, detect_face, detect_face_draft
+    from export import build_zip
+    from metrics import job_timings
+    from pipeline import async_process_job, process_job_aio
+
+    stages: dict[str, float] = {}
+
+    def new_job(i: int):
+        job_id = f"bench{i:05d}"
+        job_dir = workdir / "uploads" / job_id
+        job_dir.mkdir(parents=True, exist_ok=True)
+        return job_id, job_dir
+
+    def pipeline(i: int):
+        job_id, job_dir = new_job(i)
+        with job_timings() as timings:
+            async_process_job(job_id, "medium", image, face, job_dir, 1.0, "bench-user")
+        for stage, seconds in timings.items():
+            stages[stage] = stages.get(stage, 0.0) + seconds
+
+    async def pipeline_aio(i: int):
+        job_id, job_dir = new_job(i)
+        with job_timings() as timings:
+            await process_job_aio(job_id, "medium", image, face, job_dir, 1.0, "bench-user")
+        for stage, seconds in timings.items():
+            stages[stage] = stages.get(stage, 0.0) + seconds
+
+    runs = {
+        "detect": lambda i: detect_face(image),
+        "detect_draft": lambda i: detect_face_draft(io.BytesIO(data)),
+        "crop_square": lambda i: crop_headshot_square(image, face),
+        "crop_canvas": lambda i: crop_headshot_canvas(image, face),
+        "build_zip": lambda i: build_zip(image, f"bench{i:05d}", face),
+        "pipeline": pipeline,
+        "pipeline_aio": pipeline_aio,
+    }
+    return runs[name], stages
+
+
+def _time_sync(run, indices: range, concurrency: int) -> list[float]:
+    def timed(i):
+        start = time.perf_counter()
+        run(i)
+        return time.perf_counter() - start
+
+    if concurrency == 1:
+        return [timed(i) for i in indices]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(timed, indices))
+
+
+def _time_async(run, indices: range, concurrency: int) -> list[float]:
+    async def main():
+        slots = asyncio.Semaphore(concurrency)
+
+        async def timed(i):
+            async with slots:
+                start = time.perf_counter()
+                await run(i)
+                return time.perf_counter() - start
+
+        return await asyncio.gather(*(timed(i) for i in indices))
+
+    return asyncio.run(main())
+
+
+def run_case(name: str, input_path: Path, iterations: int, warmup: int, concurrency: int,
+             gemini_latency: float, storage_latency: float) -> dict:
+    """Run one case on one input in this process and return its measurements."""
+    workdir = Path(tempfile.mkdtemp(prefix="snapready-bench-"))
+    # Fresh caches per run; a retouch cache that keeps nothing makes every job a miss, like a new upload
+    os.environ["SNAPREADY_CACHE_DIR"] = str(workdir / "cache")
+    os.environ["RETOUCH_CACHE_MAX_BYTES"] = "0"
+    # Fixed fake latencies and no injected errors, whatever the environment says
+    os.environ["SNAPREADY_FAKES"] = "1"
+    for service in ("AUTH", "FIRESTORE", "STORAGE", "GEMINI"):
+        os.environ[f"SNAPREADY_FAKE_{service}_ERRORS"] = "0"
+        os.environ[f"SNAPREADY_FAKE_{service}_LATENCY"] = "0"
+    os.environ["SNAPREADY_FAKE_GEMINI_LATENCY"] = str(gemini_latency)
+    os.environ["SNAPREADY_FAKE_STORAGE_LATENCY"] = str(storage_latency)
+    # The fakes have no quota; a rate limit would only add waiting to the numbers
+    os.environ["SNAPREADY_GEMINI_RPM"] = "60000000"
+    os.environ["SNAPREADY_GEMINI_CONCURRENCY"] = str(max(concurrency, 1))
+    try:
+        from PIL import Image
+        from crop import detect_face
+
+        data = input_path.read_bytes()
+        image = Image.open(io.BytesIO(data)).convert("RGB")
+        face = detect_face(image)
+        if face is None:
+            raise RuntimeError(f"no face found in {input_path.name}")
+
+        run, stages = _case(name, image, data, face, workdir)
+        timer = _time_async if asyncio.iscoroutinefunction(run) else _time_sync
+        rss_before = _peak_rss_mb()
+        if warmup:
+            timer(run, range(-warmup, 0), 1)
+            stages.clear()
+
+        start = time.perf_counter()
+        latencies = sorted(timer(run, range(iterations), concurrency))
+        wall = time.perf_counter() - start
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    megapixels = image.width * image.height / 1_000_000
+    result = {
+        "case": name,
+        "input": input_path.stem,
+        "size": f"{image.width}x{image.height}",
+        "megapixels": round(megapixels, 2),
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+        "min_ms": round(latencies[0] * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+        "throughput_per_s": round(iterations / wall, 3),
+        "megapixels_per_s": round(iterations * megapixels / wall, 2),
+        "rss_before_mb": round(rss_before, 1),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+    }
+    if stages:
+        result["stages_ms"] = {stage: round(seconds / iterations * 1000, 1) for stage, seconds in sorted(stages.items())}
+    return result
+
+
+# --- Driver ---
+
+def _run_isolated(name: str, input_path: Path, args) -> dict:
+    command = [
+        sys.executable, __file__, "--child", name, str(input_path),
+        "--iterations", str(args.iterations), "--warmup", str(args.warmup), "--concurrency", str(args.concurrency),
+        "--gemini-latency", str(args.gemini_latency), "--storage-latency", str(args.storage_latency),
+    ]
+    proc = subprocess.run(command, capture_output=True, text=True, cwd=ROOT)
+    lines = [line for line in proc.stdout.splitlines() if line.startswith("{")]
+    if proc.returncode != 0 or not lines:
+        error = (proc.stderr.strip().splitlines() or ["exited with status %d" % proc.returncode])[-1]
+        return {"case": name, "input": input_path.stem, "error": error}
+    return json.loads(lines[-1])
+
+
+def _key(result: dict) -> str:
+    return f"{result['case']}:{result['input']}"
+
+
+def _change(new: float, old: float) -> str:
+    return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+
+def _print_results(results: list[dict], baseline: dict[str, dict] | None = None):
+    header = f"{'case':<13} {'input':<16} {'MP':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ops/s':>8} {'peak MB':>8}"
+    if baseline is not None:
+        header += f" {'p50 vs base':>12} {'ops/s vs base':>14}"
+    print(header)
+    for r in results:
+        if "error" in r:
+            print(f"{r['case']:<13} {r['input']:<16} error: {r['error']}")
+            continue
+        line = (
+            f"{r['case']:<13} {r['input']:<16} {r['megapixels']:>5.1f} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f}"
+            f" {r['p99_ms']:>9.1f} {r['throughput_per_s']:>8.2f} {r['peak_rss_mb']:>8.0f}"
+        )
+        old = (baseline or {}).get(_key(r))
+        if old and "error" not in old:
+            line += f" {_change(r['p50_ms'], old['p50_ms']):>12} {_change(r['throughput_per_s'], old['throughput_per_s']):>14}"
+        print(line)
+
+
+def _regressions(results: list[dict], baseline: dict[str, dict], threshold: float) -> list[str]:
+    """Cases whose median latency grew by more than threshold (a fraction) against the baseline."""
+    slower = []
+    for r in results:
+        old = baseline.get(_key(r))
+        if "error" in r or not old or "error" in old:
+            continue
+        if r["p50_ms"] > old["p50_ms"] * (1 + threshold):
+            slower.append(f"{_key(r)} p50 {old['p50_ms']:.1f} -> {r['p50_ms']:.1f} ms")
+    return slower
+
+
+def _commit() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=ROOT, check=True)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, cwd=ROOT)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip() + ("-dirty" if dirty.stdout.strip() else "")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline SnapReady benchmarks")
+    parser.add_argument("--cases", default=",".join(CASES), help=f"comma-separated subset of {', '.join(CASES)}")
+    parser.add_argument("--sizes", default=",".join(map(str, SYNTHETIC_SIZES)), help="synthetic input sizes in megapixels; empty for none")
+    parser.add_argument("--no-photos", action="store_true", help="skip the photos in test-photos")
+    parser.add_argument("--iterations", "-n", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--concurrency", "-c", type=int, default=1, help="iterations in flight at once")
+    parser.add_argument("--gemini-latency", type=float, default=0.0, help="seconds the fake Gemini takes per call")
+    parser.add_argument("--storage-latency", type=float, default=0.0, help="seconds the fake bucket takes per upload")
+    parser.add_argument("--save", nargs="?", const="", metavar="PATH", help="write results as JSON (default bench-results/<commit>.json)")
+    parser.add_argument("--compare", metavar="PATH", help="baseline JSON to compare against; exits 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.10, help="p50 slowdown counted as a regression (fraction)")
+    parser.add_argument("--child", nargs=2, metavar=("CASE", "INPUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        name, input_path = args.child
+        result = run_case(name, Path(input_path), args.iterations, args.warmup, args.concurrency, args.gemini_latency, args.storage_latency)
+        print(json.dumps(result))
+        return
+
+    cases = [c for c in args.cases.split(",") if c]
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    baseline = None
+    if args.compare:
+        baseline = {_key(r): r for r in json.loads(Path(args.compare).read_text())["results"]}
+
+    results = []
+    for input_path in _inputs(sizes, not args.no_photos):
+        for name in cases:
+            print(f"[bench] {name} on {input_path.stem}", flush=True)
+            results.append(_run_isolated(name, input_path, args))
+    print()
+    _print_results(results, baseline)
+
+    if args.save is not None:
+        commit = _commit()
+        path = Path(args.save) if args.save else RESULTS_DIR / f"{commit or 'results'}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        meta = {
+            "commit": commit,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "iterations": args.iterations,
+            "warmup": args.warmup,
+            "concurrency": args.concurrency,
+            "gemini_latency": args.gemini_latency,
+            "storage_latency": args.storage_latency,
+        }
+        path.write_text(json.dumps({"meta": meta, "results": results}, indent=2) + "\n")
+        print(f"\n[bench] Saved {path}")
+
+    if baseline is not None:
+        slower = _regressions(results, baseline, args.threshold)
+        for line in slower:
+            print(f"[bench] Regression: {line}")
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""Firebase Storage downloads through the bucket API, pooled and cached.
+
+Set STORAGE_EMULATOR_HOST (as for google-cloud-storage) to read from a local
+stand-in for the bucket instead; requests then go unauthenticated.
+"""
+
+import asyncio
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote, unquote
+
+import httpx
+from PIL import Image
+
+from services import bucket, storage_credentials
+
+STORAGE_API_URL = os.environ.get("STORAGE_EMULATOR_HOST", "https://storage.googleapis.com").rstrip("/")
+if "://" not in STORAGE_API_URL:
+    STORAGE_API_URL = f"http://{STORAGE_API_URL}"
+FETCH_CONNECT_TIMEOUT = float(os.environ.get("SNAPREADY_STORAGE_CONNECT_TIMEOUT", 5))
+FETCH_TIMEOUT = float(os.environ.get("SNAPREADY_STORAGE_TIMEOUT", 30))
+FETCH_MAX_CONNECTIONS = int(os.environ.get("SNAPREADY_STORAGE_MAX_CONNECTIONS", 32))
+FETCH_CACHE_MAX_BYTES = int(os.environ.get("SNAPREADY_STORAGE_CACHE_MB", 64)) * 1024 * 1024
+FETCH_CACHE_TTL = float(os.environ.get("SNAPREADY_STORAGE_CACHE_TTL", 600))
+
+PUBLIC_URL_PREFIX = "https://storage.googleapis.com/"
+
+
+class FetchCache:
+    """In-memory LRU of downloaded objects, bounded in bytes, each entry expiring after ttl_seconds."""
+
+    def __init__(self, max_bytes: int = FETCH_CACHE_MAX_BYTES, ttl_seconds: float = FETCH_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple, tuple[float, bytes]] = OrderedDict()  # key -> (expires, data)
+        self._total_bytes = 0
+
+    def get(self, key: tuple) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._drop_locked(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: tuple, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop_locked(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, data)
+            self._total_bytes += len(data)
+            while self._total_bytes > self.max_bytes:
+                self._drop_locked(next(iter(self._entries)))
+
+    def _drop_locked(self, key: tuple):
+        _, data = self._entries.pop(key)
+        self._total_bytes -= len(data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._total_bytes, "hits": self.hits, "misses": self.misses}
+
+
+class StorageFetcher:
+    """Downloads objects of our bucket with pooled HTTP clients and a read-through cache.
+
+    fetch() is for the event loop; fetch_sync() is its counterpart for job
+    threads and worker processes, on a thread-safe pooled client.
+
+    Public object URLs are mapped back to their object and read through the
+    JSON API with the service account's credentials, rather than through the
+    public CDN path. Other URLs are fetched as they are.
+
+    Objects are cached under (object, version). Callers pass a version
+    that changes whenever the object is rewritten (e.g. a render id).
+    Leave it None only for objects that are never rewritten, such as
+    originals.
+    """
+
+    def __init__(self, api_url: str = STORAGE_API_URL, cache: FetchCache | None = None):
+        self.api_url = api_url
+        self.authenticated = "STORAGE_EMULATOR_HOST" not in os.environ
+        self.cache = cache or FetchCache()
+        # httpx clients are bound to the event loop they first connect on
+        self._clients: dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+        self._sync_client: httpx.Client | None = None
+        self._sync_lock = threading.Lock()
+        self._token_lock = threading.Lock()
+
+    def _client_options(self) -> dict:
+        return {
+            "timeout": httpx.Timeout(FETCH_TIMEOUT, connect=FETCH_CONNECT_TIMEOUT),
+            "limits": httpx.Limits(max_connections=FETCH_MAX_CONNECTIONS, max_keepalive_connections=FETCH_MAX_CONNECTIONS),
+            "headers": {"User-Agent": "snapready"},
+        }
+
+    def _client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(**self._client_options())
+            self._clients[loop] = client
+        return client
+
+    def _client_sync(self) -> httpx.Client:
+        with self._sync_lock:
+            if self._sync_client is None:
+                self._sync_client = httpx.Client(**self._client_options())
+            return self._sync_client
+
+    def _token(self) -> str:
+        """A valid access token of the storage client's credentials, refreshed when expired."""
+        import google.auth.transport.requests
+
+        with self._token_lock:
+            if not storage_credentials.valid:
+                storage_credentials.refresh(google.auth.transport.requests.Request())
+            return storage_credentials.token
+
+    def object_name(self, url: str) -> str | None:
+        """The object in our bucket a public URL points at, or None for any other URL."""
+        prefix = f"{PUBLIC_URL_PREFIX}{bucket.name}/"
+        if not url.startswith(prefix):
+            return None
+        return unquote(url[len(prefix):].split("?", 1)[0])
+
+    def _request(self, url: str) -> tuple[str, str | None]:
+        """The URL to download url from, and its object name if it is in our bucket."""
+        name = self.object_name(url)
+        if name is None:
+            return url, None
+        return f"{self.api_url}/storage/v1/b/{bucket.name}/o/{quote(name, safe='')}?alt=media", name
+
+    async def fetch(self, url: str, version: str | None = None) -> bytes:
+        """Bytes of a stored object given its public URL. Raises httpx.HTTPError on failure."""
+        request_url, name = self._request(url)
+        key = (name or url, version)
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+
+        headers = {}
+        if name is not None and self.authenticated:
+            headers["Authorization"] = f"Bearer {await asyncio.to_thread(self._token)}"
+        response = await self._client().get(request_url, headers=headers)
+        response.raise_for_status()
+        data = response.content
+        self.cache.put(key, data)
+        return data
+
+    def fetch_sync(self, url: str, version: str | None = None) -> bytes:
+        """fetch() for threads: blocks the calling thread, shares the cache."""
+        request_url, name = self._request(url)
+        key = (name or url, version)
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+
+        headers = {}
+        if name is not None and self.authenticated:
+            headers["Authorization"] = f"Bearer {self._token()}"
+        response = self._client_sync().get(request_url, headers=headers)
+        response.raise_for_status()
+        data = response.content
+        self.cache.put(key, data)
+        return data
+
+    async def fetch_image(self, url: str, version: str | None = None) -> Image.Image:
+        """fetch() decoded to RGB; decoding runs in a thread."""
+        data = await self.fetch(url, version)
+        return await asyncio.to_thread(lambda: Image.open(io.BytesIO(data)).convert("RGB"))
+
+    def fetch_image_sync(self, url: str, version: str | None = None) -> Image.Image:
+        return Image.open(io.BytesIO(self.fetch_sync(url, version))).convert("RGB")
+
+
+storage_fetcher = StorageFetcher()
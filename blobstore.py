@@ -0,0 +1,62 @@
+"""Firebase Storage uploads straight from memory, run concurrently."""
+
+import io
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from PIL import Image
+
+from metrics import span
+from services import UPLOAD_CONCURRENCY, bucket
+
+# By extension, for uploads that don't name a content type
+CONTENT_TYPES = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png", ".webp": "image/webp", ".zip": "application/zip"}
+
+# The storage client's connection pool is sized to match in services
+_executor = ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY, thread_name_prefix="upload")
+
+
+def encode_jpeg(pil_image: Image.Image, quality: int = 95) -> bytes:
+    """Encode an image to JPEG bytes in memory."""
+    buf = io.BytesIO()
+    pil_image.save(buf, "JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def upload_bytes(destination_path: str, data: bytes, content_type: str = "image/jpeg") -> str:
+    """Upload bytes to Firebase Storage as a public object and return its public URL.
+
+    The public ACL is set in the upload request itself rather than with a
+    separate make_public() call.
+    """
+    blob = bucket.blob(destination_path)
+    with span("storage_upload"):
+        blob.upload_from_string(data, content_type=content_type, predefined_acl="publicRead")
+    return blob.public_url
+
+
+def copy_public(source_path: str, destination_path: str) -> str:
+    """Server-side copy of an existing object to a new public object. No bytes leave Google."""
+    copied = bucket.copy_blob(bucket.blob(source_path), bucket, destination_path)
+    copied.make_public()
+    return copied.public_url
+
+
+def start_copy(source_path: str, destination_path: str) -> Future:
+    """Start copy_public on the upload pool. Returns Future[url]."""
+    return _executor.submit(copy_public, source_path, destination_path)
+
+
+def _content_type(path: str) -> str:
+    return CONTENT_TYPES.get(os.path.splitext(path)[1].lower(), "application/octet-stream")
+
+
+def start_uploads(files: dict[str, bytes], content_type: str | None = None) -> dict[str, Future]:
+    """Start uploading {destination_path: bytes} concurrently. Returns {destination_path: Future[url]}.
+
+    Without a content_type, each file's type follows its extension.
+    """
+    return {
+        path: _executor.submit(upload_bytes, path, data, content_type or _content_type(path))
+        for path, data in files.items()
+    }
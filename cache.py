@@ -0,0 +1,247 @@
+"""Content-addressed on-disk cache for expensive pipeline results."""
+
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Awaitable, Callable
+
+CACHE_DIR = Path(os.environ.get("SNAPREADY_CACHE_DIR", Path(__file__).parent / "cache"))
+
+# A temporary file older than this was left by a writer that died mid-write
+_STALE_TMP_SECONDS = 600
+
+
+def content_key(*parts: bytes | str) -> str:
+    """Hash an ordered sequence of parts into a stable hex key."""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        # Length-prefix each part so ("ab", "c") and ("a", "bc") differ
+        h.update(len(part).to_bytes(8, "big"))
+        h.update(part)
+    return h.hexdigest()
+
+
+class ResultCache:
+    """Bytes cache on disk with LRU size eviction, TTL expiry and single-flight.
+
+    Entries are stored as one file per key; the file's mtime is when it was
+    stored and its atime when it was last read. An in-memory index tracks
+    size and last access. Other processes (replicas, queue workers) may
+    share the directory, so before evicting the index is rebuilt from the
+    directory if it is over budget or rescan_seconds old. Their entries then
+    count against the budget and get evicted like our own.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int, ttl_seconds: float, rescan_seconds: float = 30.0):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.rescan_seconds = rescan_seconds
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._index: OrderedDict[str, tuple[int, float]] = OrderedDict()  # key -> (size, created)
+        self._total_bytes = 0
+        self._scanned_at = 0.0
+        self._inflight: dict[str, Future] = {}
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._rescan()
+        with self._lock:
+            self._evict_locked()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.bin"
+
+    def _rescan(self):
+        """Rebuild the index from the directory, oldest access first, and delete
+        temporary files left by writers that crashed.
+        """
+        now = time.time()
+        entries = []
+        for path in self.directory.iterdir():
+            try:
+                st = path.stat()
+                if path.suffix == ".tmp":
+                    # Anything this old is not a write in progress
+                    if now - st.st_mtime > _STALE_TMP_SECONDS:
+                        path.unlink()
+                    continue
+            except OSError:
+                continue
+            if path.suffix == ".bin":
+                entries.append((st.st_atime, path.stem, st.st_size, st.st_mtime))
+        index = OrderedDict((key, (size, created)) for _, key, size, created in sorted(entries))
+        with self._lock:
+            self._index = index
+            self._total_bytes = sum(size for size, _ in index.values())
+            self._scanned_at = time.monotonic()
+
+    def _drop_locked(self, key: str):
+        size, _ = self._index.pop(key)
+        self._total_bytes -= size
+        try:
+            self._path(key).unlink()
+        except OSError:
+            pass
+
+    def _evict_locked(self):
+        now = time.time()
+        expired = [k for k, (_, created) in self._index.items() if now - created > self.ttl_seconds]
+        for key in expired:
+            self._drop_locked(key)
+        while self._total_bytes > self.max_bytes and self._index:
+            self._drop_locked(next(iter(self._index)))
+
+    def _index_stale(self) -> bool:
+        with self._lock:
+            return self._total_bytes > self.max_bytes or time.monotonic() - self._scanned_at > self.rescan_seconds
+
+    def get(self, key: str) -> bytes | None:
+        """Return cached bytes for key, or None on miss or expiry."""
+        path = self._path(key)
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is not None and time.time() - entry[1] > self.ttl_seconds:
+                self._drop_locked(key)
+                self.misses += 1
+                return None
+        if entry is None:
+            # Possibly stored by another process since the last rescan
+            try:
+                st = path.stat()
+            except OSError:
+                st = None
+            if st is None or time.time() - st.st_mtime > self.ttl_seconds:
+                with self._lock:
+                    self.misses += 1
+                return None
+            entry = (st.st_size, st.st_mtime)
+        try:
+            data = path.read_bytes()
+            # Record the access on the file too, for other processes' LRU order
+            os.utime(path, (time.time(), entry[1]))
+        except OSError:
+            with self._lock:
+                if key in self._index:
+                    self._drop_locked(key)
+                self.misses += 1
+            return None
+        with self._lock:
+            if key not in self._index:
+                self._total_bytes += entry[0]
+            self._index[key] = entry
+            self._index.move_to_end(key)
+            self.hits += 1
+        return data
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            if key in self._index:
+                return True
+        return self._path(key).exists()
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._index:
+                self._drop_locked(key)
+                return
+        self._path(key).unlink(missing_ok=True)
+
+    def put(self, key: str, data: bytes):
+        """Store bytes under key, evicting old entries to stay within budget."""
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        if self._index_stale():
+            self._rescan()
+        with self._lock:
+            if key in self._index:
+                self._total_bytes -= self._index.pop(key)[0]
+            self._index[key] = (len(data), time.time())
+            self._total_bytes += len(data)
+            self._evict_locked()
+
+    def get_or_compute(self, key: str, compute: Callable[[], bytes]) -> bytes:
+        """Return cached bytes, or run compute once for all concurrent callers of key."""
+        data = self.get(key)
+        if data is not None:
+            return data
+
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+
+        if not leader:
+            return future.result()
+
+        try:
+            # A previous leader may have stored the result since our first lookup
+            data = self.get(key)
+            if data is None:
+                data = compute()
+                self.put(key, data)
+            future.set_result(data)
+            return data
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    async def aget_or_compute(self, key: str, compute: Callable[[], Awaitable[bytes]]) -> bytes:
+        """get_or_compute for coroutines. Disk I/O runs in a thread; waiting on another caller holds none.
+
+        Shares in-flight computations with get_or_compute callers.
+        """
+        data = await asyncio.to_thread(self.get, key)
+        if data is not None:
+            return data
+
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+
+        if not leader:
+            return await asyncio.wrap_future(future)
+
+        try:
+            data = await asyncio.to_thread(self.get, key)
+            if data is None:
+                data = await compute()
+                await asyncio.to_thread(self.put, key, data)
+            future.set_result(data)
+            return data
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -1,5 +1,9 @@
 """Face detection and headshot cropping using MediaPipe."""
 
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import mediapipe as mp
@@ -14,14 +18,39 @@ _options = FaceDetectorOptions(
     base_options=BaseOptions(model_asset_path=_MODEL_PATH),
     min_detection_confidence=0.5,
 )
-_detector = FaceDetector.create_from_options(_options)
 
+# A FaceDetector must not be used from two threads at once, so each thread gets its own
+_local = threading.local()
+_detectors: list[FaceDetector] = []  # keeps detectors alive until interpreter teardown
 
-def detect_face(pil_image: Image.Image) -> dict | None:
-    """Detect the most prominent face and return {x, y, w, h} in pixels, or None."""
+
+def _get_detector() -> FaceDetector:
+    detector = getattr(_local, "detector", None)
+    if detector is None:
+        detector = FaceDetector.create_from_options(_options)
+        _local.detector = detector
+        _detectors.append(detector)
+    return detector
+
+
+# Dedicated threads for decode + detection, each with a warmed detector. Pillow
+# and MediaPipe release the GIL while working, so this scales across cores.
+DETECTOR_POOL = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("SNAPREADY_DETECTOR_THREADS", os.cpu_count() or 2)),
+    thread_name_prefix="detector",
+    initializer=_get_detector,
+)
+
+
+# BlazeFace short-range works at 128x128 internally, so detecting on a proxy
+# this size finds the same faces at a fraction of the decode and copy cost.
+DETECT_PROXY_SIZE = 640
+
+
+def _detect_raw(pil_image: Image.Image) -> dict | None:
     img_array = np.array(pil_image.convert("RGB"))
     mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=img_array)
-    result = _detector.detect(mp_image)
+    result = _get_detector().detect(mp_image)
 
     if not result.detections:
         return None
@@ -36,8 +65,66 @@ def detect_face(pil_image: Image.Image) -> dict | None:
     }
 
 
-def _crop_centered(
-    pil_image: Image.Image,
+def _scale_face(face: dict, sx: float, sy: float) -> dict:
+    """Map a face box from proxy to full-resolution pixel coordinates."""
+    return {
+        "x": round(face["x"] * sx),
+        "y": round(face["y"] * sy),
+        "w": round(face["w"] * sx),
+        "h": round(face["h"] * sy),
+    }
+
+
+def _detect_on_proxy(proxy: Image.Image, full_size: tuple[int, int]) -> dict | None:
+    if max(proxy.size) > DETECT_PROXY_SIZE:
+        proxy = proxy.copy()
+        proxy.thumbnail((DETECT_PROXY_SIZE, DETECT_PROXY_SIZE), Image.BILINEAR, reducing_gap=2.0)
+    face = _detect_raw(proxy)
+    if face is None:
+        return None
+    return _scale_face(face, full_size[0] / proxy.size[0], full_size[1] / proxy.size[1])
+
+
+def detect_face(pil_image: Image.Image, fast: bool = True) -> dict | None:
+    """Detect the most prominent face and return {x, y, w, h} in pixels, or None.
+
+    With fast=True large images are searched on a downscaled proxy first,
+    falling back to full resolution if no face is found there.
+    """
+    if fast and max(pil_image.size) > DETECT_PROXY_SIZE * 1.5:
+        face = _detect_on_proxy(pil_image, pil_image.size)
+        if face is not None:
+            return face
+    return _detect_raw(pil_image)
+
+
+def detect_face_draft(fp) -> dict | None:
+    """Detect a face in an encoded image file using only a reduced-size decode.
+
+    JPEGs are decoded in draft mode (DCT scaling), which skips most of the
+    decode work. The box is returned in full-resolution coordinates. Returns
+    None if no face is found at reduced size; callers should then fall back
+    to detect_face(full_image, fast=False).
+    """
+    with Image.open(fp) as im:
+        full_size = im.size
+        im.draft("RGB", (DETECT_PROXY_SIZE, DETECT_PROXY_SIZE))
+        proxy = im.convert("RGB")
+    return _detect_on_proxy(proxy, full_size)
+
+
+async def detect_face_async(*args, detect=detect_face):
+    """Run detect (detect_face by default) on DETECTOR_POOL, without blocking the event loop.
+
+    detect may be any detection step that should share the pool's warmed
+    detectors, e.g. one that also decodes an upload.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(DETECTOR_POOL, detect, *args)
+
+
+def _crop_box(
+    img_size: tuple[int, int],
     face: dict,
     target_w: int,
     target_h: int,
@@ -45,9 +132,9 @@ def _crop_centered(
     pad_bottom: float,
     pad_left: float,
     pad_right: float,
-) -> Image.Image:
-    """Crop an image centered on a face with specified padding ratios and output size."""
-    img_w, img_h = pil_image.size
+) -> tuple[int, int, int, int]:
+    """Compute the (left, top, right, bottom) crop region around a face."""
+    img_w, img_h = img_size
     fx, fy, fw, fh = face["x"], face["y"], face["w"], face["h"]
 
     # Face center
@@ -92,15 +179,43 @@ def _crop_centered(
     crop_right = min(img_w, int(crop_right))
     crop_bottom = min(img_h, int(crop_bottom))
 
-    cropped = pil_image.crop((crop_left, crop_top, crop_right, crop_bottom))
+    return crop_left, crop_top, crop_right, crop_bottom
+
+
+def _crop_centered(
+    pil_image: Image.Image,
+    face: dict,
+    target_w: int,
+    target_h: int,
+    pad_top: float,
+    pad_bottom: float,
+    pad_left: float,
+    pad_right: float,
+) -> Image.Image:
+    """Crop an image centered on a face with specified padding ratios and output size."""
+    box = _crop_box(
+        pil_image.size, face, target_w, target_h,
+        pad_top, pad_bottom, pad_left, pad_right,
+    )
+    cropped = pil_image.crop(box)
     return cropped.resize((target_w, target_h), Image.LANCZOS)
 
 
+# Base square paddings (zoom=1.0) - Increased for a wider default crop
+SQUARE_PADS = (0.95, 0.85, 0.85, 0.85)  # top, bottom, left, right
+
+# Zoom range of the result page slider; the retouch canvas covers the widest framing
+MIN_ZOOM = 0.5
+MAX_ZOOM = 1.5
+# Long side of the retouch canvas. Kept under retouch's 4K threshold so the canvas
+# costs a 2K generation; zooms tighter than 1200 * MAX_ZOOM / CANVAS_SIZE (about
+# 0.88) crop fewer than 1200px from it and _crop_centered upscales them.
+CANVAS_SIZE = 2048
+
+
 def crop_headshot_square(pil_image: Image.Image, face: dict, zoom: float = 1.0) -> Image.Image:
     """Crop to 1200x1200 square centered on face. Zoom > 1 is wider, < 1 is tighter."""
-    # Base paddings (zoom=1.0) - Increased for a wider default crop
-    base_top, base_bottom = 0.95, 0.85
-    base_left, base_right = 0.85, 0.85
+    base_top, base_bottom, base_left, base_right = SQUARE_PADS
 
     return _crop_centered(
         pil_image, face,
@@ -112,11 +227,63 @@ def crop_headshot_square(pil_image: Image.Image, face: dict, zoom: float = 1.0)
     )
 
 
+def crop_headshot_canvas(pil_image: Image.Image, face: dict) -> tuple[Image.Image, dict]:
+    """Crop the MAX_ZOOM framing around the face, scaled so its long side is CANVAS_SIZE.
+
+    Returns the canvas and the face box in canvas coordinates, so that
+    crop_headshot_square(canvas, canvas_face, zoom) reproduces any zoom from
+    MIN_ZOOM to MAX_ZOOM without going back to the original image, upscaling
+    the tightest ones. The scale
+    is uniform and never enlarges the original, which has no more detail to
+    give; near image edges the canvas may be narrower than it is tall.
+    """
+    base_top, base_bottom, base_left, base_right = SQUARE_PADS
+    left, top, right, bottom = _crop_box(
+        pil_image.size, face, CANVAS_SIZE, CANVAS_SIZE,
+        base_top * MAX_ZOOM, base_bottom * MAX_ZOOM,
+        base_left * MAX_ZOOM, base_right * MAX_ZOOM,
+    )
+    scale = min(1.0, CANVAS_SIZE / max(right - left, bottom - top))
+    size = (round((right - left) * scale), round((bottom - top) * scale))
+    canvas = pil_image.crop((left, top, right, bottom)).resize(size, Image.LANCZOS)
+
+    canvas_face = {
+        "x": (face["x"] - left) * scale,
+        "y": (face["y"] - top) * scale,
+        "w": face["w"] * scale,
+        "h": face["h"] * scale,
+    }
+    return canvas, canvas_face
+
+
+def square_face(img_size: tuple[int, int], face: dict, zoom: float, out_size: tuple[int, int]) -> dict:
+    """Where the face lands inside crop_headshot_square(...) output resized to out_size."""
+    base_top, base_bottom, base_left, base_right = SQUARE_PADS
+    left, top, right, bottom = _crop_box(
+        img_size, face, 1200, 1200,
+        base_top * zoom, base_bottom * zoom,
+        base_left * zoom, base_right * zoom,
+    )
+    sx = out_size[0] / (right - left)
+    sy = out_size[1] / (bottom - top)
+    return {
+        "x": (face["x"] - left) * sx,
+        "y": (face["y"] - top) * sy,
+        "w": face["w"] * sx,
+        "h": face["h"] * sy,
+    }
+
+
+# Portrait framing keeps shoulder room below the face
+PORTRAIT_PADS = (0.55, 1.40, 0.60, 0.60)  # top, bottom, left, right
+
+
 def crop_headshot_portrait(pil_image: Image.Image, face: dict) -> Image.Image:
     """Crop to 960x1200 (4:5) portrait centered on face with shoulder room."""
+    pad_top, pad_bottom, pad_left, pad_right = PORTRAIT_PADS
     return _crop_centered(
         pil_image, face,
         target_w=960, target_h=1200,
-        pad_top=0.55, pad_bottom=1.40,
-        pad_left=0.60, pad_right=0.60,
+        pad_top=pad_top, pad_bottom=pad_bottom,
+        pad_left=pad_left, pad_right=pad_right,
     )
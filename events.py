@@ -0,0 +1,143 @@
+"""Job stage transitions: latest state per job, and in-process pub/sub for SSE."""
+
+import asyncio
+import threading
+
+from jobstate import MemoryJobStateStore, make_job_state_store
+
+# Stages a job passes through, in order. A job ends in "completed" or "failed".
+STAGES = ("queued", "processing", "cropping", "retouching", "uploading", "completed", "failed")
+PIPELINE_STAGES = {"cropping", "retouching", "uploading"}
+TERMINAL = {"completed", "failed"}
+
+
+class JobEvents:
+    """Latest state per job, kept in a job-state store, plus live subscribers.
+
+    publish() may be called from any thread (scheduler workers, upload
+    callbacks); subscribers are asyncio consumers on the API event loop.
+    Each job's state accumulates fields (owner, intensity, zoom, URLs) across
+    stages, so it is the full /status payload and a subscriber that
+    connects late starts from the current stage.
+
+    Subscribers only hear publishes from this process. With a shared store,
+    other processes' updates show up in latest(); each publish merges its
+    fields in the store itself, so concurrent publishers don't lose each
+    other's.
+    """
+
+    # Stripes of per-job locks: they order one job's merges and notifications
+    # without serializing every job behind one store round trip
+    _STRIPES = 64
+
+    def __init__(self, store=None):
+        self.store = store or MemoryJobStateStore()
+        self._lock = threading.Lock()  # guards _subscribers only
+        self._job_locks = [threading.Lock() for _ in range(self._STRIPES)]
+        self._subscribers: dict[str, list[tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+
+    def publish(self, job_id: str, status: str, **fields):
+        """Record a stage transition, merged into the job's state, and push it to subscribers.
+
+        A publish that changes nothing is dropped. An error is only kept
+        while the job is failed.
+        """
+        fields = {"job_id": job_id, **fields, "status": status}
+        drop = () if status == "failed" else ("error",)
+        with self._job_lock(job_id):
+            previous, event = self._merge(job_id, fields, drop)
+            if event is None:
+                # Store down: subscribers still hear what this publish knows
+                event = fields
+            if event == previous:
+                return
+            with self._lock:
+                self._notify_locked(job_id, event)
+
+    def restart(self, job_id: str, status: str, **fields):
+        """Start a new run of the job: replace its state, rather than merging into it, and notify.
+
+        A subscriber connecting after this can't be handed the previous
+        run's terminal state.
+        """
+        event = {"job_id": job_id, **fields, "status": status}
+        with self._job_lock(job_id):
+            self._put(job_id, event)
+            with self._lock:
+                self._notify_locked(job_id, event)
+
+    def update(self, job_id: str, **fields):
+        """Attach fields (e.g. a preview URL) to the job's current stage."""
+        with self._job_lock(job_id):
+            _, event = self._merge(job_id, fields, existing_only=True)
+            if event is not None:
+                with self._lock:
+                    self._notify_locked(job_id, event)
+
+    def latest(self, job_id: str) -> dict | None:
+        return self._get(job_id)
+
+    def remember(self, job_id: str, state: dict):
+        """Store a state read from elsewhere (Firestore) without notifying anyone."""
+        self._put(job_id, {**state, "job_id": job_id})
+
+    def forget(self, job_id: str):
+        try:
+            self.store.delete(job_id)
+        except Exception as e:
+            print(f"[events] Could not drop state of {job_id}: {e}")
+
+    def _job_lock(self, job_id: str) -> threading.Lock:
+        return self._job_locks[hash(job_id) % self._STRIPES]
+
+    # A store outage must not fail jobs or requests; it only costs Firestore reads
+    def _get(self, job_id: str) -> dict | None:
+        try:
+            return self.store.get(job_id)
+        except Exception as e:
+            print(f"[events] Job state read failed for {job_id}: {e}")
+            return None
+
+    def _put(self, job_id: str, state: dict):
+        try:
+            self.store.put(job_id, state)
+        except Exception as e:
+            print(f"[events] Job state write failed for {job_id}: {e}")
+
+    def _merge(self, job_id: str, fields: dict, drop: tuple[str, ...] = (), existing_only: bool = False) -> tuple[dict | None, dict | None]:
+        try:
+            return self.store.merge(job_id, fields, drop, existing_only)
+        except Exception as e:
+            print(f"[events] Job state write failed for {job_id}: {e}")
+            return None, None
+
+    def _notify_locked(self, job_id: str, event: dict):
+        for loop, queue in self._subscribers.get(job_id, ()):
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    async def subscribe(self, job_id: str, timeout: float):
+        """Yield the job's current state, then each new one. Yields None after timeout seconds of silence."""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        entry = (loop, queue)
+        with self._lock:
+            self._subscribers.setdefault(job_id, []).append(entry)
+        current = self._get(job_id)
+        try:
+            if current is not None:
+                yield current
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self._lock:
+                subscribers = self._subscribers.get(job_id, [])
+                if entry in subscribers:
+                    subscribers.remove(entry)
+                if not subscribers:
+                    self._subscribers.pop(job_id, None)
+
+
+job_events = JobEvents(make_job_state_store())
@@ -1,28 +1,169 @@
 """Export retouched images as a ZIP with both square and portrait sizes."""
 
 import io
+import os
+import threading
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import NamedTuple
 
 from PIL import Image
 
+from crop import PORTRAIT_PADS, SQUARE_PADS, _crop_box
 
-def build_zip(retouched_image: Image.Image, job_id: str) -> bytes:
-    """Resize retouched image to both delivery sizes and package as ZIP."""
+EXPORT_THREADS = int(os.environ.get("SNAPREADY_EXPORT_THREADS", 4))
+
+# Shared Image.reduce() passes stop once this much LANCZOS downscale is left,
+# which keeps output indistinguishable from a full LANCZOS resize
+REDUCING_GAP = 2.0
+
+_executor = ThreadPoolExecutor(max_workers=EXPORT_THREADS, thread_name_prefix="export")
+
+
+class Rendition(NamedTuple):
+    """One output of the export: a framing, a pixel size and an encoding."""
+    name: str
+    width: int
+    height: int
+    pads: tuple[float, float, float, float] | None  # face framing (top, bottom, left, right); None = keep source framing
+    format: str = "JPEG"
+    quality: int = 92
+
+
+RENDITIONS = (
+    Rendition("square", 1200, 1200, SQUARE_PADS),
+    Rendition("portrait", 960, 1200, PORTRAIT_PADS),
+)
+
+# Small WebP renditions for the gallery and for the early preview shown before the retouch lands
+THUMBNAIL = Rendition("thumb", 320, 320, None, "WEBP", 70)
+PREVIEW = Rendition("preview", 480, 480, None, "WEBP", 40)
+
+_EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp"}
+
+
+def _fit_aspect(box: tuple[int, int, int, int], aspect: float) -> tuple[float, float, float, float]:
+    """Trim a box clamped at the image edge back to the target aspect, keeping its center."""
+    left, top, right, bottom = box
+    w, h = right - left, bottom - top
+    if w / h > aspect:
+        trim = (w - h * aspect) / 2
+        return left + trim, top, right - trim, bottom
+    trim = (h - w / aspect) / 2
+    return left, top + trim, right, bottom - trim
+
+
+def _source_box(size: tuple[int, int], face: dict | None, rendition: Rendition, zoom: float):
+    """Region of the source, in source pixels, that this rendition shows."""
+    aspect = rendition.width / rendition.height
+    if face is None or rendition.pads is None:
+        return _fit_aspect((0, 0, size[0], size[1]), aspect)
+    pad_top, pad_bottom, pad_left, pad_right = rendition.pads
+    box = _crop_box(
+        size, face, rendition.width, rendition.height,
+        pad_top * zoom, pad_bottom * zoom, pad_left * zoom, pad_right * zoom,
+    )
+    return _fit_aspect(box, aspect)
+
+
+def _reduce_factor(box, rendition: Rendition) -> int:
+    scale = min((box[2] - box[0]) / rendition.width, (box[3] - box[1]) / rendition.height)
+    return max(1, int(scale / REDUCING_GAP))
+
+
+def _encode(source: Image.Image, box, rendition: Rendition) -> bytes:
+    out = source.resize((rendition.width, rendition.height), Image.LANCZOS, box=box)
     buf = io.BytesIO()
+    out.save(buf, format=rendition.format, quality=rendition.quality)
+    return buf.getvalue()
 
-    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
-        # 1200x1200 square
-        square = retouched_image.copy()
-        square = square.resize((1200, 1200), Image.LANCZOS)
-        sq_buf = io.BytesIO()
-        square.save(sq_buf, format="JPEG", quality=92)
-        zf.writestr(f"{job_id}_square_1200x1200.jpg", sq_buf.getvalue())
-
-        # 960x1200 portrait (4:5)
-        portrait = retouched_image.copy()
-        portrait = portrait.resize((960, 1200), Image.LANCZOS)
-        pt_buf = io.BytesIO()
-        portrait.save(pt_buf, format="JPEG", quality=92)
-        zf.writestr(f"{job_id}_portrait_960x1200.jpg", pt_buf.getvalue())
+
+def render(
+    source: Image.Image,
+    face: dict | None = None,
+    renditions: tuple[Rendition, ...] = RENDITIONS,
+    zoom: float = 1.0,
+) -> list[bytes]:
+    """Produce every rendition from one decoded source image.
+
+    Each rendition is framed from the face box (no stretching between
+    aspects). The source is reduced once per distinct integer factor and
+    those reductions are shared, so the per-rendition LANCZOS resize works
+    on a small image. Resizes and encodes then run in parallel.
+    """
+    boxes = [_source_box(source.size, face, r, zoom) for r in renditions]
+
+    # Most exports share one factor, so this is usually a single reduce() pass
+    reduced = {1: source}
+    jobs = []
+    for rendition, box in zip(renditions, boxes):
+        factor = _reduce_factor(box, rendition)
+        if factor not in reduced:
+            reduced[factor] = source.reduce(factor)
+        scaled = tuple(v / factor for v in box)
+        jobs.append(_executor.submit(_encode, reduced[factor], scaled, rendition))
+    return [job.result() for job in jobs]
+
+
+def build_zip(
+    retouched_image: Image.Image,
+    job_id: str,
+    face: dict | None = None,
+    zoom: float = 1.0,
+    renditions: tuple[Rendition, ...] = RENDITIONS,
+) -> bytes:
+    """Render all delivery sizes from the retouched image and package them as a ZIP.
+
+    face is the face box in retouched_image coordinates. Without it each
+    rendition is a centered crop of the source framing.
+    """
+    encoded = render(retouched_image, face, renditions, zoom)
+
+    buf = io.BytesIO()
+    # JPEGs don't deflate; store them so building and unzipping cost nothing extra
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:
+        for rendition, data in zip(renditions, encoded):
+            ext = _EXTENSIONS.get(rendition.format, rendition.format.lower())
+            zf.writestr(f"{job_id}_{rendition.name}_{rendition.width}x{rendition.height}.{ext}", data)
 
     return buf.getvalue()
+
+
+def export_path(job_dir: Path, render_id: str) -> Path:
+    """Where the ZIP for one specific render of a job is cached.
+
+    render_id changes every time the job's retouched image is regenerated,
+    so a reprocess invalidates the old bundle just by changing the name.
+    """
+    return job_dir / f"export-{render_id}.zip"
+
+
+def cached_export(job_dir: Path, render_id: str) -> tuple[Path, os.stat_result] | None:
+    """Return the cached ZIP for this render and its stat if it has been built.
+
+    Serve it with that stat rather than statting again: a newer render of the
+    job finishing in between drops this bundle, and the caller should then
+    rebuild it instead of failing.
+    """
+    path = export_path(job_dir, render_id)
+    try:
+        return path, path.stat()
+    except FileNotFoundError:
+        return None
+
+
+def write_export(
+    retouched_image: Image.Image, job_id: str, job_dir: Path, render_id: str,
+    face: dict | None = None, zoom: float = 1.0,
+) -> Path:
+    """Build the ZIP for a render, cache it in job_dir and drop bundles of older renders."""
+    path = export_path(job_dir, render_id)
+    # Unique per thread too: two threads of one process may build the same render
+    tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(build_zip(retouched_image, job_id, face, zoom))
+    os.replace(tmp, path)
+    for stale in job_dir.glob("export-*.zip"):
+        if stale != path:
+            stale.unlink(missing_ok=True)
+    return path
@@ -0,0 +1,121 @@
+"""Face detection results keyed by a hash of the raw upload bytes."""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from cache import CACHE_DIR
+
+FACE_INDEX_PATH = Path(os.environ.get("SNAPREADY_FACE_INDEX", CACHE_DIR / "faces.db"))
+FACE_INDEX_MAX_ENTRIES = int(os.environ.get("SNAPREADY_FACE_INDEX_MAX", 50_000))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS faces (
+    digest TEXT PRIMARY KEY,
+    face TEXT,                 -- JSON {x, y, w, h}, or NULL when no face was found
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    user_id TEXT,              -- last job that stored this upload as its original
+    job_id TEXT,
+    original_path TEXT,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS faces_lru ON faces (last_used);
+CREATE INDEX IF NOT EXISTS faces_by_job ON faces (job_id);
+"""
+
+
+class FaceIndex:
+    """Bounded LRU index of detection results, persisted in SQLite.
+
+    Shared by the API (lookups on upload) and the job pipeline (recording
+    where the original was stored), which may be separate processes.
+    """
+
+    def __init__(self, path: Path = FACE_INDEX_PATH, max_entries: int = FACE_INDEX_MAX_ENTRIES):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._puts = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, digest: str) -> dict | None:
+        """Return {face, size, user_id, job_id, original_path} for a known upload, else None.
+
+        face is None if the upload was seen before and had no face.
+        """
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT face, width, height, user_id, job_id, original_path FROM faces WHERE digest = ?",
+            (digest,),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        conn.execute("UPDATE faces SET last_used = ? WHERE digest = ?", (time.time(), digest))
+        return {
+            "face": json.loads(row[0]) if row[0] else None,
+            "size": (row[1], row[2]),
+            "user_id": row[3],
+            "job_id": row[4],
+            "original_path": row[5],
+        }
+
+    def put(self, digest: str, face: dict | None, size: tuple[int, int]):
+        """Record the detection result for an upload."""
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO faces (digest, face, width, height, last_used) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT(digest) DO UPDATE SET face = excluded.face, width = excluded.width,"
+            " height = excluded.height, last_used = excluded.last_used",
+            (digest, json.dumps(face) if face else None, size[0], size[1], time.time()),
+        )
+        # Trim occasionally rather than on every insert
+        self._puts += 1
+        if self._puts % 100 == 0:
+            self._evict()
+
+    def set_original(self, digest: str, user_id: str, job_id: str, original_path: str):
+        """Remember where this upload's original lives in Storage, for reuse by later duplicates."""
+        self._conn().execute(
+            "UPDATE faces SET user_id = ?, job_id = ?, original_path = ? WHERE digest = ?",
+            (user_id, job_id, original_path, digest),
+        )
+
+    def forget_job(self, job_id: str):
+        """Drop Storage references to a deleted job; the detection result itself stays valid."""
+        self._conn().execute(
+            "UPDATE faces SET user_id = NULL, job_id = NULL, original_path = NULL WHERE job_id = ?",
+            (job_id,),
+        )
+
+    def _evict(self):
+        self._conn().execute(
+            "DELETE FROM faces WHERE digest IN ("
+            " SELECT digest FROM faces ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def stats(self) -> dict:
+        (entries,) = self._conn().execute("SELECT COUNT(*) FROM faces").fetchone()
+        return {"entries": entries, "hits": self.hits, "misses": self.misses}
+
+
+face_index = FaceIndex()
@@ -0,0 +1,577 @@
+"""Local stand-ins for Firebase Auth, Firestore, Storage and Gemini, for benchmarks and load tests.
+
+Set SNAPREADY_FAKES=1 to run the API against them instead of the real
+services. Fake state lives in memory, so use a single process (the default
+in-process queue, one uvicorn worker). Each fake waits a configurable time
+per call and can fail a fraction of calls with the error the real service
+would raise:
+
+    SNAPREADY_FAKE_{AUTH,FIRESTORE,STORAGE,GEMINI}_LATENCY   seconds, or "low-high" drawn uniformly
+    SNAPREADY_FAKE_{AUTH,FIRESTORE,STORAGE,GEMINI}_ERRORS    fraction of calls that fail
+    SNAPREADY_FAKE_SEED                                      seed of those draws
+
+Bearer tokens of the form "fake-<uid>" sign in as <uid>. The fake Gemini
+answers an image request with the image it was sent, and a text request
+with a fixed prompt. Stored objects are also served through a local bucket
+API, which STORAGE_EMULATOR_HOST points blobfetch at.
+
+The fake Gemini also speaks the REST API, for exercising the real SDK and
+its HTTP timeouts. serve_redis is a small in-memory Redis for the shared
+job-state store. To run either on its own:
+
+    python fakes.py gemini [port]     then SNAPREADY_GEMINI_BASE_URL=http://127.0.0.1:<port>
+    python fakes.py redis [port]      then SNAPREADY_REDIS_URL=redis://127.0.0.1:<port>/0
+"""
+
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+import types as pytypes
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+from urllib.parse import unquote, urlsplit
+
+from google.api_core.exceptions import ServiceUnavailable
+from google.genai import errors, types
+
+FAKE_SEED = os.environ.get("SNAPREADY_FAKE_SEED", "0")
+FAKE_BUCKET_NAME = "snapready-fake.appspot.com"
+FAKE_TOKEN_PREFIX = "fake-"
+FAKE_TOKEN_LIFETIME = 3600.0
+
+# What the fake critic proposes; long enough to pass feedback's validation
+FAKE_PROMPT = (
+    "Conservative portrait retouching: soften minor blemishes and even out skin tone slightly,"
+    " keeping skin texture, face shape, eye color and hair exactly as they are."
+)
+
+
+class Faults:
+    """Latency and error injection for one fake service, configured from SNAPREADY_FAKE_<NAME>_*."""
+
+    def __init__(self, name: str, latency: str | float | None = None, error_rate: float | None = None):
+        self.name = name
+        spec = str(os.environ.get(f"SNAPREADY_FAKE_{name.upper()}_LATENCY", 0) if latency is None else latency)
+        low, _, high = spec.partition("-")
+        self.low = float(low)
+        self.high = float(high or low)
+        self.error_rate = float(os.environ.get(f"SNAPREADY_FAKE_{name.upper()}_ERRORS", 0) if error_rate is None else error_rate)
+        self.calls = 0
+        self.failures = 0
+        self._random = random.Random(f"{FAKE_SEED}:{name}")
+        self._lock = threading.Lock()
+
+    def _draw(self) -> tuple[float, bool]:
+        """This call's delay, and whether it fails."""
+        with self._lock:
+            self.calls += 1
+            delay = self._random.uniform(self.low, self.high) if self.high > self.low else self.low
+            failed = self.error_rate > 0 and self._random.random() < self.error_rate
+            if failed:
+                self.failures += 1
+        return delay, failed
+
+    def hit(self) -> bool:
+        """Wait out one call's latency. Returns True if the call should fail."""
+        delay, failed = self._draw()
+        if delay:
+            time.sleep(delay)
+        return failed
+
+    async def ahit(self) -> bool:
+        delay, failed = self._draw()
+        if delay:
+            await asyncio.sleep(delay)
+        return failed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"calls": self.calls, "failures": self.failures}
+
+
+# --- Storage ---
+
+class FakeBlob:
+    def __init__(self, bucket: "FakeBucket", name: str):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def public_url(self) -> str:
+        return f"https://storage.googleapis.com/{self.bucket.name}/{self.name}"
+
+    def upload_from_string(self, data: bytes, content_type: str | None = None, predefined_acl: str | None = None):
+        self.bucket.call()
+        with self.bucket.lock:
+            self.bucket.objects[self.name] = (bytes(data), content_type)
+
+    def download_as_bytes(self) -> bytes:
+        self.bucket.call()
+        return self.bucket.read(self.name)[0]
+
+    def exists(self) -> bool:
+        with self.bucket.lock:
+            return self.name in self.bucket.objects
+
+    def make_public(self):
+        pass
+
+    def delete(self):
+        self.bucket.call()
+        with self.bucket.lock:
+            self.bucket.objects.pop(self.name, None)
+
+
+class FakeBucket:
+    """Objects kept in a dict, behind the storage faults."""
+
+    def __init__(self, name: str = FAKE_BUCKET_NAME, faults: Faults | None = None):
+        self.name = name
+        self.faults = faults or Faults("storage")
+        self.lock = threading.Lock()
+        self.objects: dict[str, tuple[bytes, str | None]] = {}
+
+    def call(self):
+        if self.faults.hit():
+            raise ServiceUnavailable("Injected fake storage error")
+
+    def read(self, name: str) -> tuple[bytes, str | None]:
+        with self.lock:
+            return self.objects[name]
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self, name)
+
+    def copy_blob(self, blob: FakeBlob, destination_bucket: "FakeBucket", new_name: str) -> FakeBlob:
+        self.call()
+        with self.lock:
+            destination_bucket.objects[new_name] = self.objects[blob.name]
+        return FakeBlob(destination_bucket, new_name)
+
+    def list_blobs(self, prefix: str = "") -> list[FakeBlob]:
+        self.call()
+        with self.lock:
+            return [FakeBlob(self, name) for name in sorted(self.objects) if name.startswith(prefix)]
+
+
+def serve_bucket(bucket: FakeBucket) -> str:
+    """Serve the bucket's objects at the JSON API's media path on a local port, and point
+    STORAGE_EMULATOR_HOST at it. Returns the host:port.
+    """
+    prefix = f"/storage/v1/b/{bucket.name}/o/"
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = urlsplit(self.path).path
+            if not path.startswith(prefix):
+                self.send_error(404)
+                return
+            if bucket.faults.hit():
+                self.send_error(503, "Injected fake storage error")
+                return
+            try:
+                data, content_type = bucket.read(unquote(path[len(prefix):]))
+            except KeyError:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type or "application/octet-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+        request_queue_size = 128
+
+    server = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, name="fake-bucket", daemon=True).start()
+    host = f"127.0.0.1:{server.server_port}"
+    os.environ["STORAGE_EMULATOR_HOST"] = f"http://{host}"
+    return host
+
+
+# --- Firestore ---
+
+class FakeSnapshot:
+    def __init__(self, doc_id: str, data: dict | None):
+        self.id = doc_id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self) -> dict | None:
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeDocument:
+    def __init__(self, db: "FakeFirestore", path: str):
+        self.db = db
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name: str) -> "FakeCollection":
+        return FakeCollection(self.db, f"{self.path}/{name}")
+
+    def set(self, data: dict, merge: bool = False):
+        self.db.call()
+        with self.db.lock:
+            if merge and self.path in self.db.documents:
+                self.db.documents[self.path].update(data)
+            else:
+                self.db.documents[self.path] = dict(data)
+
+    def update(self, data: dict):
+        self.db.call()
+        with self.db.lock:
+            self.db.documents.setdefault(self.path, {}).update(data)
+
+    def get(self) -> FakeSnapshot:
+        self.db.call()
+        with self.db.lock:
+            data = self.db.documents.get(self.path)
+            return FakeSnapshot(self.id, dict(data) if data is not None else None)
+
+    def delete(self):
+        self.db.call()
+        with self.db.lock:
+            self.db.documents.pop(self.path, None)
+
+
+class FakeCollection:
+    def __init__(self, db: "FakeFirestore", path: str, order: tuple[str, bool] | None = None, count: int | None = None):
+        self.db = db
+        self.path = path
+        self._order = order
+        self._count = count
+
+    def document(self, doc_id: str) -> FakeDocument:
+        return FakeDocument(self.db, f"{self.path}/{doc_id}")
+
+    def order_by(self, field: str, direction: str = "ASCENDING") -> "FakeCollection":
+        return FakeCollection(self.db, self.path, (field, direction == "DESCENDING"), self._count)
+
+    def limit(self, count: int) -> "FakeCollection":
+        return FakeCollection(self.db, self.path, self._order, count)
+
+    def stream(self):
+        self.db.call()
+        prefix = f"{self.path}/"
+        with self.db.lock:
+            docs = [
+                FakeSnapshot(path[len(prefix):], dict(data))
+                for path, data in self.db.documents.items()
+                if path.startswith(prefix) and "/" not in path[len(prefix):]
+            ]
+        if self._order:
+            field, descending = self._order
+            # As in Firestore, ordering by a field leaves out documents without it
+            docs = sorted((d for d in docs if d._data.get(field) is not None), key=lambda d: d._data[field], reverse=descending)
+        return iter(docs[:self._count] if self._count is not None else docs)
+
+
+class FakeFirestore:
+    """Documents kept in a dict keyed by their path, behind the firestore faults."""
+
+    def __init__(self, faults: Faults | None = None):
+        self.faults = faults or Faults("firestore")
+        self.lock = threading.Lock()
+        self.documents: dict[str, dict] = {}
+
+    def call(self):
+        if self.faults.hit():
+            raise ServiceUnavailable("Injected fake Firestore error")
+
+    def collection(self, name: str) -> FakeCollection:
+        return FakeCollection(self, name)
+
+
+# --- Auth ---
+
+class FakeAuth:
+    """verify_id_token of firebase_admin.auth, accepting "fake-<uid>" tokens."""
+
+    def __init__(self, faults: Faults | None = None):
+        self.faults = faults or Faults("auth")
+
+    def verify_id_token(self, id_token: str, app=None, check_revoked: bool = False, clock_skew_seconds: int = 0) -> dict:
+        from firebase_admin import auth
+
+        if self.faults.hit():
+            raise auth.CertificateFetchError("Injected fake auth error", None)
+        if not id_token.startswith(FAKE_TOKEN_PREFIX) or len(id_token) == len(FAKE_TOKEN_PREFIX):
+            raise auth.InvalidIdTokenError(f'Fake ID tokens look like "{FAKE_TOKEN_PREFIX}<uid>"')
+        uid = id_token[len(FAKE_TOKEN_PREFIX):]
+        return {"uid": uid, "sub": uid, "exp": time.time() + FAKE_TOKEN_LIFETIME}
+
+
+# --- Gemini ---
+
+def _fake_response(contents, config) -> types.GenerateContentResponse:
+    """The first image of the request back for image requests, FAKE_PROMPT for text ones."""
+    answer = types.Part(text=FAKE_PROMPT)
+    if config is not None and "IMAGE" in (config.response_modalities or []):
+        for part in contents:
+            if isinstance(part, types.Part) and part.inline_data is not None:
+                answer = types.Part(inline_data=types.Blob(data=part.inline_data.data, mime_type=part.inline_data.mime_type))
+                break
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(content=types.Content(role="model", parts=[answer]))],
+    )
+
+
+def _fake_error() -> errors.APIError:
+    return errors.ServerError(503, {"error": {"code": 503, "message": "Injected fake Gemini error", "status": "UNAVAILABLE"}})
+
+
+class _FakeModels:
+    def __init__(self, faults: Faults):
+        self.faults = faults
+
+    def generate_content(self, *, model: str, contents, config=None) -> types.GenerateContentResponse:
+        if self.faults.hit():
+            raise _fake_error()
+        return _fake_response(contents, config)
+
+
+class _FakeAsyncModels:
+    def __init__(self, faults: Faults):
+        self.faults = faults
+
+    async def generate_content(self, *, model: str, contents, config=None) -> types.GenerateContentResponse:
+        if await self.faults.ahit():
+            raise _fake_error()
+        return _fake_response(contents, config)
+
+
+class FakeGenaiClient:
+    """The parts of genai.Client that ResilientGemini uses, behind the gemini faults."""
+
+    def __init__(self, faults: Faults | None = None):
+        self.faults = faults or Faults("gemini")
+        self.models = _FakeModels(self.faults)
+        self.aio = pytypes.SimpleNamespace(models=_FakeAsyncModels(self.faults))
+
+
+def serve_gemini(faults: Faults | None = None, port: int = 0) -> str:
+    """Serve generateContent of the Gemini REST API on a local port, behind the gemini
+    faults, answering as FakeGenaiClient does. Returns the base URL for genai's
+    http_options (or SNAPREADY_GEMINI_BASE_URL).
+    """
+    faults = faults or Faults("gemini")
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, body: dict):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not urlsplit(self.path).path.endswith(":generateContent"):
+                self._reply(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+                return
+            if faults.hit():
+                self._reply(503, {"error": {"code": 503, "message": "Injected fake Gemini error", "status": "UNAVAILABLE"}})
+                return
+            answer = {"text": FAKE_PROMPT}
+            if "IMAGE" in request.get("generationConfig", {}).get("responseModalities", []):
+                for content in request.get("contents", []):
+                    image = next((part for part in content.get("parts", []) if "inlineData" in part), None)
+                    if image is not None:
+                        answer = {"inlineData": image["inlineData"]}
+                        break
+            self._reply(200, {"candidates": [{"content": {"role": "model", "parts": [answer]}}]})
+
+        def log_message(self, format, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+        request_queue_size = 128
+
+    server = Server(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, name="fake-gemini", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+
+# --- Redis ---
+
+class FakeRedis:
+    """The Redis commands the job-state store uses, on dicts: strings, hashes,
+    expiry, and MULTI/EXEC with WATCH.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data: dict[bytes, bytes | dict[bytes, bytes]] = {}
+        self.expires: dict[bytes, float] = {}
+        self.versions: dict[bytes, int] = {}  # bumped on every write, for WATCH
+
+    def _live(self, key: bytes):
+        if key in self.expires and self.expires[key] <= time.monotonic():
+            self._drop(key)
+        return self.data.get(key)
+
+    def _drop(self, key: bytes) -> bool:
+        self.expires.pop(key, None)
+        self._touch(key)
+        return self.data.pop(key, None) is not None
+
+    def _touch(self, key: bytes):
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def _hash(self, key: bytes) -> dict[bytes, bytes]:
+        value = self._live(key)
+        if value is None:
+            return {}
+        if not isinstance(value, dict):
+            raise ValueError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def execute(self, name: str, args: list[bytes]):
+        """Run one command with the lock held. Returns its reply; raises ValueError for an error reply."""
+        if name == "PING":
+            return b"PONG"
+        if name in ("SELECT", "CLIENT"):
+            return b"OK"
+        if name == "GET":
+            value = self._live(args[0])
+            if isinstance(value, dict):
+                raise ValueError("WRONGTYPE Operation against a key holding the wrong kind of value")
+            return value
+        if name == "SET":
+            self.data[args[0]] = args[1]
+            self.expires.pop(args[0], None)
+            if len(args) >= 4 and args[2].upper() == b"EX":
+                self.expires[args[0]] = time.monotonic() + int(args[3])
+            self._touch(args[0])
+            return b"OK"
+        if name == "DEL":
+            return sum(self._drop(key) for key in args if self._live(key) is not None)
+        if name == "EXISTS":
+            return sum(self._live(key) is not None for key in args)
+        if name == "EXPIRE":
+            if self._live(args[0]) is None:
+                return 0
+            self.expires[args[0]] = time.monotonic() + int(args[1])
+            return 1
+        if name == "HGETALL":
+            return [item for pair in self._hash(args[0]).items() for item in pair]
+        if name == "HSET":
+            values = self._hash(args[0])
+            added = sum(field not in values for field in args[1::2])
+            values.update(zip(args[1::2], args[2::2]))
+            self.data[args[0]] = values
+            self._touch(args[0])
+            return added
+        if name == "HDEL":
+            values = self._hash(args[0])
+            removed = sum(values.pop(field, None) is not None for field in args[1:])
+            if not values:
+                self._drop(args[0])
+            self._touch(args[0])
+            return removed
+        raise ValueError(f"ERR unknown command '{name}'")
+
+
+def _resp(reply) -> bytes:
+    if isinstance(reply, ValueError):
+        return b"-" + str(reply).encode() + b"\r\n"
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, bytes):
+        if reply in (b"OK", b"PONG", b"QUEUED"):
+            return b"+" + reply + b"\r\n"
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    return b"*%d\r\n" % len(reply) + b"".join(_resp(item) for item in reply)
+
+
+def serve_redis(redis: FakeRedis | None = None, port: int = 0) -> str:
+    """Serve a FakeRedis over RESP2 on a local port. Returns its redis:// URL."""
+    redis = redis or FakeRedis()
+
+    class Handler(StreamRequestHandler):
+        def _command(self) -> list[bytes] | None:
+            line = self.rfile.readline()
+            if not line:
+                return None
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+            return args
+
+        def handle(self):
+            watched: dict[bytes, int] = {}
+            queued: list[list[bytes]] | None = None
+            while (command := self._command()) is not None:
+                name, args = command[0].decode().upper(), command[1:]
+                with redis.lock:
+                    if name == "WATCH":
+                        watched.update((key, redis.versions.get(key, 0)) for key in args)
+                        reply = b"OK"
+                    elif name == "UNWATCH":
+                        watched.clear()
+                        reply = b"OK"
+                    elif name == "MULTI":
+                        queued = []
+                        reply = b"OK"
+                    elif name == "DISCARD":
+                        queued = None
+                        watched.clear()
+                        reply = b"OK"
+                    elif name == "EXEC":
+                        if any(redis.versions.get(key, 0) != version for key, version in watched.items()):
+                            reply = None  # a watched key changed: the transaction is dropped
+                        else:
+                            reply = []
+                            for queued_name, queued_args in queued or []:
+                                try:
+                                    reply.append(redis.execute(queued_name, queued_args))
+                                except ValueError as e:
+                                    reply.append(e)
+                        queued = None
+                        watched.clear()
+                    elif queued is not None:
+                        queued.append((name, args))
+                        reply = b"QUEUED"
+                    else:
+                        try:
+                            reply = redis.execute(name, args)
+                        except ValueError as e:
+                            reply = e
+                if name == "EXEC" and reply is None:
+                    self.wfile.write(b"*-1\r\n")
+                else:
+                    self.wfile.write(_resp(reply))
+
+    class Server(ThreadingTCPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+
+    server = Server(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, name="fake-redis", daemon=True).start()
+    return f"redis://127.0.0.1:{server.server_address[1]}/0"
+
+
+if __name__ == "__main__":
+    servers = {"gemini": (serve_gemini, "SNAPREADY_GEMINI_BASE_URL"), "redis": (serve_redis, "SNAPREADY_REDIS_URL")}
+    if len(sys.argv) < 2 or sys.argv[1] not in servers:
+        sys.exit("usage: python fakes.py {gemini,redis} [port]")
+    serve, variable = servers[sys.argv[1]]
+    url = serve(port=int(sys.argv[2]) if len(sys.argv) > 2 else 0)
+    print(f"[fakes] Fake {sys.argv[1]} at {url}; set {variable}={url}")
+    threading.Event().wait()
@@ -1,137 +1,197 @@
 """Feedback rating and prompt improvement pipeline."""
 
-import json
 import base64
+import io
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
 
-from retouch import PROMPTS, _get_client
+from google.genai import types
+from PIL import Image
+
+from prompts import prompt_registry
+from ratings import RatingsStore
+from gemini import get_gemini
+from retouch import PROMPTS
 
 UPLOAD_DIR = Path(__file__).parent / "uploads"
-OVERRIDES_PATH = Path(__file__).parent / "prompt_overrides.json"
 
 BAD_THRESHOLD = 5
 BAD_RATIO = 0.6
 MAX_PAIRS = 3
 
+# Bad ratings arriving within this window share one critic run
+ANALYSIS_DEBOUNCE_SECONDS = float(os.environ.get("SNAPREADY_ANALYSIS_DEBOUNCE", 30))
+# Critic inputs: longest side in pixels, and JPEG size budget per image
+CRITIC_IMAGE_SIZE = int(os.environ.get("SNAPREADY_CRITIC_IMAGE_SIZE", 512))
+CRITIC_IMAGE_BYTES = int(os.environ.get("SNAPREADY_CRITIC_IMAGE_BYTES", 60_000))
+
+# One critic call at a time, off the event loop
+_analysis_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="analysis")
+_analysis_lock = threading.Lock()
+_analyses: dict[str, dict] = {}  # "intensity:vN" -> latest run state
+
 REFUSAL_PHRASES = ["i can't", "i cannot", "i'm unable", "as an ai"]
 
 
-def save_rating(job_id: str, rating: str) -> dict:
-    """Write rating.json into uploads/{job_id}/."""
+_ratings: RatingsStore | None = None
+_ratings_lock = threading.Lock()
+
+
+def _ratings_store() -> RatingsStore:
+    """Open the ratings store on first use, importing any legacy rating.json files."""
+    global _ratings
+    with _ratings_lock:
+        if _ratings is None:
+            store = RatingsStore()
+            if UPLOAD_DIR.exists():
+                store.import_legacy(UPLOAD_DIR)
+            _ratings = store
+        return _ratings
+
+
+def save_rating(job_id: str, rating: str, intensity: str | None = None, prompt_version: int | None = None) -> dict:
+    """Record a rating for a job.
+
+    intensity and prompt_version describe how the rated image was made;
+    when not given they are read from the job dir, defaulting to medium/1.
+    """
     job_dir = UPLOAD_DIR / job_id
     if not job_dir.exists():
         raise FileNotFoundError(f"Job {job_id} not found")
 
-    intensity_file = job_dir / "intensity.txt"
-    intensity = intensity_file.read_text().strip() if intensity_file.exists() else "medium"
+    if intensity is None:
+        intensity_file = job_dir / "intensity.txt"
+        intensity = intensity_file.read_text().strip() if intensity_file.exists() else "medium"
 
-    version_file = job_dir / "prompt_version.txt"
-    prompt_version = int(version_file.read_text().strip()) if version_file.exists() else 1
+    if prompt_version is None:
+        version_file = job_dir / "prompt_version.txt"
+        prompt_version = int(version_file.read_text().strip()) if version_file.exists() else 1
 
-    record = {
+    now = datetime.now(timezone.utc)
+    _ratings_store().record(job_id, intensity, prompt_version, rating, now.timestamp())
+    return {
         "job_id": job_id,
         "intensity": intensity,
         "rating": rating,
-        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "timestamp": now.isoformat(),
         "prompt_version": prompt_version,
     }
-    (job_dir / "rating.json").write_text(json.dumps(record, indent=2))
-    return record
-
-
-def load_all_ratings() -> list[dict]:
-    """Read all rating.json files across jobs."""
-    ratings = []
-    if not UPLOAD_DIR.exists():
-        return ratings
-    for rating_file in UPLOAD_DIR.glob("*/rating.json"):
-        try:
-            ratings.append(json.loads(rating_file.read_text()))
-        except (json.JSONDecodeError, OSError):
-            continue
-    return ratings
 
 
 def get_current_prompt_version() -> int:
-    """Read version from prompt_overrides.json (default 1)."""
-    if not OVERRIDES_PATH.exists():
-        return 1
-    try:
-        data = json.loads(OVERRIDES_PATH.read_text())
-        return data.get("version", 1)
-    except (json.JSONDecodeError, OSError):
-        return 1
+    """Current prompt version (default 1)."""
+    return prompt_registry.version()
 
 
 def get_active_prompt(intensity: str) -> str:
     """Return override prompt if exists, else hardcoded default."""
     default = PROMPTS.get(intensity, PROMPTS["medium"])
-    if not OVERRIDES_PATH.exists():
-        return default
-    try:
-        data = json.loads(OVERRIDES_PATH.read_text())
-        override = data.get("prompts", {}).get(intensity)
-        return override if override else default
-    except (json.JSONDecodeError, OSError):
-        return default
+    return prompt_registry.prompt(intensity) or default
 
 
 def get_feedback_stats() -> dict:
     """Return good/bad counts per intensity."""
-    ratings = load_all_ratings()
-    stats = {}
-    for r in ratings:
-        intensity = r.get("intensity", "unknown")
-        if intensity not in stats:
-            stats[intensity] = {"good": 0, "bad": 0}
-        if r.get("rating") == "good":
-            stats[intensity]["good"] += 1
-        elif r.get("rating") == "bad":
-            stats[intensity]["bad"] += 1
-    return stats
-
-
-def check_and_trigger_analysis() -> dict | None:
-    """Scan ratings and trigger analysis if threshold met. Returns result or None."""
-    ratings = load_all_ratings()
-    current_version = get_current_prompt_version()
-
-    # Group by intensity+version
-    groups: dict[str, list[dict]] = {}
-    for r in ratings:
-        key = f"{r.get('intensity')}:v{r.get('prompt_version', 1)}"
-        groups.setdefault(key, []).append(r)
-
-    for key, group in groups.items():
-        intensity, version_str = key.split(":")
-        version = int(version_str[1:])
-
-        # Skip if already upgraded past this version
-        if version < current_version:
-            continue
+    return _ratings_store().counts_by_intensity()
 
-        bad = [r for r in group if r.get("rating") == "bad"]
-        good = [r for r in group if r.get("rating") == "good"]
-        total = len(bad) + len(good)
 
-        if len(bad) < BAD_THRESHOLD:
+def _eligible_groups() -> list[tuple[str, int]]:
+    """(intensity, prompt_version) groups at the current version whose bad ratings meet the threshold."""
+    store = _ratings_store()
+    groups = []
+    # Groups already upgraded past their version are skipped
+    for intensity, version, good, bad in store.group_counts(min_version=get_current_prompt_version()):
+        total = bad + good
+
+        if bad < BAD_THRESHOLD:
             continue
-        if total > 0 and len(bad) / total < BAD_RATIO:
+        if total > 0 and bad / total < BAD_RATIO:
             continue
-
-        # Threshold met — analyze
-        bad_job_ids = [r["job_id"] for r in bad[:MAX_PAIRS]]
-        result = _analyze_failures(intensity, bad_job_ids)
-        if result:
-            return result
-
-    return None
-
-
-def _analyze_failures(intensity: str, bad_job_ids: list[str]) -> dict | None:
-    """Send before/after pairs to Gemini as critic, return improved prompt."""
+        groups.append((intensity, version))
+    return groups
+
+
+def request_analysis(delay: float = ANALYSIS_DEBOUNCE_SECONDS) -> dict:
+    """Schedule a critic run for every group over the bad-rating threshold. Returns analysis_status().
+
+    Runs are single-flight per (intensity, version): requests made while
+    one is pending or running join it. A run starts delay seconds after it
+    is first requested, so a burst of bad ratings costs one critic call.
+    delay=0 starts a pending run right away.
+    """
+    for intensity, version in _eligible_groups():
+        key = f"{intensity}:v{version}"
+        with _analysis_lock:
+            state = _analyses.get(key)
+            if state is not None and state["status"] in ("running", "updated"):
+                continue
+            if state is not None and state["status"] == "pending":
+                if delay > 0:
+                    continue
+                # A timer that already fired can't be cancelled; _start_analysis
+                # sees the run was replaced and drops it
+                state["timer"].cancel()
+            state = {
+                "intensity": intensity,
+                "prompt_version": version,
+                "status": "pending",
+                "requested_at": datetime.now(timezone.utc).isoformat(),
+            }
+            state["timer"] = threading.Timer(delay, _start_analysis, (key, state))
+            state["timer"].daemon = True
+            _analyses[key] = state
+            state["timer"].start()
+    return analysis_status()
+
+
+def _start_analysis(key: str, state: dict):
+    """Hand a pending run to the analysis thread, unless a newer request replaced it."""
+    with _analysis_lock:
+        if _analyses.get(key) is not state or state["status"] != "pending":
+            return
+        # Running from here on, so requests made while it waits for the thread join it
+        state["status"] = "running"
+    _analysis_executor.submit(_run_analysis, key, state["intensity"], state["prompt_version"])
+
+
+def analysis_status() -> dict:
+    """State of each group's latest analysis, keyed "intensity:vN"."""
+    with _analysis_lock:
+        return {
+            key: {k: v for k, v in state.items() if k != "timer"}
+            for key, state in _analyses.items()
+        }
+
+
+def _set_analysis(key: str, **fields):
+    with _analysis_lock:
+        _analyses[key].update(fields)
+
+
+def _run_analysis(key: str, intensity: str, version: int):
+    _set_analysis(key, status="running", started_at=datetime.now(timezone.utc).isoformat())
+    result, error = None, None
+    try:
+        # Ratings may have moved, or another process upgraded the prompt, since this was requested
+        if (intensity, version) in _eligible_groups():
+            bad_job_ids = _ratings_store().recent_job_ids(intensity, version, "bad", MAX_PAIRS)
+            result = _analyze_failures(intensity, bad_job_ids, version)
+    except Exception as e:
+        print(f"[feedback] Analysis failed: {e}")
+        error = str(e)
+    _set_analysis(
+        key,
+        status="failed" if error else "updated" if result else "no_action",
+        finished_at=datetime.now(timezone.utc).isoformat(),
+        result=result,
+        error=error,
+    )
+
+
+def _analyze_failures(intensity: str, bad_job_ids: list[str], version: int) -> dict | None:
+    """Send before/after pairs to Gemini as critic, return improved prompt. Raises if the call fails."""
     current_prompt = get_active_prompt(intensity)
 
     # Build content parts for Gemini
@@ -166,63 +226,48 @@ def _analyze_failures(intensity: str, bad_job_ids: list[str]) -> dict | None:
     if pairs_found == 0:
         return None
 
-    try:
-        client = _get_client()
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=content_parts,
-        )
-        new_prompt = response.text.strip().strip('"').strip("'")
-
-        # Validate
-        if len(new_prompt) < 30:
-            return None
-        if any(phrase in new_prompt.lower() for phrase in REFUSAL_PHRASES):
-            return None
+    response = get_gemini().generate_content(
+        model="gemini-2.5-flash",
+        contents=content_parts,
+    )
+    new_prompt = response.text.strip().strip('"').strip("'")
 
-        return _save_override(intensity, new_prompt, bad_job_ids)
-    except Exception as e:
-        print(f"[feedback] Analysis failed: {e}")
+    # Validate
+    if len(new_prompt) < 30:
+        return None
+    if any(phrase in new_prompt.lower() for phrase in REFUSAL_PHRASES):
         return None
 
+    return _save_override(intensity, new_prompt, bad_job_ids, version)
 
-def _load_image_for_gemini(path: Path):
-    """Load image file for Gemini API content."""
-    from PIL import Image
-    return Image.open(path).convert("RGB")
 
+def _load_image_for_gemini(path: Path) -> types.Part:
+    """Downscale an image and JPEG-encode it within CRITIC_IMAGE_BYTES for the critic.
 
-def _save_override(intensity: str, new_prompt: str, trigger_jobs: list[str]) -> dict:
-    """Write prompt_overrides.json with version bump."""
-    if OVERRIDES_PATH.exists():
-        try:
-            data = json.loads(OVERRIDES_PATH.read_text())
-        except (json.JSONDecodeError, OSError):
-            data = {}
-    else:
-        data = {}
+    The critic judges retouching style, which survives downscaling; full
+    1200px pairs only add upload size and latency.
+    """
+    img = Image.open(path)
+    img.draft("RGB", (CRITIC_IMAGE_SIZE, CRITIC_IMAGE_SIZE))
+    img = img.convert("RGB")
+    img.thumbnail((CRITIC_IMAGE_SIZE, CRITIC_IMAGE_SIZE), Image.LANCZOS)
+    for quality in (85, 75, 65, 55, 45, 35):
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=quality)
+        if buf.tell() <= CRITIC_IMAGE_BYTES:
+            break
+    return types.Part.from_bytes(data=buf.getvalue(), mime_type="image/jpeg")
 
-    prompts = data.get("prompts", {"light": None, "medium": None, "strong": None})
-    history = data.get("history", [])
-    version = data.get("version", 1) + 1
 
-    old_prompt = prompts.get(intensity)
-    prompts[intensity] = new_prompt
+def _save_override(intensity: str, new_prompt: str, trigger_jobs: list[str], based_on_version: int) -> dict | None:
+    """Save a new override with a version bump; every process picks it up on its next lookup.
 
-    history.append({
-        "version": version,
-        "intensity": intensity,
-        "old_prompt": old_prompt,
-        "new_prompt": new_prompt,
-        "trigger_jobs": trigger_jobs,
-        "timestamp": datetime.now(timezone.utc).isoformat(),
-    })
-
-    data = {
-        "version": version,
-        "prompts": prompts,
-        "history": history,
-    }
-    OVERRIDES_PATH.write_text(json.dumps(data, indent=2))
+    Returns None without saving if the version moved on since the analysis
+    started (e.g. another process saved an override first).
+    """
+    version = prompt_registry.save_override(intensity, new_prompt, trigger_jobs, expected_version=based_on_version)
+    if version is None:
+        print(f"[feedback] Discarded '{intensity}' override based on stale v{based_on_version}")
+        return None
     print(f"[feedback] Prompt override saved for '{intensity}' (v{version})")
     return {"intensity": intensity, "version": version, "new_prompt": new_prompt}
@@ -334,15 +334,16 @@ function addJobToGallery(jobId, jobStatus, jobData = null, localDataUrl = null)
   itemDiv.className = `gallery-item ${jobStatus}`;
   itemDiv.id = `job-${jobId}`;
 
-  const thumbUrl = (jobStatus === "completed" && jobData && jobData.retouched_url)
-    ? jobData.retouched_url
+  // Gallery tiles use the small WebP thumbnail; older jobs only have the full image
+  const thumbUrl = (jobStatus === "completed" && jobData && (jobData.thumb_url || jobData.retouched_url))
+    ? (jobData.thumb_url || jobData.retouched_url)
     : (localDataUrl || "data:image/svg+xml,%3Csvg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 24 24'%3E%3Crect width='24' height='24' fill='%231a1a1a'/%3E%3C/svg%3E");
 
   itemDiv.innerHTML = `
     <img src="${thumbUrl}" alt="Job ${jobId}">
     <div class="status-badge ${jobStatus}">${jobStatus}</div>
     <button class="gallery-delete-btn" title="Delete">&times;</button>
-    ${jobStatus === 'processing' || jobStatus === 'unknown' ? '<div class="loader-bar"></div>' : ''}
+    ${jobStatus === 'processing' || jobStatus === 'queued' || jobStatus === 'unknown' ? '<div class="loader-bar"></div>' : ''}
   `;
 
   // Wire up delete button
@@ -379,8 +380,8 @@ function updateGalleryItem(jobId, status, jobData = null, localDataUrl = null) {
 
   if (status === "completed") {
     if (loaderBar) loaderBar.remove();
-    if (img && jobData && jobData.retouched_url) {
-      img.src = jobData.retouched_url + `?t=${Date.now()}`; // bust cache
+    if (img && jobData && (jobData.thumb_url || jobData.retouched_url)) {
+      img.src = (jobData.thumb_url || jobData.retouched_url) + `?t=${Date.now()}`; // bust cache
     }
     itemDiv.classList.add("clickable");
     itemDiv.onclick = () => {
@@ -391,11 +392,16 @@ function updateGalleryItem(jobId, status, jobData = null, localDataUrl = null) {
     if (loaderBar) loaderBar.remove();
     itemDiv.classList.remove("clickable");
     itemDiv.onclick = null;
-  } else if (status === "processing" || status === "unknown") {
+  } else if (status === "processing" || status === "queued" || status === "unknown") {
     itemDiv.classList.remove("clickable");
     itemDiv.onclick = null;
     badge.textContent = "Processing...";
     if (localDataUrl && img) img.src = localDataUrl;
+    // Show the framed crop as soon as the server has published it
+    else if (img && jobData && jobData.preview_url && img.dataset.preview !== jobData.preview_url) {
+      img.dataset.preview = jobData.preview_url;
+      img.src = jobData.preview_url + `?t=${Date.now()}`;
+    }
   }
 }
 
@@ -435,47 +441,125 @@ async function deleteJob(jobId, itemDiv) {
   }
 }
 
-async function pollJob(jobId) {
-  if (!currentUser) return;
+/* ---- Job status stream ---- */
+// Server-side pipeline stages, all shown as "processing"
+const PIPELINE_STAGES = ["cropping", "retouching", "uploading"];
+
+function displayStatus(status) {
+  return PIPELINE_STAGES.includes(status) ? "processing" : status;
+}
+
+// Follow a job's status until it completes or fails. Reads the SSE stream with
+// fetch (EventSource can't send the Authorization header) and falls back to
+// polling /status every 2 s if the stream is unavailable.
+// onUpdate(data) gets each state; onMissing() is called if the job doesn't exist.
+// Aborting signal stops the watch, closing the stream and any polling. With
+// renderId, states of an earlier run (another render id) are skipped.
+async function watchJob(jobId, onUpdate, onMissing = () => {}, watch = {}) {
+  const { signal } = watch;
+  if (!currentUser || signal?.aborted) return;
 
   try {
     const token = await currentUser.getIdToken();
-    const resp = await fetch(`${API_BASE_URL}/status/${jobId}`, {
-      headers: { "Authorization": `Bearer ${token}` }
+    const resp = await fetch(`${API_BASE_URL}/status/${jobId}/stream`, {
+      headers: { "Authorization": `Bearer ${token}`, "Accept": "text/event-stream" },
+      signal
     });
-
-    // If the backend says 404, the job files were deleted (e.g. Render server restarted)
     if (resp.status === 404) {
-      updateGalleryItem(jobId, "expired", null);
-
-      // Remove from history
-      const jobs = JobHistory.get().filter(id => id !== jobId);
-      localStorage.setItem('snapready_jobs', JSON.stringify(jobs));
-
-      // Remove from UI after a brief delay
-      setTimeout(() => {
-        const item = document.getElementById(`job-${jobId}`);
-        if (item) item.remove();
-
-        // Hide section if empty
-        if (JobHistory.get().length === 0) {
-          document.getElementById("gallery-section").hidden = true;
-        }
-      }, 2000);
+      onMissing();
       return;
     }
+    if (!resp.ok || !resp.body) throw new Error(`stream unavailable (${resp.status})`);
+
+    const reader = resp.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = "";
+    let last = null;
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += value;
+      let boundary;
+      while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+        const message = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        const dataLine = message.split("\n").find(line => line.startsWith("data:"));
+        if (!dataLine) continue; // keepalive comment
+        const data = JSON.parse(dataLine.slice(5));
+        if (!ofRun(data, watch)) continue;
+        last = data;
+        onUpdate(last);
+      }
+    }
+    // Stream ended without a final state (server restart, proxy timeout): keep watching
+    if (!last || (last.status !== "completed" && last.status !== "failed")) {
+      setTimeout(() => watchJob(jobId, onUpdate, onMissing, watch), 2000);
+    }
+  } catch (e) {
+    if (signal?.aborted) return;
+    console.warn("Status stream failed, polling instead", e);
+    pollStatus(jobId, onUpdate, onMissing, watch);
+  }
+}
 
-    if (!resp.ok) return;
-    const data = await resp.json();
+// Whether a job state belongs to the run being watched
+function ofRun(data, { renderId } = {}) {
+  return !renderId || !data.render_id || data.render_id === renderId;
+}
 
-    updateGalleryItem(jobId, data.status, data);
+async function pollStatus(jobId, onUpdate, onMissing, watch = {}) {
+  const { signal } = watch;
+  if (!currentUser || signal?.aborted) return;
 
-    if (data.status === "processing") {
-      setTimeout(() => pollJob(jobId), 2000);
+  try {
+    const token = await currentUser.getIdToken();
+    const resp = await fetch(`${API_BASE_URL}/status/${jobId}`, {
+      headers: { "Authorization": `Bearer ${token}` },
+      signal
+    });
+    if (resp.status === 404) {
+      onMissing();
+      return;
+    }
+    if (resp.ok) {
+      const data = await resp.json();
+      if (ofRun(data, watch)) {
+        onUpdate(data);
+        if (data.status === "completed" || data.status === "failed") return;
+      }
     }
   } catch (e) {
+    if (signal?.aborted) return;
     console.warn("Polling error", e);
   }
+  setTimeout(() => pollStatus(jobId, onUpdate, onMissing, watch), 2000);
+}
+
+function pollJob(jobId) {
+  // The latest preview seen, since later stage events don't repeat it
+  let previewUrl = null;
+
+  watchJob(jobId, (data) => {
+    previewUrl = data.preview_url || previewUrl;
+    updateGalleryItem(jobId, displayStatus(data.status), { ...data, preview_url: previewUrl });
+  }, () => {
+    // If the backend says 404, the job files were deleted (e.g. Render server restarted)
+    updateGalleryItem(jobId, "expired", null);
+
+    // Remove from history
+    const jobs = JobHistory.get().filter(id => id !== jobId);
+    localStorage.setItem('snapready_jobs', JSON.stringify(jobs));
+
+    // Remove from UI after a brief delay
+    setTimeout(() => {
+      const item = document.getElementById(`job-${jobId}`);
+      if (item) item.remove();
+
+      // Hide section if empty
+      if (JobHistory.get().length === 0) {
+        document.getElementById("gallery-section").hidden = true;
+      }
+    }, 2000);
+  });
 }
 
 /* ---- Result Page Init ---- */
@@ -511,6 +595,10 @@ async function initResultPage() {
     if (data.cropped_url && data.retouched_url) {
       beforeImg.src = data.cropped_url + "?t=" + new Date().getTime();
       afterImg.src = data.retouched_url + "?t=" + new Date().getTime();
+    } else if (data.preview_url) {
+      // Still retouching: show the framed crop while we wait
+      beforeImg.src = data.preview_url + "?t=" + new Date().getTime();
+      afterImg.src = beforeImg.src;
     }
 
     // ALWAYS restore controls from backend data if available
@@ -533,8 +621,8 @@ async function initResultPage() {
       // Update download link
       const dlLink = document.getElementById("download-btn");
       dlLink.href = `${API_BASE_URL}/download/${jobId}?token=${token}`;
-    } else if (data.status === "processing") {
-      pollResultPage(jobId);
+    } else if (data.status === "processing" || data.status === "queued") {
+      watchResultPage(jobId, spinner, beforeImg, afterImg);
     } else if (data.status === "failed") {
       spinner.classList.remove("active");
       alert("This job failed to process.");
@@ -545,6 +633,28 @@ async function initResultPage() {
   }
 }
 
+// Wait for a job opened while still processing, then show its result
+function watchResultPage(jobId, spinner, beforeImg, afterImg) {
+  watchJob(jobId, async (data) => {
+    if (data.status === "completed") {
+      spinner.classList.remove("active");
+      if (data.cropped_url && data.retouched_url) {
+        beforeImg.src = data.cropped_url + "?t=" + new Date().getTime();
+        afterImg.src = data.retouched_url + "?t=" + new Date().getTime();
+      }
+      const token = await currentUser.getIdToken();
+      const dlLink = document.getElementById("download-btn");
+      dlLink.href = `${API_BASE_URL}/download/${jobId}?token=${token}`;
+    } else if (data.status === "failed") {
+      spinner.classList.remove("active");
+      alert("This job failed to process.");
+    } else if (data.preview_url) {
+      beforeImg.src = data.preview_url + "?t=" + new Date().getTime();
+      afterImg.src = beforeImg.src;
+    }
+  });
+}
+
 /* ---- Comparison Slider ---- */
 function initComparisonSlider() {
   const container = document.getElementById("comparison");
@@ -589,7 +699,7 @@ function initIntensityReprocess() {
   const beforeImg = document.getElementById("before-img");
   const afterImg = document.getElementById("after-img");
   let reprocessTimeout;
-  let pollingInterval;
+  let reprocessWatch = null;
 
   // --- Intensity radios: immediate reprocess ---
   intensityControls.forEach((radio) => {
@@ -652,8 +762,8 @@ function initIntensityReprocess() {
         body: formData,
         headers: { "Authorization": `Bearer ${token}` }
       });
+      const data = await resp.json();
       if (!resp.ok) {
-        const data = await resp.json();
         throw new Error(data.detail || "Reprocessing failed");
       }
 
@@ -664,7 +774,7 @@ function initIntensityReprocess() {
       window.history.replaceState({}, '', newUrl);
 
       // Start polling for completion
-      startPollingReprocess(jobId, spinner, beforeImg, afterImg);
+      startPollingReprocess(jobId, spinner, beforeImg, afterImg, data.render_id);
 
       // Reset feedback
       resetFeedbackUI();
@@ -679,17 +789,14 @@ function initIntensityReprocess() {
     }
   }
 
-  async function startPollingReprocess(jobId, spinner, beforeImg, afterImg) {
-    if (pollingInterval) clearTimeout(pollingInterval);
-    if (!currentUser) return;
+  function startPollingReprocess(jobId, spinner, beforeImg, afterImg, renderId) {
+    // A newer reprocess supersedes the stream of the previous one: close it
+    reprocessWatch?.abort();
+    const watch = new AbortController();
+    reprocessWatch = watch;
 
-    try {
-      const token = await currentUser.getIdToken();
-      const resp = await fetch(`${API_BASE_URL}/status/${jobId}`, {
-        headers: { "Authorization": `Bearer ${token}` }
-      });
-      if (!resp.ok) return;
-      const data = await resp.json();
+    watchJob(jobId, (data) => {
+      if (watch.signal.aborted) return;
 
       if (data.status === "completed") {
         spinner.classList.remove("active");
@@ -708,13 +815,8 @@ function initIntensityReprocess() {
       } else if (data.status === "failed") {
         spinner.classList.remove("active");
         alert("Reprocessing failed: " + data.error);
-      } else {
-        pollingInterval = setTimeout(() => startPollingReprocess(jobId, spinner, beforeImg, afterImg), 2000);
       }
-    } catch (e) {
-      console.warn("Polling error", e);
-      spinner.classList.remove("active");
-    }
+    }, undefined, { signal: watch.signal, renderId });
   }
 }
 
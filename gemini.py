@@ -0,0 +1,478 @@
+"""Gemini client wrapper: per-call deadlines, retries with jitter, rate and concurrency limits,
+optional hedged requests, and a circuit breaker.
+
+Point SNAPREADY_GEMINI_BASE_URL at a local server speaking the Gemini REST
+API to exercise all of this without the real service.
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import httpx
+from google import genai
+from google.genai import errors, types
+
+from metrics import span
+
+GEMINI_BASE_URL = os.environ.get("SNAPREADY_GEMINI_BASE_URL")
+GEMINI_TIMEOUT = float(os.environ.get("SNAPREADY_GEMINI_TIMEOUT", 120))  # seconds per attempt, from when it is sent
+GEMINI_RETRIES = int(os.environ.get("SNAPREADY_GEMINI_RETRIES", 3))
+# Seconds a call may wait for a rate or concurrency slot. Separate from the attempt
+# deadline, so a short backlog queues for the model instead of failing; bounded by
+# how long a call may take itself, since a longer backlog is refused at admission.
+GEMINI_QUEUE_TIMEOUT = float(os.environ.get("SNAPREADY_GEMINI_QUEUE_TIMEOUT", GEMINI_TIMEOUT * (GEMINI_RETRIES + 1)))
+GEMINI_BACKOFF = float(os.environ.get("SNAPREADY_GEMINI_BACKOFF", 1.0))  # first retry waits up to this, doubling
+GEMINI_BACKOFF_MAX = 30.0
+GEMINI_RPM = float(os.environ.get("SNAPREADY_GEMINI_RPM", 60))
+GEMINI_CONCURRENCY = int(os.environ.get("SNAPREADY_GEMINI_CONCURRENCY", 4))
+GEMINI_HEDGE_AFTER = float(os.environ.get("SNAPREADY_GEMINI_HEDGE_AFTER", 0))  # seconds; 0 disables hedging
+GEMINI_BREAKER_FAILURES = int(os.environ.get("SNAPREADY_GEMINI_BREAKER_FAILURES", 5))
+GEMINI_BREAKER_RESET = float(os.environ.get("SNAPREADY_GEMINI_BREAKER_RESET", 30))
+
+# Throttling, timeouts and server-side failures; anything else is the request's fault
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class GeminiUnavailable(RuntimeError):
+    """Gemini was not called: the circuit is open or no rate/concurrency slot freed up in time."""
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, errors.APIError):
+        return error.code in RETRYABLE_STATUS
+    return isinstance(error, (TimeoutError, httpx.TimeoutException, httpx.TransportError))
+
+
+class TokenBucket:
+    """Requests-per-minute limit that allows bursts of up to burst calls."""
+
+    def __init__(self, per_minute: float, burst: int | None = None):
+        self.rate = per_minute / 60.0
+        self.capacity = float(burst or max(1, int(per_minute // 6)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take_locked(self) -> float:
+        """Take a token if one is available; otherwise return seconds until one is."""
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            return self._take_locked() == 0.0
+
+    def acquire(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                wait_for = self._take_locked()
+            if wait_for == 0.0:
+                return True
+            if time.monotonic() + wait_for > deadline:
+                return False
+            time.sleep(wait_for)
+
+    async def aacquire(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                wait_for = self._take_locked()
+            if wait_for == 0.0:
+                return True
+            if time.monotonic() + wait_for > deadline:
+                return False
+            await asyncio.sleep(wait_for)
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures and fails calls fast for reset_seconds.
+
+    After that one trial call is let through (half-open); its outcome closes
+    the circuit or opens it for another reset_seconds. allow() hands out a
+    token so that only the trial's own caller can give the trial up.
+    """
+
+    _CLOSED = object()  # the token of every call admitted while closed
+
+    def __init__(self, failure_threshold: int = GEMINI_BREAKER_FAILURES, reset_seconds: float = GEMINI_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial = None  # token of the half-open trial in flight
+        self._lock = threading.Lock()
+
+    def allow(self) -> object | None:
+        """A token admitting one call, or None if the circuit refuses it."""
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                self._trial = None
+            if self.state == "half_open":
+                if self._trial is not None:
+                    return None
+                self._trial = object()
+                return self._trial
+            return self._CLOSED if self.state == "closed" else None
+
+    def abandon(self, token: object | None):
+        """The call admitted with token ended without an outcome. If it was the trial, let another through."""
+        with self._lock:
+            if token is not None and token is self._trial:
+                self._trial = None
+
+    def retry_after(self) -> float:
+        """Seconds until an open circuit lets a trial through; 0 if it isn't open."""
+        with self._lock:
+            if self.state != "open":
+                return 0.0
+            return max(0.0, self._opened_at + self.reset_seconds - time.monotonic())
+
+    def record(self, ok: bool):
+        with self._lock:
+            self._trial = None
+            if ok:
+                self.state = "closed"
+                self._failures = 0
+                return
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"[gemini] Circuit open after {self._failures} failures")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+class _SlotLease:
+    """One held concurrency slot, released once by the call or by the attempt that gave up on it."""
+
+    def __init__(self, slots: threading.BoundedSemaphore):
+        self._slots = slots
+        self._held = True
+        self._lock = threading.Lock()
+
+    def release(self) -> bool:
+        """Return the slot. False if it was already returned."""
+        with self._lock:
+            if not self._held:
+                return False
+            self._held = False
+        self._slots.release()
+        return True
+
+
+class ResilientGemini:
+    """generate_content with a deadline per attempt, retries and limits around a genai.Client.
+
+    Calls are admitted by a token bucket (requests per minute) and a
+    concurrency limit, waiting up to queue_timeout for both; the attempt's
+    deadline only starts once the request is sent. Calls are retried with full-jitter exponential backoff on
+    throttling, timeouts and 5xx. Consecutive retryable failures open the
+    circuit breaker. With hedge_after set, an attempt that has not answered
+    after that many seconds gets a duplicate request, if the limits have
+    room, and the first answer wins.
+
+    agenerate_content does the same on the SDK's async client, sharing the
+    limits and breaker with threaded callers.
+    """
+
+    def __init__(
+        self,
+        client: genai.Client,
+        timeout: float = GEMINI_TIMEOUT,
+        queue_timeout: float = GEMINI_QUEUE_TIMEOUT,
+        retries: int = GEMINI_RETRIES,
+        backoff: float = GEMINI_BACKOFF,
+        requests_per_minute: float = GEMINI_RPM,
+        concurrency: int = GEMINI_CONCURRENCY,
+        hedge_after: float = GEMINI_HEDGE_AFTER,
+        breaker: CircuitBreaker | None = None,
+    ):
+        self.client = client
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_after = hedge_after
+        self.limiter = TokenBucket(requests_per_minute)
+        self.breaker = breaker or CircuitBreaker()
+        self._concurrency = concurrency
+        self._slots = threading.BoundedSemaphore(concurrency)
+        # Hedged attempts run here; losers finish (or time out) in the background. Requests
+        # an attempt gave up on may still hold a thread, so there is room beyond the slots.
+        self._pool = ThreadPoolExecutor(max_workers=concurrency * 3, thread_name_prefix="gemini") if hedge_after > 0 else None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0  # calls waiting for a concurrency slot or rate token
+        self.counts = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "failures": 0, "rejected": 0, "abandoned": 0}
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counts[name] += n
+
+    def _with_deadline(self, config: types.GenerateContentConfig | None, timeout: float) -> types.GenerateContentConfig:
+        # The SDK's HTTP timeout is the per-attempt deadline
+        http_options = types.HttpOptions(timeout=int(timeout * 1000))
+        if config is None:
+            return types.GenerateContentConfig(http_options=http_options)
+        return config.model_copy(update={"http_options": http_options})
+
+    def _retry_delay(self, error: Exception, attempt: int) -> float | None:
+        """Seconds to back off before the next attempt, or None if error should be raised."""
+        if isinstance(error, GeminiUnavailable):
+            self._count("rejected")
+            return None
+        if not is_retryable(error) or attempt == self.retries:
+            self._count("failures")
+            return None
+        delay = random.uniform(0, min(GEMINI_BACKOFF_MAX, self.backoff * 2 ** attempt))
+        print(f"[gemini] Attempt {attempt + 1} failed ({error or type(error).__name__}); retrying in {delay:.1f}s")
+        self._count("retries")
+        return delay
+
+    def generate_content(self, *, model: str, contents, config: types.GenerateContentConfig | None = None, timeout: float | None = None):
+        """Like client.models.generate_content. Raises GeminiUnavailable when no call could be made."""
+        timeout = timeout or self.timeout
+        config = self._with_deadline(config, timeout)
+        self._count("calls")
+        for attempt in range(self.retries + 1):
+            try:
+                return self._attempt(model, contents, config, timeout)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+
+    async def agenerate_content(self, *, model: str, contents, config: types.GenerateContentConfig | None = None, timeout: float | None = None):
+        """generate_content on the SDK's async client. Waiting for a slot, backoff and the call hold no thread."""
+        timeout = timeout or self.timeout
+        config = self._with_deadline(config, timeout)
+        self._count("calls")
+        for attempt in range(self.retries + 1):
+            try:
+                return await self._aattempt(model, contents, config, timeout)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+
+    def _admit(self) -> object:
+        """Take the circuit breaker's permission for a call whose slot is already held.
+
+        Checked before the rate limit, so a refused call doesn't spend a token.
+        """
+        token = self.breaker.allow()
+        if token is None:
+            self._slots.release()
+            raise GeminiUnavailable("Gemini circuit breaker is open")
+        return token
+
+    def _refuse_rate(self, token: object):
+        self.breaker.abandon(token)
+        self._slots.release()
+        raise GeminiUnavailable("Gemini request rate limit reached")
+
+    def _waiting(self, n: int):
+        with self._lock:
+            self.waiting += n
+
+    def backpressure(self) -> float | None:
+        """Seconds new work should hold off, or None while calls are being admitted.
+
+        Work is refused while the circuit is open, or while more calls wait
+        for room than the limits could start within queue_timeout if each
+        took its full deadline; those would only time out in the queue.
+        """
+        wait = self.breaker.retry_after()
+        if wait > 0:
+            return wait
+        capacity = self._concurrency * self.queue_timeout / self.timeout
+        with self._lock:
+            if self.waiting >= capacity:
+                return self.timeout
+        return None
+
+    def _can_hedge(self) -> bool:
+        return self.breaker.state == "closed" and self.limiter.try_acquire() and self._slots.acquire(blocking=False)
+
+    def _attempt(self, model, contents, config, timeout):
+        queue_deadline = time.monotonic() + self.queue_timeout
+        self._waiting(1)
+        try:
+            if not self._slots.acquire(timeout=self.queue_timeout):
+                raise GeminiUnavailable("No Gemini concurrency slot became free in time")
+            token = self._admit()
+            if not self.limiter.acquire(max(0.0, queue_deadline - time.monotonic())):
+                self._refuse_rate(token)
+        finally:
+            self._waiting(-1)
+
+        if self._pool is None:
+            return self._call(model, contents, config)
+
+        primary_lease = _SlotLease(self._slots)
+        primary = self._pool.submit(self._call, model, contents, config, primary_lease)
+        done, _ = wait([primary], timeout=self.hedge_after)
+        if done:
+            return primary.result()
+        pending = {primary: primary_lease}
+        if self._can_hedge():
+            self._count("hedges")
+            hedge_lease = _SlotLease(self._slots)
+            pending[self._pool.submit(self._call, model, contents, config, hedge_lease)] = hedge_lease
+
+        deadline = time.monotonic() + timeout
+        error = None
+        while pending:
+            done, _ = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                # Threads can't be cancelled, so give the overdue requests' slots back now
+                # instead of when their HTTP timeout finally fires
+                for lease in pending.values():
+                    if lease.release():
+                        self._count("abandoned")
+                raise TimeoutError("Gemini attempt exceeded its deadline")
+            for future in done:
+                del pending[future]
+                if future.exception() is None:
+                    if future is not primary:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    async def _aattempt(self, model, contents, config, timeout):
+        queue_deadline = time.monotonic() + self.queue_timeout
+        pause = 0.01
+        self._waiting(1)
+        try:
+            while not self._slots.acquire(blocking=False):
+                # Slots are shared with threads, so poll instead of awaiting a condition
+                if time.monotonic() + pause > queue_deadline:
+                    raise GeminiUnavailable("No Gemini concurrency slot became free in time")
+                await asyncio.sleep(pause)
+                pause = min(pause * 2, 0.25)
+            token = self._admit()
+            if not await self.limiter.aacquire(max(0.0, queue_deadline - time.monotonic())):
+                self._refuse_rate(token)
+        finally:
+            self._waiting(-1)
+
+        primary = asyncio.ensure_future(self._acall(model, contents, config, token))
+        pending = {primary}
+        try:
+            if self.hedge_after > 0:
+                done, _ = await asyncio.wait(pending, timeout=self.hedge_after)
+                if not done and self._can_hedge():
+                    self._count("hedges")
+                    pending.add(asyncio.ensure_future(self._acall(model, contents, config)))
+
+            deadline = time.monotonic() + timeout
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise TimeoutError("Gemini attempt exceeded its deadline")
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self._count("hedge_wins")
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            # Unlike threads, a losing or overdue request can be cancelled
+            for task in pending:
+                task.cancel()
+
+    def _call(self, model, contents, config, lease: _SlotLease | None = None):
+        """One request. The caller holds a concurrency slot, released here unless the
+        lease for it was already given back.
+        """
+        with self._lock:
+            self.in_flight += 1
+        try:
+            with span("gemini_request"):
+                response = self.client.models.generate_content(model=model, contents=contents, config=config)
+        except Exception as e:
+            # A rejected request still shows the service is up
+            self.breaker.record(not is_retryable(e))
+            raise
+        else:
+            self.breaker.record(True)
+            return response
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            if lease is None:
+                self._slots.release()
+            else:
+                lease.release()
+
+    async def _acall(self, model, contents, config, token: object | None = None):
+        """One request on the async client. token is the breaker's admission, if this call took one."""
+        with self._lock:
+            self.in_flight += 1
+        try:
+            with span("gemini_request"):
+                response = await self.client.aio.models.generate_content(model=model, contents=contents, config=config)
+        except asyncio.CancelledError:
+            self.breaker.abandon(token)
+            raise
+        except Exception as e:
+            self.breaker.record(not is_retryable(e))
+            raise
+        else:
+            self.breaker.record(True)
+            return response
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counts, "in_flight": self.in_flight, "waiting": self.waiting, "circuit": self.breaker.state}
+
+
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_gemini() -> ResilientGemini:
+    """The process-wide Gemini client, created on first use."""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None and os.environ.get("SNAPREADY_FAKES") == "1":
+            from fakes import FakeGenaiClient
+            _CLIENT = ResilientGemini(FakeGenaiClient())
+        if _CLIENT is None:
+            api_key = os.environ.get("GEMINI_API_KEY")
+            if not api_key:
+                raise RuntimeError("GEMINI_API_KEY environment variable is not set")
+            http_options = types.HttpOptions(base_url=GEMINI_BASE_URL) if GEMINI_BASE_URL else None
+            _CLIENT = ResilientGemini(genai.Client(api_key=api_key, http_options=http_options))
+        return _CLIENT
+
+
+def gemini_backpressure() -> float | None:
+    """ResilientGemini.backpressure of the process-wide client; None before its first use."""
+    return _CLIENT.backpressure() if _CLIENT is not None else None
+
+
+def gemini_stats() -> dict | None:
+    """Call counters of the process-wide client, or None before its first use."""
+    return _CLIENT.stats() if _CLIENT is not None else None
@@ -0,0 +1,89 @@
+"""Upload intake: size limits enforced while the body streams in, format sniffing, header probing."""
+
+import json
+
+from fastapi import HTTPException
+from PIL import Image
+
+JPEG_MAGIC = b"\xff\xd8\xff"
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+
+# Largest image we will fully decode (48 MP phone sensors fit comfortably)
+MAX_PIXELS = 64_000_000
+
+
+def sniff_format(head: bytes) -> str | None:
+    """Identify an upload from its leading bytes: "jpeg", "png" or None."""
+    if head.startswith(JPEG_MAGIC):
+        return "jpeg"
+    if head.startswith(PNG_MAGIC):
+        return "png"
+    return None
+
+
+def probe_size(fp) -> tuple[int, int]:
+    """Read image dimensions from the header only. Raises ValueError if unreadable or too large."""
+    try:
+        with Image.open(fp) as im:
+            size = im.size
+    except Exception as e:
+        raise ValueError(f"Could not read image header: {e}")
+    finally:
+        fp.seek(0)
+    if size[0] * size[1] > MAX_PIXELS:
+        raise ValueError(f"Image is {size[0]}x{size[1]}, larger than {MAX_PIXELS // 1_000_000} MP")
+    return size
+
+
+class UploadSizeLimitMiddleware:
+    """Reject oversized request bodies on upload routes as bytes arrive.
+
+    A declared Content-Length over the limit is refused before any body is
+    read. Otherwise the body is counted as it streams into the multipart
+    parser, and parsing is aborted with 413 the moment it passes the limit,
+    so an oversized upload is never fully received or buffered.
+    """
+
+    def __init__(self, app, max_body_bytes: int, paths: set[str], detail: str = "Upload too large."):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+        self.paths = paths
+        self.detail = detail
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        declared = headers.get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > self.max_body_bytes:
+            await self._reject(send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    # FastAPI re-raises HTTPExceptions from body parsing as-is
+                    raise HTTPException(413, self.detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": self.detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
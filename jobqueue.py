@@ -0,0 +1,297 @@
+"""Durable SQLite-backed job queue shared by the API and worker processes."""
+
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+from scheduler import SchedulerOverloaded, PRIORITY_REPROCESS, PRIORITY_UPLOAD
+
+QUEUE_DB_PATH = Path(os.environ.get("SNAPREADY_QUEUE_DB", Path(__file__).parent / "jobs.db"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    state TEXT NOT NULL,              -- queued | running | done | failed
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_expires REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (state, priority, available_at, id);
+CREATE INDEX IF NOT EXISTS jobs_by_job_id ON jobs (job_id, state);
+CREATE INDEX IF NOT EXISTS jobs_by_owner ON jobs (owner, state);
+"""
+
+
+class QueuedJob(NamedTuple):
+    id: int
+    job_id: str
+    owner: str
+    kind: str
+    payload: dict
+    attempts: int
+
+
+class SqliteJobQueue:
+    """Job queue persisted in a local SQLite file.
+
+    Workers claim a job by taking a time-limited lease and extend it with
+    heartbeat() while running. A job whose lease expires (worker crashed or
+    was killed) is handed out again, and failures are retried with
+    exponential backoff and jitter up to max_attempts.
+
+    Admission control mirrors JobScheduler: a bounded number of waiting jobs
+    overall and per owner, and a waiting job_id is replaced, not duplicated.
+    A job_id queued while it is running is not claimed until that run ends,
+    so two runs of one job never overlap.
+    """
+
+    def __init__(
+        self,
+        path: Path = QUEUE_DB_PATH,
+        max_queue: int = 32,
+        max_per_owner: int = 4,
+        max_attempts: int = 3,
+        lease_seconds: float = 120.0,
+        backoff_seconds: float = 5.0,
+    ):
+        self.path = Path(path)
+        self.max_queue = max_queue
+        self.max_per_owner = max_per_owner
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.backoff_seconds = backoff_seconds
+        self._local = threading.local()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared across threads; keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _write(self):
+        """Start a write transaction that takes the database lock up front."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        return conn
+
+    # --- API side ---
+
+    def _retry_after(self, conn: sqlite3.Connection) -> int:
+        (backlog,) = conn.execute("SELECT COUNT(*) FROM jobs WHERE state IN ('queued', 'running')").fetchone()
+        return max(1, backlog * 5)
+
+    def _check(self, conn: sqlite3.Connection, owner: str):
+        (queued,) = conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued'").fetchone()
+        if queued >= self.max_queue:
+            raise SchedulerOverloaded("Server is busy, please retry shortly.", 503, self._retry_after(conn))
+        (mine,) = conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE owner = ? AND state IN ('queued', 'running')", (owner,)
+        ).fetchone()
+        if mine >= self.max_per_owner:
+            raise SchedulerOverloaded("Too many photos in progress, please wait for one to finish.", 429, self._retry_after(conn))
+
+    def _waiting_id(self, conn: sqlite3.Connection, job_id: str) -> int | None:
+        row = conn.execute("SELECT id FROM jobs WHERE job_id = ? AND state = 'queued'", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def check_admission(self, owner: str, job_id: str | None = None):
+        """Raise SchedulerOverloaded now if enqueue() would be rejected."""
+        conn = self._conn()
+        if job_id is not None and self._waiting_id(conn, job_id) is not None:
+            return
+        self._check(conn, owner)
+
+    def enqueue(self, kind: str, job_id: str, owner: str, payload: dict, priority: int = PRIORITY_UPLOAD):
+        """Persist a job for the workers, or raise SchedulerOverloaded."""
+        now = time.time()
+        conn = self._write()
+        try:
+            waiting = self._waiting_id(conn, job_id)
+            if waiting is not None:
+                conn.execute(
+                    "UPDATE jobs SET kind = ?, payload = ?, priority = ?, attempts = 0, available_at = ?, updated_at = ? WHERE id = ?",
+                    (kind, json.dumps(payload), priority, now, now, waiting),
+                )
+            else:
+                self._check(conn, owner)
+                conn.execute(
+                    "INSERT INTO jobs (job_id, owner, kind, payload, priority, state, available_at, created_at, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?, 'queued', ?, ?, ?)",
+                    (job_id, owner, kind, json.dumps(payload), priority, now, now, now),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def active_status(self, job_id: str) -> str | None:
+        """'queued' or 'processing' while the job is in the queue, else None."""
+        row = self._conn().execute(
+            "SELECT state FROM jobs WHERE job_id = ? AND state IN ('queued', 'running') ORDER BY id DESC LIMIT 1",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        return "processing" if row[0] == "running" else "queued"
+
+    # --- Worker side ---
+
+    def claim(self, worker_id: str) -> QueuedJob | None:
+        """Lease the highest-priority ready job, or return None if there is none."""
+        now = time.time()
+        # Cheap read first so idle workers polling don't contend for the write lock
+        if self._conn().execute(
+            "SELECT 1 FROM jobs WHERE state = 'queued' AND available_at <= ? LIMIT 1", (now,)
+        ).fetchone() is None:
+            return None
+        conn = self._write()
+        try:
+            row = conn.execute(
+                "SELECT id, job_id, owner, kind, payload, attempts FROM jobs"
+                " WHERE state = 'queued' AND available_at <= ?"
+                " AND job_id NOT IN (SELECT job_id FROM jobs WHERE state = 'running')"
+                " ORDER BY priority, id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET state = 'running', attempts = attempts + 1, lease_owner = ?, lease_expires = ?, updated_at = ?"
+                " WHERE id = ?",
+                (worker_id, now + self.lease_seconds, now, row[0]),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return QueuedJob(row[0], row[1], row[2], row[3], json.loads(row[4]), row[5] + 1)
+
+    def heartbeat(self, job: QueuedJob, worker_id: str):
+        """Extend the lease on a running job."""
+        now = time.time()
+        self._conn().execute(
+            "UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE id = ? AND lease_owner = ? AND state = 'running'",
+            (now + self.lease_seconds, now, job.id, worker_id),
+        )
+
+    def complete(self, job: QueuedJob, worker_id: str) -> bool:
+        """Mark the job done. Returns False if this worker no longer holds its lease."""
+        now = time.time()
+        cursor = self._conn().execute(
+            "UPDATE jobs SET state = 'done', lease_owner = NULL, lease_expires = NULL, updated_at = ?"
+            " WHERE id = ? AND lease_owner = ? AND state = 'running'",
+            (now, job.id, worker_id),
+        )
+        return cursor.rowcount > 0
+
+    def is_final_attempt(self, job: QueuedJob) -> bool:
+        return job.attempts >= self.max_attempts
+
+    def fail(self, job: QueuedJob, error: str, worker_id: str) -> bool:
+        """Record a failed attempt. Returns True if the job is now permanently failed.
+
+        Does nothing if this worker no longer holds the job's lease; the job
+        has then been requeued or claimed by someone else.
+        """
+        now = time.time()
+        if self.is_final_attempt(job):
+            cursor = self._conn().execute(
+                "UPDATE jobs SET state = 'failed', last_error = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ?"
+                " WHERE id = ? AND lease_owner = ? AND state = 'running'",
+                (error, now, job.id, worker_id),
+            )
+            return cursor.rowcount > 0
+        delay = self.backoff_seconds * 2 ** (job.attempts - 1) * random.uniform(0.5, 1.5)
+        self._conn().execute(
+            "UPDATE jobs SET state = 'queued', available_at = ?, last_error = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ?"
+            " WHERE id = ? AND lease_owner = ? AND state = 'running'",
+            (now + delay, error, now, job.id, worker_id),
+        )
+        return False
+
+    def recover_orphans(self) -> list[QueuedJob]:
+        """Requeue running jobs whose lease expired.
+
+        Jobs with a live lease are left alone even on startup, since another
+        worker supervisor may be sharing this database.
+
+        Jobs that already used all attempts are marked failed instead and
+        returned, so the caller can record the failure where users see it.
+        """
+        now = time.time()
+        conn = self._write()
+        try:
+            rows = conn.execute(
+                "SELECT id, job_id, owner, kind, payload, attempts FROM jobs WHERE state = 'running' AND lease_expires < ?",
+                (now,),
+            ).fetchall()
+            exhausted = []
+            for row in rows:
+                job = QueuedJob(row[0], row[1], row[2], row[3], json.loads(row[4]), row[5])
+                if self.is_final_attempt(job):
+                    conn.execute(
+                        "UPDATE jobs SET state = 'failed', last_error = 'worker lost', lease_owner = NULL, updated_at = ? WHERE id = ?",
+                        (now, job.id),
+                    )
+                    exhausted.append(job)
+                else:
+                    conn.execute(
+                        "UPDATE jobs SET state = 'queued', available_at = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ? WHERE id = ?",
+                        (now, now, job.id),
+                    )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if rows:
+            print(f"[jobqueue] Recovered {len(rows) - len(exhausted)} orphaned jobs, {len(exhausted)} exhausted")
+        return exhausted
+
+    def prune(self, older_than_seconds: float = 24 * 3600):
+        """Delete finished rows so the table doesn't grow without bound."""
+        self._conn().execute(
+            "DELETE FROM jobs WHERE state IN ('done', 'failed') AND updated_at < ?",
+            (time.time() - older_than_seconds,),
+        )
+
+    def metrics(self) -> dict:
+        counts = dict(self._conn().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        by_priority = dict(self._conn().execute(
+            "SELECT priority, COUNT(*) FROM jobs WHERE state = 'queued' GROUP BY priority"
+        ).fetchall())
+        (oldest,) = self._conn().execute("SELECT MIN(created_at) FROM jobs WHERE state = 'queued'").fetchone()
+        return {
+            "backend": "sqlite",
+            "running": counts.get("running", 0),
+            "queued": counts.get("queued", 0),
+            "max_queue": self.max_queue,
+            "queued_by_priority": {
+                "reprocess": by_priority.get(PRIORITY_REPROCESS, 0),
+                "upload": by_priority.get(PRIORITY_UPLOAD, 0),
+            },
+            "oldest_wait_seconds": round(time.time() - oldest, 3) if oldest else 0.0,
+            "completed": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+        }
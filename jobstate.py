@@ -0,0 +1,161 @@
+"""Short-lived job state (the full /status payload) with size and TTL bounds.
+
+The in-process store is the default. The Redis store lets several API
+replicas and queue workers share state; it speaks the plain Redis protocol,
+so any compatible server works (`pip install redis` to use it).
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+JOB_STATE_BACKEND = os.environ.get("SNAPREADY_JOB_STATE", "memory")  # memory | redis
+JOB_STATE_REDIS_URL = os.environ.get("SNAPREADY_REDIS_URL", "redis://localhost:6379/0")
+JOB_STATE_TTL = float(os.environ.get("SNAPREADY_JOB_STATE_TTL", 6 * 3600))
+JOB_STATE_MAX_ENTRIES = int(os.environ.get("SNAPREADY_JOB_STATE_MAX", 10_000))
+
+
+class MemoryJobStateStore:
+    """Job states in this process: LRU-bounded to max_entries, each expiring ttl_seconds after its last write."""
+
+    shared = False
+
+    def __init__(self, max_entries: int = JOB_STATE_MAX_ENTRIES, ttl_seconds: float = JOB_STATE_TTL):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()  # job_id -> (expires, state)
+
+    def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(job_id)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[job_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(job_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, job_id: str, state: dict):
+        with self._lock:
+            self._put_locked(job_id, state)
+
+    def _put_locked(self, job_id: str, state: dict):
+        self._entries[job_id] = (time.monotonic() + self.ttl_seconds, state)
+        self._entries.move_to_end(job_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def merge(self, job_id: str, fields: dict, drop: tuple[str, ...] = (), existing_only: bool = False) -> tuple[dict | None, dict | None]:
+        """Set fields and remove drop in the job's state in one step.
+
+        Returns the state before and after. With existing_only, a job with
+        no state is left alone and the state after is None.
+        """
+        with self._lock:
+            entry = self._entries.get(job_id)
+            previous = entry[1] if entry is not None and entry[0] >= time.monotonic() else None
+            if previous is None and existing_only:
+                return None, None
+            state = {**(previous or {}), **fields}
+            for name in drop:
+                state.pop(name, None)
+            self._put_locked(job_id, state)
+            return previous, state
+
+    def delete(self, job_id: str):
+        with self._lock:
+            self._entries.pop(job_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = len(self._entries)
+        return {"backend": "memory", "entries": entries, "hits": self.hits, "misses": self.misses}
+
+
+class RedisJobStateStore:
+    """Job states in Redis with a TTL; size is bounded by the server's maxmemory policy.
+
+    Each state is a hash of JSON-encoded fields, so processes merging
+    different fields into one job never overwrite each other's.
+    """
+
+    shared = True
+
+    def __init__(self, url: str = JOB_STATE_REDIS_URL, ttl_seconds: float = JOB_STATE_TTL, prefix: str = "snapready:jobstate:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("SNAPREADY_JOB_STATE=redis needs the redis package (pip install redis)")
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        # RESP2 is what every Redis-compatible server speaks
+        self._redis = redis.Redis.from_url(url, protocol=2, socket_timeout=2, socket_connect_timeout=2)
+
+    @staticmethod
+    def _decode(raw: dict) -> dict | None:
+        return {name.decode(): json.loads(value) for name, value in raw.items()} if raw else None
+
+    def get(self, job_id: str) -> dict | None:
+        state = self._decode(self._redis.hgetall(self.prefix + job_id))
+        if state is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return state
+
+    def put(self, job_id: str, state: dict):
+        key = self.prefix + job_id
+        pipe = self._redis.pipeline()
+        pipe.delete(key)
+        if state:
+            pipe.hset(key, mapping={name: json.dumps(value) for name, value in state.items()})
+        pipe.expire(key, int(self.ttl_seconds))
+        pipe.execute()
+
+    def merge(self, job_id: str, fields: dict, drop: tuple[str, ...] = (), existing_only: bool = False) -> tuple[dict | None, dict | None]:
+        """MemoryJobStateStore.merge, as one HSET per field. WATCH retries the
+        transaction if another process changed the job in between, so the
+        states returned are exact.
+        """
+        key = self.prefix + job_id
+        fields = {name: value for name, value in fields.items() if name not in drop}
+
+        def apply(pipe):
+            previous = self._decode(pipe.hgetall(key))
+            if previous is None and existing_only:
+                return None, None
+            state = {**(previous or {}), **fields}
+            stale = [name for name in drop if name in state]
+            for name in stale:
+                del state[name]
+            pipe.multi()
+            if fields:
+                pipe.hset(key, mapping={name: json.dumps(value) for name, value in fields.items()})
+            if stale:
+                pipe.hdel(key, *stale)
+            pipe.expire(key, int(self.ttl_seconds))
+            return previous, state
+
+        return self._redis.transaction(apply, key, value_from_callable=True)
+
+    def delete(self, job_id: str):
+        self._redis.delete(self.prefix + job_id)
+
+    def stats(self) -> dict:
+        return {"backend": "redis", "hits": self.hits, "misses": self.misses}
+
+
+def make_job_state_store():
+    """The store selected by SNAPREADY_JOB_STATE."""
+    if JOB_STATE_BACKEND == "redis":
+        return RedisJobStateStore()
+    return MemoryJobStateStore()
@@ -0,0 +1,360 @@
+"""End-to-end load test of the API against the local fakes, at rising concurrency.
+
+Each virtual user signs in with its own fake token and repeats a session:
+upload a photo, poll /status until the retouch completes, change the zoom
+(a re-crop) and wait for that, open the gallery and download the ZIP. Every
+step between polls waits a randomized think time. For each level of
+concurrency it reports throughput, latency percentiles per endpoint, the
+time from upload to result, errors and overload rejections.
+
+    python loadtest.py --spawn                              # start a fake-backed server
+    SNAPREADY_FAKE_GEMINI_LATENCY=5-15 python loadtest.py --spawn --levels 1,8,32,64
+    python loadtest.py --url http://localhost:8000          # a server started with SNAPREADY_FAKES=1
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+from metrics import percentile
+
+ROOT = Path(__file__).parent
+DEFAULT_IMAGE = ROOT / "test-photos" / "headshot.jpg"
+ENDPOINTS = ("process", "status", "stream", "reprocess", "jobs", "download")
+TERMINAL = ("completed", "failed")
+OVERLOAD_STATUS = (429, 503)  # admission control turning work away, counted apart from errors
+
+
+def photo_variants(path: Path, count: int) -> list[bytes]:
+    """count JPEGs of the photo, each with a differently coloured patch at its center.
+
+    The face (and so the retouched crop) covers the center, so the variants
+    differ in what reaches Gemini. Without this, concurrent jobs of identical
+    pixels would share one retouch call.
+    """
+    from PIL import Image
+
+    with Image.open(path) as source:
+        photo = source.convert("RGB")
+    cx, cy = photo.width // 2, photo.height // 2
+    variants = []
+    for i in range(count):
+        marked = photo.copy()
+        marked.paste((i % 256, i // 256 % 256, 128), (cx - 8, cy - 8, cx + 8, cy + 8))
+        buf = io.BytesIO()
+        marked.save(buf, "JPEG", quality=92)
+        variants.append(buf.getvalue())
+    return variants
+
+
+def unique_jpeg(data: bytes) -> bytes:
+    """The JPEG with a random comment segment after SOI: the same pixels, but a new upload hash,
+    so every upload runs face detection like a new photo would.
+    """
+    comment = f"loadtest {uuid.uuid4().hex}".encode()
+    return data[:2] + b"\xff\xfe" + (len(comment) + 2).to_bytes(2, "big") + comment + data[2:]
+
+
+class Recorder:
+    """Latencies and outcomes of the requests and sessions of one concurrency level."""
+
+    def __init__(self):
+        self.requests: dict[str, list[tuple[float, int]]] = {name: [] for name in ENDPOINTS}  # (seconds, status; 0 = no response)
+        self.results: list[float] = []  # upload to completed, seconds
+        self.sessions = 0
+        self.sessions_ok = 0
+
+    def request(self, endpoint: str, seconds: float, status: int):
+        self.requests[endpoint].append((seconds, status))
+
+    def summary(self, elapsed: float) -> dict:
+        endpoints = {}
+        total = errors = rejected = 0
+        for name, samples in self.requests.items():
+            if not samples:
+                continue
+            latencies = sorted(seconds for seconds, _ in samples)
+            overloaded = sum(1 for _, status in samples if status in OVERLOAD_STATUS)
+            failed = sum(1 for _, status in samples if status == 0 or status >= 400 and status not in OVERLOAD_STATUS)
+            total += len(samples)
+            errors += failed
+            rejected += overloaded
+            endpoints[name] = {
+                "count": len(samples),
+                "errors": failed,
+                "rejected": overloaded,
+                "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+                "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+                "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+                "max_ms": round(latencies[-1] * 1000, 1),
+            }
+        results = sorted(self.results)
+        return {
+            "elapsed_s": round(elapsed, 1),
+            "sessions": self.sessions,
+            "sessions_ok": self.sessions_ok,
+            "sessions_per_s": round(self.sessions_ok / elapsed, 3),
+            "requests": total,
+            "requests_per_s": round(total / elapsed, 2),
+            "errors": errors,
+            "rejected": rejected,
+            "result_p50_s": round(percentile(results, 0.50), 2) if results else None,
+            "result_p99_s": round(percentile(results, 0.99), 2) if results else None,
+            "endpoints": endpoints,
+        }
+
+
+class Session:
+    """One virtual user's requests, recorded as they complete."""
+
+    def __init__(self, client: httpx.AsyncClient, user: str, images: list[bytes], args, recorder: Recorder, rng: random.Random, job_ids: set):
+        self.client = client
+        self.headers = {"Authorization": f"Bearer fake-{user}"}
+        self.images = images
+        self.args = args
+        self.recorder = recorder
+        self.rng = rng
+        self.job_ids = job_ids
+
+    async def _call(self, endpoint: str, method: str, url: str, **kwargs) -> httpx.Response | None:
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, headers=self.headers, **kwargs)
+        except httpx.HTTPError:
+            self.recorder.request(endpoint, time.perf_counter() - start, 0)
+            return None
+        self.recorder.request(endpoint, time.perf_counter() - start, response.status_code)
+        return response
+
+    async def think(self):
+        await asyncio.sleep(self.rng.uniform(0.5, 1.5) * self.args.think)
+
+    async def _poll(self, job_id: str) -> str | None:
+        """Poll /status like the frontend's fallback until the job settles. Returns the final status."""
+        deadline = time.monotonic() + self.args.job_timeout
+        while time.monotonic() < deadline:
+            response = await self._call("status", "GET", f"/status/{job_id}")
+            if response is not None and response.status_code == 200 and response.json()["status"] in TERMINAL:
+                return response.json()["status"]
+            await asyncio.sleep(self.args.poll_interval)
+        return None
+
+    async def _stream(self, job_id: str) -> str | None:
+        """Follow /status/{id}/stream until the job settles. Records the time to the final event."""
+        start = time.perf_counter()
+        status, code = None, 0
+        try:
+            async with self.client.stream("GET", f"/status/{job_id}/stream", headers=self.headers, timeout=self.args.job_timeout) as response:
+                code = response.status_code
+                async for line in response.aiter_lines():
+                    if line.startswith("data: "):
+                        status = json.loads(line[6:])["status"]
+                        if status in TERMINAL:
+                            break
+        except httpx.HTTPError:
+            pass
+        self.recorder.request("stream", time.perf_counter() - start, code)
+        return status if status in TERMINAL else None
+
+    async def _wait(self, job_id: str) -> bool:
+        watch = self._stream if self.args.watch == "stream" else self._poll
+        return await watch(job_id) == "completed"
+
+    async def run(self) -> bool:
+        self.recorder.sessions += 1
+        start = time.perf_counter()
+        response = await self._call(
+            "process", "POST", "/process",
+            files={"file": ("photo.jpg", unique_jpeg(self.rng.choice(self.images)), "image/jpeg")},
+            data={"intensity": "medium", "zoom": "1.0"},
+        )
+        if response is None or response.status_code != 200:
+            return False
+        job_id = response.json()["job_id"]
+        self.job_ids.add(job_id)
+        if not await self._wait(job_id):
+            return False
+        self.recorder.results.append(time.perf_counter() - start)
+
+        await self.think()
+        response = await self._call("reprocess", "POST", f"/reprocess/{job_id}", data={"intensity": "medium", "zoom": "1.2"})
+        if response is None or response.status_code != 200 or not await self._wait(job_id):
+            return False
+
+        await self.think()
+        response = await self._call("jobs", "GET", "/jobs")
+        if response is None or response.status_code != 200:
+            return False
+
+        await self.think()
+        response = await self._call("download", "GET", f"/download/{job_id}")
+        if response is None or response.status_code != 200:
+            return False
+        self.recorder.sessions_ok += 1
+        return True
+
+
+async def run_level(url: str, users: int, args, images: list[bytes], job_ids: set) -> dict:
+    """Run users sessions back to back for args.duration seconds; sessions under way then finish."""
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=users * 2 + 4, max_keepalive_connections=users * 2 + 4)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=args.request_timeout) as client:
+        stop_at = time.monotonic() + args.duration
+
+        async def user_loop(n: int):
+            rng = random.Random(f"{args.seed}:{users}:{n}")
+            session = Session(client, f"load{n}", images, args, recorder, rng, job_ids)
+            # Spread the first uploads over one think time
+            await asyncio.sleep(rng.uniform(0, args.think))
+            while time.monotonic() < stop_at:
+                if not await session.run():
+                    await session.think()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user_loop(n) for n in range(users)))
+        elapsed = time.perf_counter() - start
+
+        server = None
+        try:
+            server = (await client.get("/queue/metrics")).json()
+        except (httpx.HTTPError, ValueError):
+            pass
+    return {"users": users, **recorder.summary(elapsed), "server": server}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def spawn_server(log_path: Path, cache_dir: Path) -> tuple[subprocess.Popen, str]:
+    """Start app.py on the fakes on a free local port. The environment passes through, fake settings included."""
+    port = _free_port()
+    env = {
+        **os.environ,
+        "SNAPREADY_FAKES": "1",
+        "SNAPREADY_CACHE_DIR": str(cache_dir),
+        # Uploads share pixels; a retouch cache that keeps nothing makes each a miss, like a new photo
+        "RETOUCH_CACHE_MAX_BYTES": "0",
+    }
+    log = open(log_path, "w")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with status {proc.returncode}; see {log_path}")
+        try:
+            if httpx.get(f"{url}/queue/metrics", timeout=1).status_code == 200:
+                return proc, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    proc.terminate()
+    raise RuntimeError(f"server did not start; see {log_path}")
+
+
+def _print_level(level: dict, first: bool):
+    if first:
+        print(
+            f"{'users':>5} {'sess/s':>7} {'req/s':>7} {'err':>5} {'rej':>5}"
+            f" {'process p50/p99 ms':>19} {'status p50/p99 ms':>18} {'result p50/p99 s':>17}"
+        )
+    process = level["endpoints"].get("process", {})
+    status = level["endpoints"].get("status") or level["endpoints"].get("stream") or {}
+    result = f"{level['result_p50_s']}/{level['result_p99_s']}" if level["result_p50_s"] is not None else "-"
+    print(
+        f"{level['users']:>5} {level['sessions_per_s']:>7.2f} {level['requests_per_s']:>7.1f} {level['errors']:>5} {level['rejected']:>5}"
+        f" {process.get('p50_ms', 0):>9.0f}/{process.get('p99_ms', 0):<9.0f}"
+        f" {status.get('p50_ms', 0):>8.0f}/{status.get('p99_ms', 0):<9.0f}"
+        f" {result:>17}",
+        flush=True,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test SnapReady against the local fakes")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="API started with SNAPREADY_FAKES=1")
+    target.add_argument("--spawn", action="store_true", help="start a fake-backed server for the run")
+    parser.add_argument("--levels", default="1,2,4,8,16,32", help="comma-separated concurrent users per level")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds new sessions start at each level")
+    parser.add_argument("--think", type=float, default=1.0, help="mean seconds between a user's steps")
+    parser.add_argument("--watch", choices=("poll", "stream"), default="poll", help="follow jobs by polling /status or by SSE")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="seconds between /status polls, as in the frontend")
+    parser.add_argument("--job-timeout", type=float, default=300.0)
+    parser.add_argument("--request-timeout", type=float, default=60.0)
+    parser.add_argument("--image", type=Path, default=DEFAULT_IMAGE, help="portrait to upload")
+    parser.add_argument("--variants", type=int, default=256, help="distinct versions of it to upload")
+    parser.add_argument("--stop-p99", type=float, metavar="SECONDS", help="stop rising once /process or /status p99 exceeds this")
+    parser.add_argument("--seed", default="0")
+    parser.add_argument("--save", metavar="PATH", help="write every level's results as JSON")
+    args = parser.parse_args()
+
+    levels = [int(n) for n in args.levels.split(",") if n]
+    images = photo_variants(args.image, args.variants)
+
+    proc = None
+    workdir = None
+    url = args.url
+    if args.spawn:
+        workdir = Path(tempfile.mkdtemp(prefix="snapready-load-"))
+        log_path = workdir / "server.log"
+        print(f"[loadtest] Starting server (log: {log_path})")
+        proc, url = spawn_server(log_path, workdir / "cache")
+
+    results = []
+    job_ids: set[str] = set()
+    try:
+        for i, users in enumerate(levels):
+            level = asyncio.run(run_level(url, users, args, images, job_ids))
+            results.append(level)
+            _print_level(level, i == 0)
+            worst = max(level["endpoints"].get(name, {}).get("p99_ms", 0) for name in ("process", "status"))
+            if args.stop_p99 and worst > args.stop_p99 * 1000:
+                print(f"[loadtest] p99 {worst / 1000:.1f} s exceeds {args.stop_p99} s at {users} users; stopping")
+                break
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=30)
+            # The server kept its job directories in uploads/; they are ours to remove
+            for job_id in job_ids:
+                shutil.rmtree(ROOT / "uploads" / job_id, ignore_errors=True)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.save:
+        environment = {key: value for key, value in os.environ.items() if key.startswith("SNAPREADY_")}
+        meta = {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "url": args.url or "spawned",
+            "duration": args.duration,
+            "think": args.think,
+            "watch": args.watch,
+            "poll_interval": args.poll_interval,
+            "environment": environment,
+        }
+        Path(args.save).write_text(json.dumps({"meta": meta, "levels": results}, indent=2) + "\n")
+        print(f"[loadtest] Saved {args.save}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Stage latency spans, and Prometheus text exposition of them alongside service gauges.
+
+Each process keeps its own histograms; with the SQLite queue, worker
+processes' pipeline spans are only in the per-job timings they write to
+Firestore.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Seconds; stages range from sub-millisecond Firestore writes to minute-long model calls
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with one label, as Prometheus expects."""
+
+    def __init__(self, name: str, help: str, label: str, buckets: tuple[float, ...] = STAGE_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series: dict[str, list] = {}  # label value -> [bucket counts..., count, sum]
+
+    def observe(self, value: str, seconds: float):
+        with self._lock:
+            series = self._series.get(value)
+            if series is None:
+                series = self._series[value] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += seconds
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {value: list(series) for value, series in self._series.items()}
+        for value, series in sorted(snapshot.items()):
+            label = f'{self.label}="{value}"'
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {series[-2]}')
+            lines.append(f"{self.name}_count{{{label}}} {series[-2]}")
+            lines.append(f"{self.name}_sum{{{label}}} {series[-1]:.6f}")
+        return lines
+
+
+stage_seconds = Histogram("snapready_stage_seconds", "Time spent in each request and pipeline stage.", "stage")
+
+# Per-job breakdown collected by span(); asyncio.to_thread carries it into job threads
+_job_timings: ContextVar[dict[str, float] | None] = ContextVar("job_timings", default=None)
+
+
+@contextmanager
+def span(stage: str):
+    """Time a block into the stage histogram and, inside job_timings(), into the job's breakdown."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(stage, elapsed)
+        timings = _job_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+@contextmanager
+def job_timings():
+    """Collect the spans of one job. Yields the {stage: seconds} dict being filled."""
+    timings: dict[str, float] = {}
+    token = _job_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _job_timings.reset(token)
+
+
+def timings_ms() -> dict[str, int]:
+    """The current job's breakdown so far, in whole milliseconds, for its Firestore document."""
+    return {stage: round(seconds * 1000) for stage, seconds in (_job_timings.get() or {}).items()}
+
+
+def percentile(ordered: list[float], q: float) -> float:
+    """Linearly interpolated q-quantile (0-1) of sorted values, for benchmark and load-test reports."""
+    if len(ordered) == 1:
+        return ordered[0]
+    position = (len(ordered) - 1) * q
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def render(samples: list[tuple[str, str, str, list[tuple[dict, float]]]]) -> str:
+    """Prometheus text format of the stage histogram plus (name, type, help, [(labels, value)]) samples."""
+    lines = stage_seconds.render()
+    for name, kind, help, values in samples:
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+        for labels, value in values:
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return "\n".join(lines) + "\n"
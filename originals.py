@@ -0,0 +1,90 @@
+"""On-disk cache of each job's decoded working canvas, so a reprocess on the same node
+skips the download and the decode.
+"""
+
+import json
+import os
+import struct
+import zlib
+
+from PIL import Image
+
+from cache import CACHE_DIR, ResultCache
+
+ORIGINALS_CACHE_MAX_BYTES = int(os.environ.get("SNAPREADY_ORIGINALS_CACHE_MB", 2048)) * 1024 * 1024
+ORIGINALS_CACHE_TTL = float(os.environ.get("SNAPREADY_ORIGINALS_CACHE_TTL", 7 * 24 * 3600))  # 7 days
+
+_MAGIC = b"SRC1"
+_HEADER = struct.Struct(">4sIIII")  # magic, width, height, metadata length, CRC32 of metadata and pixels
+
+_FACE_KEYS = ("x", "y", "w", "h")
+
+
+def _face(face: dict) -> dict:
+    return {k: float(face[k]) for k in _FACE_KEYS}
+
+
+def _pack(canvas: Image.Image, canvas_face: dict, face: dict) -> bytes:
+    meta = json.dumps({"canvas_face": _face(canvas_face), "face": _face(face)}).encode()
+    body = meta + canvas.tobytes()
+    return _HEADER.pack(_MAGIC, canvas.width, canvas.height, len(meta), zlib.crc32(body)) + body
+
+
+def _unpack(data: bytes) -> tuple[Image.Image, dict, dict] | None:
+    """The canvas, its face box and the original's face box in a cache entry, or None if the entry is damaged."""
+    if len(data) < _HEADER.size:
+        return None
+    magic, width, height, meta_len, crc = _HEADER.unpack_from(data)
+    body = memoryview(data)[_HEADER.size:]
+    if magic != _MAGIC or len(body) != meta_len + width * height * 3 or zlib.crc32(body) != crc:
+        return None
+    meta = json.loads(bytes(body[:meta_len]))
+    return Image.frombytes("RGB", (width, height), body[meta_len:]), meta["canvas_face"], meta["face"]
+
+
+class OriginalsCache:
+    """Decoded working canvases by job id, LRU-evicted within a byte budget.
+
+    A canvas is the crop_headshot_canvas framing of the job's original: every
+    zoom the slider offers is a crop of it, so a reprocess can start from it
+    instead of the full original. Entries are raw RGB pixels behind a header
+    with the size, both face boxes and a CRC32, so loading one is a file read
+    with no JPEG decode. An entry that fails the check (e.g. cut short by a
+    crash mid-write) is dropped and reads as a miss.
+    """
+
+    def __init__(self, directory=CACHE_DIR / "originals", max_bytes: int = ORIGINALS_CACHE_MAX_BYTES, ttl_seconds: float = ORIGINALS_CACHE_TTL):
+        self._store = ResultCache(directory, max_bytes=max_bytes, ttl_seconds=ttl_seconds)
+        self.corrupt = 0
+
+    def __contains__(self, job_id: str) -> bool:
+        return job_id in self._store
+
+    def get(self, job_id: str, face: dict) -> tuple[Image.Image, dict] | None:
+        """The canvas and its face box, if one was cut around this face of the original."""
+        data = self._store.get(job_id)
+        if data is None:
+            return None
+        entry = _unpack(data)
+        if entry is None:
+            print(f"[originals] Dropping damaged cached canvas of {job_id}")
+            self.corrupt += 1
+            self._store.delete(job_id)
+            return None
+        canvas, canvas_face, cut_for = entry
+        if cut_for != _face(face):
+            return None
+        return canvas, canvas_face
+
+    def put(self, job_id: str, canvas: Image.Image, canvas_face: dict, face: dict):
+        """Cache the canvas cut from the original around face."""
+        self._store.put(job_id, _pack(canvas.convert("RGB") if canvas.mode != "RGB" else canvas, canvas_face, face))
+
+    def delete(self, job_id: str):
+        self._store.delete(job_id)
+
+    def stats(self) -> dict:
+        return {**self._store.stats(), "corrupt": self.corrupt}
+
+
+originals_cache = OriginalsCache()
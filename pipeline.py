@@ -0,0 +1,461 @@
+"""Crop/retouch/upload job pipeline, shared by the API scheduler and queue workers."""
+
+import asyncio
+import os
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+from blobfetch import storage_fetcher
+from crop import MAX_ZOOM, MIN_ZOOM, crop_headshot_square, crop_headshot_canvas, square_face
+from events import job_events
+from export import PREVIEW, THUMBNAIL, render, write_export
+from retouch import aretouch_image, retouch_image
+from feedback import get_current_prompt_version
+from blobstore import encode_jpeg, start_copy, start_uploads, upload_bytes
+from faceindex import face_index
+from metrics import job_timings, span, timings_ms
+from originals import originals_cache
+from services import job_doc
+
+UPLOAD_DIR = Path(__file__).parent / "uploads"
+
+# Retouch one wide canvas per job and serve zoom changes by re-cropping it locally
+CANVAS_RETOUCH = os.environ.get("SNAPREADY_CANVAS_RETOUCH", "1") == "1"
+
+# Local filename in uploads/{job_id} -> object name under users/{uid}/{job_id}/ in Storage
+STORAGE_NAMES = {
+    "original.jpg": "original.jpg",
+    "cropped_square.jpg": "cropped.jpg",
+    "retouched.jpg": "retouched.jpg",
+    "canvas.jpg": "canvas.jpg",
+    "retouched_canvas.jpg": "retouched_canvas.jpg",
+    "thumb.webp": "thumb.webp",
+    "cropped_thumb.webp": "cropped_thumb.webp",
+    "preview.webp": "preview.webp",
+}
+
+
+def _storage_path(user_id: str, job_id: str, name: str) -> str:
+    return f"users/{user_id}/{job_id}/{STORAGE_NAMES[name]}"
+
+
+def _publish(job_dir: Path, user_id: str, job_id: str, files: dict[str, bytes], copies: dict[str, str] | None = None) -> dict[str, str]:
+    """Upload encoded renditions concurrently and keep local copies for feedback and re-crops.
+
+    files maps a local filename in job_dir to its bytes; the storage name is
+    looked up in STORAGE_NAMES. copies maps a local filename to an existing
+    Storage object to copy server-side instead; the local file is uploaded
+    if the copy fails. Returns {local filename: public URL}.
+    """
+    futures = start_uploads({_storage_path(user_id, job_id, name): data for name, data in files.items()})
+    copy_futures = {
+        name: start_copy(source, _storage_path(user_id, job_id, name))
+        for name, source in (copies or {}).items()
+    }
+    # Disk copies are written while the uploads are in flight
+    for name, data in files.items():
+        (job_dir / name).write_bytes(data)
+
+    urls = {name: futures[_storage_path(user_id, job_id, name)].result() for name in files}
+    for name, future in copy_futures.items():
+        try:
+            urls[name] = future.result()
+        except Exception as e:
+            print(f"Job {job_id}: copy of {name} failed ({e}), uploading instead")
+            urls[name] = upload_bytes(_storage_path(user_id, job_id, name), (job_dir / name).read_bytes())
+    return urls
+
+
+def _result_urls(urls: dict[str, str]) -> dict[str, str]:
+    """The URLs clients display for a completed job, keyed as in Firestore and /status."""
+    return {
+        'cropped_url': urls["cropped_square.jpg"],
+        'retouched_url': urls["retouched.jpg"],
+        'thumb_url': urls["thumb.webp"],
+        'cropped_thumb_url': urls["cropped_thumb.webp"],
+    }
+
+
+def _thumbnails(cropped: Image.Image, retouched: Image.Image) -> dict[str, bytes]:
+    """Small WebP tiles for the gallery and the before/after slider."""
+    (thumb,) = render(retouched, renditions=(THUMBNAIL,))
+    (cropped_thumb,) = render(cropped, renditions=(THUMBNAIL,))
+    return {"thumb.webp": thumb, "cropped_thumb.webp": cropped_thumb}
+
+
+def _publish_preview(doc_ref, user_id: str, job_id: str, cropped: Image.Image):
+    """Upload a low-quality preview of the crop and record its URL, without waiting for it.
+
+    The retouch takes several seconds; this lets the client show the framed
+    photo in the meantime.
+    """
+    (data,) = render(cropped, renditions=(PREVIEW,))
+    path = _storage_path(user_id, job_id, "preview.webp")
+
+    def record(future):
+        try:
+            url = future.result()
+            doc_ref.update({'preview_url': url})
+            job_events.update(job_id, preview_url=url)
+        except Exception as e:
+            print(f"Job {job_id}: preview not published ({e})")
+
+    start_uploads({path: data})[path].add_done_callback(record)
+
+
+def _prebuild_export(source: Image.Image, job_id: str, job_dir: Path, render_id: str, face: dict, zoom: float):
+    """Build the download bundle ahead of the first download. Best effort: the job is
+    already completed, and /export builds the bundle itself if it is missing.
+    """
+    try:
+        with span("export"):
+            write_export(source, job_id, job_dir, render_id, face, zoom)
+    except Exception as e:
+        print(f"Job {job_id}: export not prebuilt ({e})")
+
+
+def _begin_process(
+    job_id: str, intensity: str, pil_image: Image.Image | None, face: dict, zoom: float, user_id: str,
+    canvas: tuple[Image.Image, dict] | None = None,
+) -> dict:
+    """Mark the job processing, crop it and publish the preview.
+
+    With canvas (a cached working canvas and its face box) the crop is cut
+    from it and pil_image is not needed. Returns the crop state for
+    _finish_process; its "source" is the image to retouch.
+    """
+    # 1. Update Firestore status
+    doc_ref = job_doc(user_id, job_id)
+    with span("firestore"):
+        doc_ref.set({
+            'job_id': job_id,
+            'status': 'processing',
+            'intensity': intensity,
+            'zoom': zoom,
+            'created_at': datetime.utcnow(),
+        }, merge=True)
+    job_events.publish(job_id, "cropping")
+
+    with span("crop"):
+        if CANVAS_RETOUCH:
+            # Retouch the widest framing once; every zoom is a local crop of it
+            canvas, canvas_face = canvas or crop_headshot_canvas(pil_image, face)
+            cropped = crop_headshot_square(canvas, canvas_face, zoom=zoom)
+            crop = {"doc_ref": doc_ref, "cropped": cropped, "canvas": canvas, "canvas_face": canvas_face, "source": canvas}
+        else:
+            # Crop with zoom, from the cached canvas when there is one
+            frame, frame_face = canvas or (pil_image, face)
+            cropped = crop_headshot_square(frame, frame_face, zoom=zoom)
+            crop = {"doc_ref": doc_ref, "cropped": cropped, "source": cropped, "frame_size": frame.size, "frame_face": frame_face}
+    with span("preview"):
+        _publish_preview(doc_ref, user_id, job_id, cropped)
+    job_events.publish(job_id, "retouching")
+    return crop
+
+
+def _finish_process(
+    crop: dict, retouched_source: Image.Image,
+    job_id: str, intensity: str, pil_image: Image.Image | None, face: dict, job_dir: Path, zoom: float, user_id: str,
+    original_url: str | None, upload_hash: str | None, original_source: str | None,
+    render_id: str | None = None,
+):
+    """Encode and upload the renditions of a retouched crop, and record the job completed.
+
+    pil_image is only None on a reprocess started from a cached canvas.
+    """
+    doc_ref, cropped = crop["doc_ref"], crop["cropped"]
+    files = {}
+    canvas_data = {}
+    with span("encode"):
+        if "canvas" in crop:
+            canvas, canvas_face = crop["canvas"], crop["canvas_face"]
+            retouched_canvas = retouched_source
+            if retouched_canvas.size != canvas.size:
+                # Gemini may answer in a different aspect; crop to the canvas's before
+                # scaling so canvas_face still lines up
+                retouched_canvas = ImageOps.fit(retouched_canvas, canvas.size, Image.LANCZOS)
+            retouched = crop_headshot_square(retouched_canvas, canvas_face, zoom=zoom)
+
+            files["canvas.jpg"] = encode_jpeg(canvas)
+            files["retouched_canvas.jpg"] = encode_jpeg(retouched_canvas)
+            canvas_data = {
+                'canvas_face': canvas_face,
+                'canvas_intensity': intensity,
+            }
+            # Exports are framed from the canvas so the portrait gets real shoulder room
+            export_source, export_face = retouched_canvas, canvas_face
+        else:
+            retouched = retouched_source
+            export_source, export_face = retouched, square_face(crop["frame_size"], crop["frame_face"], zoom, retouched.size)
+
+        files["cropped_square.jpg"] = encode_jpeg(cropped)
+        files["retouched.jpg"] = encode_jpeg(retouched)
+        files.update(_thumbnails(cropped, retouched))
+
+        # Upload to Firebase Storage, all renditions at once
+        copies = {}
+        if original_url is None:
+            original_path = job_dir / "original.jpg"
+            # Re-encoding the raw upload also strips its EXIF (GPS etc.) before it goes public
+            original_bytes = original_path.read_bytes() if original_path.exists() else encode_jpeg(pil_image)
+            if original_source:
+                original_path.write_bytes(original_bytes)  # uploaded instead if the copy fails
+                copies["original.jpg"] = original_source
+            else:
+                files["original.jpg"] = original_bytes
+    job_events.publish(job_id, "uploading")
+    with span("upload"):
+        urls = _publish(job_dir, user_id, job_id, files, copies)
+    for raw_upload in job_dir.glob("upload.*"):
+        raw_upload.unlink()
+    if upload_hash and "original.jpg" in urls:
+        face_index.set_original(upload_hash, user_id, job_id, _storage_path(user_id, job_id, "original.jpg"))
+
+    if CANVAS_RETOUCH:
+        canvas_data['canvas_url'] = urls["canvas.jpg"]
+        canvas_data['retouched_canvas_url'] = urls["retouched_canvas.jpg"]
+
+    # Save face coordinates to Firestore instead of a text file
+    face_data = {"x": face['x'], "y": face['y'], "w": face['w'], "h": face['h']}
+
+    # Update Firestore with completion data
+    render_id = render_id or uuid.uuid4().hex[:12]
+    result = _result_urls(urls)
+    prompt_version = get_current_prompt_version()
+    # How this image was made, for ratings; read back by feedback.save_rating
+    (job_dir / "intensity.txt").write_text(intensity)
+    (job_dir / "prompt_version.txt").write_text(str(prompt_version))
+    with span("firestore"):
+        doc_ref.update({
+            'status': 'completed',
+            'original_url': urls.get("original.jpg", original_url),
+            **result,
+            'face': face_data,
+            'prompt_version': prompt_version,
+            'render_id': render_id,
+            'timings_ms': timings_ms(),
+            **canvas_data,
+        })
+    job_events.publish(
+        job_id, "completed", **result, intensity=intensity, zoom=zoom, prompt_version=prompt_version,
+        render_id=render_id,
+    )
+
+    # Build the download bundle now, after the user already sees the result
+    _prebuild_export(export_source, job_id, job_dir, render_id, export_face, zoom)
+
+    # Lets a reprocess on this node skip the download and decode. Best effort, like the export.
+    if pil_image is not None and job_id not in originals_cache:
+        try:
+            with span("originals_cache"):
+                if "canvas" in crop:
+                    canvas, canvas_face = crop["canvas"], crop["canvas_face"]
+                else:
+                    canvas, canvas_face = crop_headshot_canvas(pil_image, face)
+                originals_cache.put(job_id, canvas, canvas_face, face)
+        except Exception as e:
+            print(f"Job {job_id}: canvas not cached ({e})")
+
+
+def async_process_job(
+    job_id: str, intensity: str, pil_image: Image.Image | None, face: dict, job_dir: Path, zoom: float, user_id: str,
+    original_url: str | None = None, upload_hash: str | None = None, original_source: str | None = None,
+    canvas: tuple[Image.Image, dict] | None = None, render_id: str | None = None,
+):
+    """Scheduled job to crop, retouch, upload to Firebase, and update Firestore.
+
+    original_url is passed on reprocess, when the original is already in
+    Storage and doesn't need uploading again. For a repeat upload of the same
+    file, original_source names the earlier job's original to copy
+    server-side. upload_hash lets later duplicates find this job's original.
+    A reprocess may pass the cached working canvas instead of pil_image.
+    render_id is the id the result is recorded under, assigned when queued.
+    """
+    crop = _begin_process(job_id, intensity, pil_image, face, zoom, user_id, canvas)
+    with span("retouch"):
+        retouched = retouch_image(crop["source"], intensity)
+    _finish_process(
+        crop, retouched, job_id, intensity, pil_image, face, job_dir, zoom, user_id,
+        original_url, upload_hash, original_source, render_id,
+    )
+
+
+async def process_job_aio(
+    job_id: str, intensity: str, pil_image: Image.Image | None, face: dict, job_dir: Path, zoom: float, user_id: str,
+    original_url: str | None = None, upload_hash: str | None = None, original_source: str | None = None,
+    canvas: tuple[Image.Image, dict] | None = None, render_id: str | None = None,
+):
+    """Coroutine version of async_process_job.
+
+    Cropping and uploading run in the loop's executor; the retouch awaits the
+    async Gemini client, so it holds no thread.
+    """
+    crop = await asyncio.to_thread(_begin_process, job_id, intensity, pil_image, face, zoom, user_id, canvas)
+    with span("retouch"):
+        retouched = await aretouch_image(crop["source"], intensity)
+    await asyncio.to_thread(
+        _finish_process, crop, retouched, job_id, intensity, pil_image, face, job_dir, zoom, user_id,
+        original_url, upload_hash, original_source, render_id,
+    )
+
+
+def async_recrop_job(
+    job_id: str, canvas: Image.Image, retouched_canvas: Image.Image, canvas_face: dict, job_dir: Path, zoom: float, user_id: str,
+    render_id: str | None = None,
+):
+    """Scheduled job to re-frame an already retouched canvas at a new zoom. No model call."""
+    doc_ref = job_doc(user_id, job_id)
+    with span("firestore"):
+        doc_ref.update({'status': 'processing', 'zoom': zoom})
+    job_events.publish(job_id, "cropping")
+
+    with span("crop"):
+        cropped = crop_headshot_square(canvas, canvas_face, zoom=zoom)
+        retouched = crop_headshot_square(retouched_canvas, canvas_face, zoom=zoom)
+
+    with span("encode"):
+        files = {
+            "cropped_square.jpg": encode_jpeg(cropped),
+            "retouched.jpg": encode_jpeg(retouched),
+            **_thumbnails(cropped, retouched),
+        }
+    job_events.publish(job_id, "uploading")
+    with span("upload"):
+        urls = _publish(job_dir, user_id, job_id, files)
+
+    render_id = render_id or uuid.uuid4().hex[:12]
+    result = _result_urls(urls)
+    with span("firestore"):
+        doc_ref.update({
+            'status': 'completed',
+            **result,
+            'render_id': render_id,
+            'timings_ms': timings_ms(),
+        })
+    job_events.publish(job_id, "completed", **result, zoom=zoom, render_id=render_id)
+
+    _prebuild_export(retouched_canvas, job_id, job_dir, render_id, canvas_face, zoom)
+
+
+def _load_canvases(job_dir: Path, payload: dict) -> tuple[Image.Image, Image.Image]:
+    """Load the raw and retouched canvas from the job dir, or from Storage if not on this node."""
+    canvas_path = job_dir / "canvas.jpg"
+    retouched_canvas_path = job_dir / "retouched_canvas.jpg"
+    if canvas_path.exists() and retouched_canvas_path.exists():
+        return (
+            Image.open(canvas_path).convert("RGB"),
+            Image.open(retouched_canvas_path).convert("RGB"),
+        )
+    # Canvases are only rewritten by a new render, so the render id versions them
+    version = payload.get('render_id')
+    return (
+        storage_fetcher.fetch_image_sync(payload['canvas_url'], version),
+        storage_fetcher.fetch_image_sync(payload['retouched_canvas_url'], version),
+    )
+
+
+def _cached_canvas(job_id: str, payload: dict) -> tuple[Image.Image, dict] | None:
+    """The cached working canvas to reprocess from, if this node has one covering the zoom.
+
+    Fresh uploads never start from it: their original still has to be published.
+    """
+    if not payload.get('original_url') or not MIN_ZOOM <= payload['zoom'] <= MAX_ZOOM:
+        return None
+    return originals_cache.get(job_id, payload['face'])
+
+
+def _load_original(job_id: str, job_dir: Path, original_url: str | None = None) -> Image.Image:
+    """Load the job's original, cheapest source first.
+
+    That is original.jpg once written, then the raw upload, then a download
+    of original_url.
+    """
+    candidates = [job_dir / "original.jpg", *sorted(job_dir.glob("upload.*"))]
+    for path in candidates:
+        if path.exists():
+            return Image.open(path).convert("RGB")
+    if original_url:
+        return storage_fetcher.fetch_image_sync(original_url)
+    raise FileNotFoundError(f"No original image in {job_dir}")
+
+
+def record_job_failure(job_id: str, user_id: str, error: str):
+    """Mark a job failed in Firestore and leave the error next to its files."""
+    job_doc(user_id, job_id).update({
+        'status': 'failed',
+        'error': error
+    })
+    job_dir = UPLOAD_DIR / job_id
+    if job_dir.exists():
+        (job_dir / "error.txt").write_text(error)
+
+
+def run_job(kind: str, job_id: str, user_id: str, payload: dict, pil_image: Image.Image | None = None, final_attempt: bool = True):
+    """Run a queued job by kind. Payloads are JSON-safe so they can live in the durable queue.
+
+    pil_image lets the in-process scheduler hand over an already decoded
+    original. Failure is only recorded in Firestore on the final attempt, so
+    a job that will be retried doesn't flash "failed" to the user.
+    """
+    job_dir = UPLOAD_DIR / job_id
+    job_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        with job_timings():
+            if kind == "process":
+                canvas = None
+                if pil_image is None:
+                    with span("decode"):
+                        canvas = _cached_canvas(job_id, payload)
+                        if canvas is None:
+                            pil_image = _load_original(job_id, job_dir, payload.get('original_url'))
+                async_process_job(
+                    job_id, payload['intensity'], pil_image, payload['face'], job_dir, payload['zoom'], user_id,
+                    payload.get('original_url'), payload.get('upload_hash'), payload.get('original_source'), canvas,
+                    payload.get('run_id'),
+                )
+            elif kind == "recrop":
+                with span("decode"):
+                    canvas, retouched_canvas = _load_canvases(job_dir, payload)
+                async_recrop_job(
+                    job_id, canvas, retouched_canvas, payload['canvas_face'], job_dir, payload['zoom'], user_id,
+                    payload.get('run_id'),
+                )
+            else:
+                raise ValueError(f"Unknown job kind: {kind}")
+    except Exception as e:
+        _job_failed(job_id, user_id, e, final_attempt)
+        raise
+
+
+async def run_job_aio(kind: str, job_id: str, user_id: str, payload: dict, pil_image: Image.Image | None = None, final_attempt: bool = True):
+    """run_job for the async scheduler. Only process jobs call the model; other kinds run in a thread."""
+    if kind != "process":
+        return await asyncio.to_thread(run_job, kind, job_id, user_id, payload, pil_image, final_attempt)
+    job_dir = UPLOAD_DIR / job_id
+    try:
+        with job_timings():
+            await asyncio.to_thread(job_dir.mkdir, parents=True, exist_ok=True)
+            canvas = None
+            if pil_image is None:
+                with span("decode"):
+                    canvas = await asyncio.to_thread(_cached_canvas, job_id, payload)
+                    if canvas is None:
+                        pil_image = await asyncio.to_thread(_load_original, job_id, job_dir, payload.get('original_url'))
+            await process_job_aio(
+                job_id, payload['intensity'], pil_image, payload['face'], job_dir, payload['zoom'], user_id,
+                payload.get('original_url'), payload.get('upload_hash'), payload.get('original_source'), canvas,
+                payload.get('run_id'),
+            )
+    except Exception as e:
+        await asyncio.to_thread(_job_failed, job_id, user_id, e, final_attempt)
+        raise
+
+
+def _job_failed(job_id: str, user_id: str, error: Exception, final_attempt: bool):
+    print(f"Job {job_id} failed: {error}")
+    if final_attempt:
+        record_job_failure(job_id, user_id, str(error))
+        job_events.publish(job_id, "failed", error=str(error))
@@ -0,0 +1,139 @@
+"""In-memory registry of prompt overrides, reloaded when prompt_overrides.json changes."""
+
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+OVERRIDES_PATH = Path(__file__).parent / "prompt_overrides.json"
+HISTORY_PATH = Path(__file__).parent / "prompt_history.jsonl"
+
+# How often lookups stat the overrides file for changes made by other processes
+RELOAD_CHECK_SECONDS = 1.0
+
+
+def _atomic_write(path: Path, text: str):
+    """Replace path so readers see either the old or the new file, never a partial one."""
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class PromptRegistry:
+    """Current prompt overrides and version, held in memory.
+
+    Lookups are memory reads. The file is re-read only when its mtime or
+    size changes (checked at most every RELOAD_CHECK_SECONDS) or after
+    invalidate(). Override history is appended to a separate JSON-lines
+    file, so the file read on reload stays small.
+    """
+
+    def __init__(self, path: Path = OVERRIDES_PATH, history_path: Path = HISTORY_PATH):
+        self.path = Path(path)
+        self.history_path = Path(history_path)
+        self._lock = threading.Lock()
+        self._signature = None  # (mtime_ns, size) of the loaded file, None if absent
+        self._checked_at = 0.0
+        self._stale = True
+        self._version = 1
+        self._prompts: dict[str, str | None] = {}
+
+    def _stat(self):
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _read(self) -> dict:
+        try:
+            return json.loads(self.path.read_text())
+        except (json.JSONDecodeError, OSError):
+            return {}
+
+    def _refresh(self):
+        now = time.monotonic()
+        if not self._stale and now - self._checked_at < RELOAD_CHECK_SECONDS:
+            return
+        with self._lock:
+            if not self._stale and now - self._checked_at < RELOAD_CHECK_SECONDS:
+                return
+            signature = self._stat()
+            if self._stale or signature != self._signature:
+                data = self._read() if signature else {}
+                self._version = data.get("version", 1)
+                self._prompts = data.get("prompts", {})
+                self._signature = signature
+                self._stale = False
+            self._checked_at = now
+
+    def invalidate(self):
+        """Force a reload on the next lookup."""
+        self._stale = True
+
+    def version(self) -> int:
+        self._refresh()
+        return self._version
+
+    def prompt(self, intensity: str) -> str | None:
+        """The override for an intensity, or None to use the built-in prompt."""
+        self._refresh()
+        return self._prompts.get(intensity)
+
+    @contextmanager
+    def _write_lock(self):
+        # Overrides may be saved by more than one process; serialize the read-modify-write
+        with open(self.path.with_name(f".{self.path.name}.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def save_override(self, intensity: str, new_prompt: str, trigger_jobs: list[str], expected_version: int | None = None) -> int | None:
+        """Set a new prompt for an intensity, bump the version and log it. Returns the new version.
+
+        With expected_version, nothing is saved (and None returned) unless
+        that is still the current version.
+        """
+        with self._write_lock():
+            data = self._read()
+            if expected_version is not None and data.get("version", 1) != expected_version:
+                return None
+            prompts = data.get("prompts", {"light": None, "medium": None, "strong": None})
+            version = data.get("version", 1) + 1
+
+            # Files from before the split carry their history inline; move it out once
+            legacy_history = data.get("history", [])
+
+            old_prompt = prompts.get(intensity)
+            prompts[intensity] = new_prompt
+            entry = {
+                "version": version,
+                "intensity": intensity,
+                "old_prompt": old_prompt,
+                "new_prompt": new_prompt,
+                "trigger_jobs": trigger_jobs,
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+            }
+            with open(self.history_path, "a") as f:
+                f.write("".join(json.dumps(h) + "\n" for h in [*legacy_history, entry]))
+
+            _atomic_write(self.path, json.dumps({"version": version, "prompts": prompts}, indent=2))
+        self.invalidate()
+        return version
+
+    def history(self) -> list[dict]:
+        if not self.history_path.exists():
+            return []
+        return [json.loads(line) for line in self.history_path.read_text().splitlines() if line.strip()]
+
+
+prompt_registry = PromptRegistry()
@@ -0,0 +1,154 @@
+"""Ratings store: an append-only log plus running good/bad counters per intensity and prompt version."""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+RATINGS_DB_PATH = Path(os.environ.get("SNAPREADY_RATINGS_DB", Path(__file__).parent / "ratings.db"))
+
+RATINGS = ("good", "bad")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rating_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    intensity TEXT NOT NULL,
+    prompt_version INTEGER NOT NULL,
+    rating TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+-- Current rating of each job; a job rated again replaces its earlier rating
+CREATE TABLE IF NOT EXISTS job_ratings (
+    job_id TEXT PRIMARY KEY,
+    intensity TEXT NOT NULL,
+    prompt_version INTEGER NOT NULL,
+    rating TEXT NOT NULL,
+    rated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_ratings_by_group ON job_ratings (intensity, prompt_version, rating, rated_at);
+CREATE TABLE IF NOT EXISTS rating_counts (
+    intensity TEXT NOT NULL,
+    prompt_version INTEGER NOT NULL,
+    good INTEGER NOT NULL DEFAULT 0,
+    bad INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (intensity, prompt_version)
+);
+"""
+
+
+class RatingsStore:
+    """Ratings persisted in SQLite.
+
+    Recording a rating is a constant-time insert that also adjusts the
+    counters of its (intensity, prompt_version) group, so stats and the
+    analysis threshold check read one row per group however many ratings
+    exist.
+    """
+
+    def __init__(self, path: Path = RATINGS_DB_PATH):
+        self.path = Path(path)
+        self._local = threading.local()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def record(self, job_id: str, intensity: str, prompt_version: int, rating: str, rated_at: float | None = None):
+        """Append a rating and make it the job's current one."""
+        if rating not in RATINGS:
+            raise ValueError(f"Unknown rating: {rating}")
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._record_locked(conn, job_id, intensity, prompt_version, rating, rated_at or time.time())
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _record_locked(self, conn: sqlite3.Connection, job_id: str, intensity: str, prompt_version: int, rating: str, rated_at: float):
+        # rating is one of RATINGS, so it is safe to use as a column name
+        previous = conn.execute(
+            "SELECT intensity, prompt_version, rating FROM job_ratings WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        if previous is not None:
+            conn.execute(
+                f"UPDATE rating_counts SET {previous[2]} = {previous[2]} - 1 WHERE intensity = ? AND prompt_version = ?",
+                (previous[0], previous[1]),
+            )
+        conn.execute(
+            "INSERT OR REPLACE INTO job_ratings (job_id, intensity, prompt_version, rating, rated_at) VALUES (?, ?, ?, ?, ?)",
+            (job_id, intensity, prompt_version, rating, rated_at),
+        )
+        conn.execute(
+            f"INSERT INTO rating_counts (intensity, prompt_version, {rating}) VALUES (?, ?, 1)"
+            f" ON CONFLICT (intensity, prompt_version) DO UPDATE SET {rating} = {rating} + 1",
+            (intensity, prompt_version),
+        )
+        conn.execute(
+            "INSERT INTO rating_log (job_id, intensity, prompt_version, rating, created_at) VALUES (?, ?, ?, ?, ?)",
+            (job_id, intensity, prompt_version, rating, rated_at),
+        )
+
+    def group_counts(self, min_version: int = 0) -> list[tuple[str, int, int, int]]:
+        """(intensity, prompt_version, good, bad) for every group at or above min_version."""
+        return self._conn().execute(
+            "SELECT intensity, prompt_version, good, bad FROM rating_counts WHERE prompt_version >= ?",
+            (min_version,),
+        ).fetchall()
+
+    def counts_by_intensity(self) -> dict[str, dict[str, int]]:
+        rows = self._conn().execute(
+            "SELECT intensity, SUM(good), SUM(bad) FROM rating_counts GROUP BY intensity"
+        ).fetchall()
+        return {intensity: {"good": good, "bad": bad} for intensity, good, bad in rows}
+
+    def recent_job_ids(self, intensity: str, prompt_version: int, rating: str, limit: int) -> list[str]:
+        """Most recently rated jobs of a group with the given current rating."""
+        rows = self._conn().execute(
+            "SELECT job_id FROM job_ratings WHERE intensity = ? AND prompt_version = ? AND rating = ?"
+            " ORDER BY rated_at DESC LIMIT ?",
+            (intensity, prompt_version, rating, limit),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def import_legacy(self, upload_dir: Path) -> int:
+        """One-time import of uploads/*/rating.json files written before this store existed.
+
+        Runs in one transaction, so processes starting together import once.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            (done,) = conn.execute("PRAGMA user_version").fetchone()
+            imported = 0
+            for rating_file in ([] if done else upload_dir.glob("*/rating.json")):
+                try:
+                    r = json.loads(rating_file.read_text())
+                    rated_at = datetime.fromisoformat(r["timestamp"]).timestamp()
+                except (json.JSONDecodeError, OSError, KeyError, ValueError):
+                    continue
+                if r.get("rating") not in RATINGS:
+                    continue
+                self._record_locked(conn, r["job_id"], r.get("intensity", "medium"), r.get("prompt_version", 1), r["rating"], rated_at)
+                imported += 1
+            conn.execute("PRAGMA user_version = 1")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if imported:
+            print(f"[ratings] Imported {imported} legacy rating.json files")
+        return imported
@@ -1,13 +1,25 @@
 """Gemini 3 Pro Image retouch wrapper."""
 
+import asyncio
 import os
 
-from google import genai
 from google.genai import types
 from PIL import Image
 import io
 
-_CLIENT = None
+from cache import CACHE_DIR, ResultCache, content_key
+from gemini import get_gemini
+
+# Retouch results keyed by cropped pixels + intensity + prompt. Gemini output is
+# deterministic enough for our purposes that an identical request can reuse it.
+RETOUCH_CACHE_MAX_BYTES = int(os.environ.get("RETOUCH_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024))  # 2 GB
+RETOUCH_CACHE_TTL = float(os.environ.get("RETOUCH_CACHE_TTL", 7 * 24 * 3600))  # 7 days
+
+_RETOUCH_CACHE = ResultCache(
+    CACHE_DIR / "retouch",
+    max_bytes=RETOUCH_CACHE_MAX_BYTES,
+    ttl_seconds=RETOUCH_CACHE_TTL,
+)
 
 SAFETY_SUFFIX = (
     " Do not alter face shape, eye color, bone structure, or hair."
@@ -33,16 +45,6 @@ PROMPTS = {
 }
 
 
-def _get_client():
-    global _CLIENT
-    if _CLIENT is None:
-        api_key = os.environ.get("GEMINI_API_KEY")
-        if not api_key:
-            raise RuntimeError("GEMINI_API_KEY environment variable is not set")
-        _CLIENT = genai.Client(api_key=api_key)
-    return _CLIENT
-
-
 def _detect_resolution(pil_image: Image.Image) -> str:
     """Pick output resolution based on input image dimensions."""
     w, h = pil_image.size
@@ -54,36 +56,90 @@ def _detect_resolution(pil_image: Image.Image) -> str:
     return "1K"
 
 
-def retouch_image(pil_image: Image.Image, intensity: str = "medium") -> Image.Image:
-    """Send image to Gemini for retouching and return the result."""
-    client = _get_client()
-    from feedback import get_active_prompt
-    prompt = get_active_prompt(intensity)
-    resolution = _detect_resolution(pil_image)
+def _retouch_cache_key(pil_image: Image.Image, intensity: str, prompt: str, prompt_version: int) -> str:
+    """Content hash of everything that determines the retouch output."""
+    return content_key(
+        pil_image.mode,
+        f"{pil_image.size[0]}x{pil_image.size[1]}",
+        pil_image.tobytes(),
+        intensity,
+        prompt,
+        str(prompt_version),
+    )
 
-    # Map resolution string to SDK enum
-    size_map = {
-        "1K": "IMAGE_SIZE_1024x1024",
-        "2K": "IMAGE_SIZE_2048x2048",
-        "4K": "IMAGE_SIZE_4096x4096",
-    }
-    image_size = size_map.get(resolution, "IMAGE_SIZE_1024x1024")
 
-    response = client.models.generate_content(
-        model="gemini-3-pro-image-preview",
-        contents=[pil_image, prompt],
-        config=types.GenerateContentConfig(
+def _image_part(pil_image: Image.Image) -> types.Part:
+    """The image as a PNG part, as the SDK would encode a PIL image itself."""
+    buf = io.BytesIO()
+    pil_image.save(buf, "PNG")
+    return types.Part.from_bytes(data=buf.getvalue(), mime_type="image/png")
+
+
+def _retouch_request(pil_image: Image.Image, prompt: str) -> dict:
+    """generate_content arguments for a retouch. Encoding the image is the expensive part."""
+    return {
+        "model": "gemini-3-pro-image-preview",
+        "contents": [_image_part(pil_image), prompt],
+        "config": types.GenerateContentConfig(
             response_modalities=["IMAGE"],
+            image_config=types.ImageConfig(image_size=_detect_resolution(pil_image)),
         ),
-    )
+    }
 
-    # Extract image from response
+
+def _response_image(response) -> bytes:
+    """The encoded image bytes Gemini produced."""
     for part in response.candidates[0].content.parts:
         if part.inline_data is not None:
-            image_bytes = part.inline_data.data
-            result = Image.open(io.BytesIO(image_bytes))
-            if result.mode == "RGBA":
-                result = result.convert("RGB")
-            return result
+            return part.inline_data.data
 
     raise RuntimeError("Gemini API did not return an image")
+
+
+def _generate_retouch(pil_image: Image.Image, prompt: str) -> bytes:
+    """Call Gemini and return the encoded image bytes it produced."""
+    return _response_image(get_gemini().generate_content(**_retouch_request(pil_image, prompt)))
+
+
+async def _agenerate_retouch(pil_image: Image.Image, prompt: str) -> bytes:
+    request = await asyncio.to_thread(_retouch_request, pil_image, prompt)
+    return _response_image(await get_gemini().agenerate_content(**request))
+
+
+def _decode_result(image_bytes: bytes) -> Image.Image:
+    result = Image.open(io.BytesIO(image_bytes))
+    if result.mode == "RGBA":
+        result = result.convert("RGB")
+    return result
+
+
+def retouch_cache_stats() -> dict:
+    return _RETOUCH_CACHE.stats()
+
+
+def retouch_image(pil_image: Image.Image, intensity: str = "medium") -> Image.Image:
+    """Send image to Gemini for retouching and return the result.
+
+    Results are cached by content, and identical concurrent requests share a
+    single Gemini call.
+    """
+    from feedback import get_active_prompt, get_current_prompt_version
+    prompt = get_active_prompt(intensity)
+    key = _retouch_cache_key(pil_image, intensity, prompt, get_current_prompt_version())
+
+    image_bytes = _RETOUCH_CACHE.get_or_compute(key, lambda: _generate_retouch(pil_image, prompt))
+    return _decode_result(image_bytes)
+
+
+async def aretouch_image(pil_image: Image.Image, intensity: str = "medium") -> Image.Image:
+    """retouch_image for asyncio callers.
+
+    Hashing, encoding and decoding run in a thread; the Gemini call is
+    awaited, so a retouch in flight holds no thread.
+    """
+    from feedback import get_active_prompt, get_current_prompt_version
+    prompt = get_active_prompt(intensity)
+    key = await asyncio.to_thread(_retouch_cache_key, pil_image, intensity, prompt, get_current_prompt_version())
+
+    image_bytes = await _RETOUCH_CACHE.aget_or_compute(key, lambda: _agenerate_retouch(pil_image, prompt))
+    return await asyncio.to_thread(_decode_result, image_bytes)
@@ -0,0 +1,259 @@
+"""Bounded in-process job scheduler with priorities and admission control."""
+
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from metrics import stage_seconds
+
+PRIORITY_REPROCESS = 0
+PRIORITY_UPLOAD = 1
+
+
+class SchedulerOverloaded(Exception):
+    """Raised when a job cannot be admitted. Carries the HTTP status and a Retry-After hint."""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class _Entry:
+    __slots__ = ("job_id", "owner", "priority", "fn", "args", "enqueued_at", "cancelled")
+
+    def __init__(self, job_id, owner, priority, fn, args):
+        self.job_id = job_id
+        self.owner = owner
+        self.priority = priority
+        self.fn = fn
+        self.args = args
+        self.enqueued_at = time.monotonic()
+        self.cancelled = False
+
+
+class JobScheduler:
+    """Runs blocking job functions on a fixed pool of worker threads.
+
+    The queue is bounded overall and per owner. Lower priority numbers run
+    first, FIFO within a priority. Submitting a job_id that is still waiting
+    replaces the waiting entry instead of queueing a second one, so rapid
+    reprocess requests for the same job collapse into the latest. A job_id
+    submitted while it is running is held until that run finishes, so two
+    runs of one job never overlap and the newer one writes last.
+
+    on_status(job_id, status) is called with "queued", "processing",
+    "completed" or "failed". A job function signals failure by raising.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        max_queue: int,
+        max_per_owner: int,
+        on_status: Callable[[str, str], None] | None = None,
+    ):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_per_owner = max_per_owner
+        self.on_status = on_status or (lambda job_id, status: None)
+
+        self._cond = threading.Condition()
+        self._heap: list[tuple[int, int, _Entry]] = []
+        self._seq = itertools.count()
+        self._pending: dict[str, _Entry] = {}  # job_id -> waiting entry (queued or held)
+        self._running_ids: set[str] = set()
+        self._owner_counts: dict[str, int] = {}  # owner -> waiting + running
+        self._running = 0
+        self._avg_duration = 15.0  # seconds, EWMA seed
+        self._counters = {"submitted": 0, "replaced": 0, "rejected": 0, "completed": 0, "failed": 0}
+
+        self._start()
+
+    def _start(self):
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def _retry_after_locked(self) -> int:
+        """Rough time until a slot frees up, from queue depth and average job time."""
+        backlog = len(self._pending) + self._running
+        return max(1, int(self._avg_duration * backlog / self.workers))
+
+    def _check_locked(self, owner: str, replacing: bool):
+        if replacing:
+            return
+        if len(self._pending) >= self.max_queue:
+            self._counters["rejected"] += 1
+            raise SchedulerOverloaded("Server is busy, please retry shortly.", 503, self._retry_after_locked())
+        if self._owner_counts.get(owner, 0) >= self.max_per_owner:
+            self._counters["rejected"] += 1
+            raise SchedulerOverloaded("Too many photos in progress, please wait for one to finish.", 429, self._retry_after_locked())
+
+    def check_admission(self, owner: str, job_id: str | None = None):
+        """Raise SchedulerOverloaded now if a submit would be rejected.
+
+        Lets request handlers refuse work before doing any expensive
+        decoding. submit() re-checks, since capacity can change in between.
+        """
+        with self._cond:
+            self._check_locked(owner, job_id in self._pending)
+
+    def submit(self, job_id: str, owner: str, fn: Callable, *args, priority: int = PRIORITY_UPLOAD):
+        """Queue fn(*args) for job_id, or raise SchedulerOverloaded."""
+        with self._cond:
+            previous = self._pending.get(job_id)
+            self._check_locked(owner, previous is not None)
+
+            if previous is not None:
+                previous.cancelled = True
+                self._owner_counts[previous.owner] -= 1
+                self._counters["replaced"] += 1
+
+            entry = _Entry(job_id, owner, priority, fn, args)
+            self._pending[job_id] = entry
+            self._owner_counts[owner] = self._owner_counts.get(owner, 0) + 1
+            self._counters["submitted"] += 1
+            if job_id not in self._running_ids:
+                heapq.heappush(self._heap, (priority, next(self._seq), entry))
+                self._cond.notify()
+            # Otherwise _finish queues it once the current run is done
+
+        self._notify(job_id, "queued")
+
+    def _notify(self, job_id: str, status: str):
+        """Call on_status; a failing callback (e.g. its store is down) must not kill a worker."""
+        try:
+            self.on_status(job_id, status)
+        except Exception as e:
+            print(f"[scheduler] Status update {status} for job {job_id} failed: {e}")
+
+    def _release_owner_locked(self, owner: str):
+        self._owner_counts[owner] -= 1
+        if self._owner_counts[owner] <= 0:
+            del self._owner_counts[owner]
+
+    def _next_entry(self) -> _Entry:
+        """Block until a job is runnable, and mark it running."""
+        with self._cond:
+            while True:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, entry = heapq.heappop(self._heap)
+                if not entry.cancelled:
+                    break
+            del self._pending[entry.job_id]
+            self._running_ids.add(entry.job_id)
+            self._running += 1
+        stage_seconds.observe("queue_wait", time.monotonic() - entry.enqueued_at)
+        self._notify(entry.job_id, "processing")
+        return entry
+
+    def _finish(self, entry: _Entry, status: str, duration: float):
+        stage_seconds.observe("job", duration)
+        with self._cond:
+            self._running -= 1
+            self._running_ids.discard(entry.job_id)
+            self._release_owner_locked(entry.owner)
+            self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+            self._counters[status] += 1
+            held = self._pending.get(entry.job_id)
+            if held is not None:
+                heapq.heappush(self._heap, (held.priority, next(self._seq), held))
+                self._cond.notify()
+        # With a newer run waiting, the job isn't done yet
+        self._notify(entry.job_id, "queued" if held is not None else status)
+
+    def _worker(self):
+        while True:
+            entry = self._next_entry()
+            start = time.monotonic()
+            status = "failed"
+            try:
+                entry.fn(*entry.args)
+                status = "completed"
+            except Exception as e:
+                print(f"[scheduler] Job {entry.job_id} failed: {e}")
+            finally:
+                self._finish(entry, status, time.monotonic() - start)
+
+    def metrics(self) -> dict:
+        """Snapshot of queue depth, concurrency and lifetime counters."""
+        with self._cond:
+            now = time.monotonic()
+            waits = [now - e.enqueued_at for e in self._pending.values()]
+            by_priority: dict[int, int] = {}
+            for e in self._pending.values():
+                by_priority[e.priority] = by_priority.get(e.priority, 0) + 1
+            return {
+                "workers": self.workers,
+                "running": self._running,
+                "queued": len(self._pending),
+                "max_queue": self.max_queue,
+                "queued_by_priority": {
+                    "reprocess": by_priority.get(PRIORITY_REPROCESS, 0),
+                    "upload": by_priority.get(PRIORITY_UPLOAD, 0),
+                },
+                "oldest_wait_seconds": round(max(waits), 3) if waits else 0.0,
+                "avg_job_seconds": round(self._avg_duration, 3),
+                "retry_after_seconds": self._retry_after_locked(),
+                **self._counters,
+            }
+
+
+class AsyncJobScheduler(JobScheduler):
+    """JobScheduler for coroutine job functions, run concurrently on one event loop thread.
+
+    A job awaiting the network holds no thread, so workers (the number of
+    jobs running at once) can be in the hundreds. Blocking steps inside jobs
+    go to the loop's default executor, which has cpu_threads threads.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        max_queue: int,
+        max_per_owner: int,
+        on_status: Callable[[str, str], None] | None = None,
+        cpu_threads: int = os.cpu_count() or 4,
+    ):
+        self.cpu_threads = cpu_threads
+        super().__init__(workers, max_queue, max_per_owner, on_status)
+
+    def _start(self):
+        self._slots = threading.Semaphore(self.workers)
+        self._loop = asyncio.new_event_loop()
+        self._loop.set_default_executor(ThreadPoolExecutor(self.cpu_threads, thread_name_prefix="job-cpu"))
+        self._threads = [
+            threading.Thread(target=self._loop.run_forever, name="job-loop", daemon=True),
+            threading.Thread(target=self._dispatch, name="job-dispatch", daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+
+    def _dispatch(self):
+        while True:
+            self._slots.acquire()
+            entry = self._next_entry()
+            asyncio.run_coroutine_threadsafe(self._run(entry), self._loop)
+
+    async def _run(self, entry: _Entry):
+        start = time.monotonic()
+        status = "failed"
+        try:
+            await entry.fn(*entry.args)
+            status = "completed"
+        except Exception as e:
+            print(f"[scheduler] Job {entry.job_id} failed: {e}")
+        finally:
+            # Also on cancellation, so the slot and the running/owner counts are returned
+            self._slots.release()
+            self._finish(entry, status, time.monotonic() - start)
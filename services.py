@@ -0,0 +1,51 @@
+"""Shared Firebase clients for the API and worker processes.
+
+With SNAPREADY_FAKES=1 these are the in-memory stand-ins from fakes.py.
+"""
+
+import os
+from pathlib import Path
+
+STORAGE_BUCKET = 'yphoto-d4f64.firebasestorage.app'
+# Concurrent Storage uploads and copies per process (see blobstore)
+UPLOAD_CONCURRENCY = int(os.environ.get("SNAPREADY_UPLOAD_CONCURRENCY", 8))
+
+if os.environ.get("SNAPREADY_FAKES") == "1":
+    from fakes import FakeBucket, FakeFirestore, serve_bucket
+
+    db = FakeFirestore()
+    bucket = FakeBucket()
+    storage_credentials = None
+    serve_bucket(bucket)
+    print("[services] Using fake Firestore and Storage (SNAPREADY_FAKES=1)")
+else:
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+    from google.auth.transport.requests import AuthorizedSession
+    from google.cloud import storage
+    from requests.adapters import HTTPAdapter
+
+    # --- Firebase Initialization ---
+    firebase_cred_path = Path(__file__).parent / "yphoto-firebase-adminsdk.json"
+    if not firebase_cred_path.exists():
+        print("WARNING: Firebase Admin SDK JSON not found. Auth will fail.")
+
+    cred = credentials.Certificate(str(firebase_cred_path))
+    firebase_app = firebase_admin.initialize_app(cred, {
+        'storageBucket': STORAGE_BUCKET
+    })
+
+    db = firestore.client()
+
+    # Storage gets its own session so its pool fits the upload concurrency: requests keeps
+    # 10 connections per host by default and drops the rest after use, so bursts beyond
+    # that would pay a fresh TLS handshake
+    storage_credentials = cred.get_credential()
+    _storage_session = AuthorizedSession(storage_credentials)
+    _storage_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=max(10, UPLOAD_CONCURRENCY * 2)))
+    bucket = storage.Client(project=cred.project_id, credentials=storage_credentials, _http=_storage_session).bucket(STORAGE_BUCKET)
+
+
+def job_doc(user_id: str, job_id: str):
+    """Firestore document reference for a user's job."""
+    return db.collection('users').document(user_id).collection('jobs').document(job_id)
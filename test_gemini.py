@@ -0,0 +1,282 @@
+"""Tests for the Gemini wrapper: retry classification, the circuit breaker and hedging.
+
+Run with: python -m unittest test_gemini
+"""
+
+import asyncio
+import threading
+import time
+import types as pytypes
+import unittest
+
+import httpx
+from google import genai
+from google.genai import errors, types
+
+from fakes import Faults, serve_gemini
+from gemini import CircuitBreaker, GeminiUnavailable, ResilientGemini, is_retryable
+
+
+def _api_error(code: int) -> errors.APIError:
+    cls = errors.ClientError if code < 500 else errors.ServerError
+    return cls(code, {"error": {"code": code, "message": "test", "status": "TEST"}})
+
+
+class ScriptedClient:
+    """A genai.Client stand-in whose calls play a script: each step is a delay and
+    an exception to raise, or None to answer "ok".
+    """
+
+    def __init__(self, *steps: tuple[float, Exception | None]):
+        self.steps = list(steps)
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.models = pytypes.SimpleNamespace(generate_content=self._generate)
+        self.aio = pytypes.SimpleNamespace(models=pytypes.SimpleNamespace(generate_content=self._agenerate))
+
+    def _next(self) -> tuple[float, Exception | None]:
+        with self._lock:
+            self.calls += 1
+            return self.steps.pop(0) if self.steps else (0.0, None)
+
+    def _generate(self, *, model, contents, config=None):
+        delay, error = self._next()
+        time.sleep(delay)
+        if error is not None:
+            raise error
+        return "ok"
+
+    async def _agenerate(self, *, model, contents, config=None):
+        delay, error = self._next()
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return "ok"
+
+
+def _gemini(client, **kwargs) -> ResilientGemini:
+    options = {"timeout": 5.0, "retries": 2, "backoff": 0.01, "requests_per_minute": 60000, "concurrency": 2}
+    return ResilientGemini(client, **{**options, **kwargs})
+
+
+class RetryClassificationTest(unittest.TestCase):
+    def test_throttling_timeouts_and_server_errors_are_retryable(self):
+        for code in (408, 429, 500, 503):
+            self.assertTrue(is_retryable(_api_error(code)), code)
+        self.assertTrue(is_retryable(TimeoutError()))
+        self.assertTrue(is_retryable(httpx.ReadTimeout("slow")))
+        self.assertTrue(is_retryable(httpx.ConnectError("refused")))
+
+    def test_request_errors_are_not(self):
+        for code in (400, 403, 404):
+            self.assertFalse(is_retryable(_api_error(code)), code)
+        self.assertFalse(is_retryable(ValueError("bad")))
+
+    def test_retries_until_success(self):
+        client = ScriptedClient((0, _api_error(503)), (0, _api_error(429)))
+        gemini = _gemini(client)
+        self.assertEqual(gemini.generate_content(model="m", contents=["x"]), "ok")
+        self.assertEqual(client.calls, 3)
+        self.assertEqual(gemini.stats()["retries"], 2)
+
+    def test_gives_up_after_retries(self):
+        client = ScriptedClient(*[(0, _api_error(503))] * 3)
+        gemini = _gemini(client)
+        with self.assertRaises(errors.ServerError):
+            gemini.generate_content(model="m", contents=["x"])
+        self.assertEqual(client.calls, 3)
+        self.assertEqual(gemini.stats()["failures"], 1)
+
+    def test_request_error_is_not_retried(self):
+        client = ScriptedClient((0, _api_error(400)))
+        gemini = _gemini(client)
+        with self.assertRaises(errors.ClientError):
+            gemini.generate_content(model="m", contents=["x"])
+        self.assertEqual(client.calls, 1)
+
+    def test_async_retries_until_success(self):
+        client = ScriptedClient((0, _api_error(503)))
+        gemini = _gemini(client)
+        self.assertEqual(asyncio.run(gemini.agenerate_content(model="m", contents=["x"])), "ok")
+        self.assertEqual(client.calls, 2)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker(failure_threshold=3, reset_seconds=60)
+        for _ in range(2):
+            breaker.record(False)
+        self.assertEqual(breaker.state, "closed")
+        breaker.record(True)
+        for _ in range(3):
+            breaker.record(False)
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.allow())
+
+    def test_half_open_lets_one_trial_through(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.05)
+        breaker.record(False)
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, "half_open")
+        self.assertFalse(breaker.allow())
+        breaker.record(True)
+        self.assertEqual(breaker.state, "closed")
+        self.assertTrue(breaker.allow())
+
+    def test_failed_trial_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.05)
+        breaker.record(False)
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        breaker.record(False)
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.allow())
+
+    def test_abandoned_trial_lets_another_through(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.05)
+        breaker.record(False)
+        time.sleep(0.06)
+        trial = breaker.allow()
+        self.assertTrue(trial)
+        breaker.abandon(trial)
+        self.assertTrue(breaker.allow())
+
+    def test_only_the_trial_can_abandon_it(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.05)
+        earlier = breaker.allow()
+        breaker.record(False)
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        # A call admitted before the circuit opened is cancelled during the trial
+        breaker.abandon(earlier)
+        self.assertFalse(breaker.allow())
+
+    def test_open_circuit_fails_fast_and_returns_the_slot(self):
+        client = ScriptedClient()
+        gemini = _gemini(
+            client, breaker=CircuitBreaker(failure_threshold=1, reset_seconds=60), concurrency=1, requests_per_minute=6,
+        )
+        gemini.breaker.record(False)
+        with self.assertRaises(GeminiUnavailable):
+            gemini.generate_content(model="m", contents=["x"])
+        self.assertEqual(client.calls, 0)
+        self.assertEqual(gemini.stats()["rejected"], 1)
+        self.assertTrue(gemini._slots.acquire(blocking=False))
+        # Refused before the rate limit, so its only token is still there
+        self.assertTrue(gemini.limiter.try_acquire())
+
+    def test_request_errors_do_not_open_it(self):
+        client = ScriptedClient(*[(0, _api_error(400))] * 3)
+        gemini = _gemini(client, breaker=CircuitBreaker(failure_threshold=2, reset_seconds=60), retries=0)
+        for _ in range(3):
+            with self.assertRaises(errors.ClientError):
+                gemini.generate_content(model="m", contents=["x"])
+        self.assertEqual(gemini.breaker.state, "closed")
+
+
+class BackpressureTest(unittest.TestCase):
+    def test_open_circuit_holds_work_off_until_the_trial(self):
+        gemini = _gemini(ScriptedClient(), breaker=CircuitBreaker(failure_threshold=1, reset_seconds=60))
+        self.assertIsNone(gemini.backpressure())
+        gemini.breaker.record(False)
+        self.assertGreater(gemini.backpressure(), 50)
+
+    def test_backlog_beyond_the_queue_timeout_is_refused(self):
+        # One slot, calls up to 1 s, 2 s of queueing: room for two waiting calls
+        client = ScriptedClient((0.5, None))
+        gemini = _gemini(client, concurrency=1, timeout=1.0, queue_timeout=2.0)
+        threads = [threading.Thread(target=gemini.generate_content, kwargs={"model": "m", "contents": ["x"]}) for _ in range(3)]
+        for t in threads:
+            t.start()
+        time.sleep(0.2)
+        self.assertEqual(gemini.stats()["waiting"], 2)
+        self.assertEqual(gemini.backpressure(), 1.0)
+        for t in threads:
+            t.join()
+        self.assertIsNone(gemini.backpressure())
+
+
+class HedgingTest(unittest.TestCase):
+    def test_slow_primary_is_hedged_and_the_hedge_wins(self):
+        client = ScriptedClient((1.0, None), (0, None))
+        gemini = _gemini(client, hedge_after=0.05)
+        started = time.monotonic()
+        self.assertEqual(gemini.generate_content(model="m", contents=["x"]), "ok")
+        self.assertLess(time.monotonic() - started, 0.5)
+        stats = gemini.stats()
+        self.assertEqual((stats["hedges"], stats["hedge_wins"]), (1, 1))
+
+    def test_fast_primary_is_not_hedged(self):
+        client = ScriptedClient((0, None))
+        gemini = _gemini(client, hedge_after=0.5)
+        gemini.generate_content(model="m", contents=["x"])
+        self.assertEqual(client.calls, 1)
+        self.assertEqual(gemini.stats()["hedges"], 0)
+
+    def test_no_hedge_without_a_free_slot(self):
+        client = ScriptedClient((0.2, None))
+        gemini = _gemini(client, hedge_after=0.05, concurrency=1)
+        gemini.generate_content(model="m", contents=["x"])
+        self.assertEqual(client.calls, 1)
+        self.assertEqual(gemini.stats()["hedges"], 0)
+
+    def test_timed_out_attempt_returns_its_slots(self):
+        client = ScriptedClient((1.0, None), (1.0, None))
+        gemini = _gemini(client, hedge_after=0.05, timeout=0.1, retries=0)
+        with self.assertRaises(TimeoutError):
+            gemini.generate_content(model="m", contents=["x"])
+        self.assertEqual(gemini.stats()["abandoned"], 2)
+        # Both slots are free again although the requests are still running
+        self.assertTrue(gemini._slots.acquire(blocking=False))
+        self.assertTrue(gemini._slots.acquire(blocking=False))
+        self.assertEqual(gemini.stats()["in_flight"], 2)
+        gemini._slots.release()
+        gemini._slots.release()
+        # The late requests finishing must not release slots a second time
+        time.sleep(1.1)
+        self.assertEqual(gemini.stats()["in_flight"], 0)
+        with self.assertRaises(ValueError):
+            gemini._slots.release()
+
+    def test_async_slow_primary_is_hedged_and_cancelled(self):
+        client = ScriptedClient((1.0, None), (0, None))
+        gemini = _gemini(client, hedge_after=0.05)
+        self.assertEqual(asyncio.run(gemini.agenerate_content(model="m", contents=["x"])), "ok")
+        stats = gemini.stats()
+        self.assertEqual((stats["hedges"], stats["hedge_wins"], stats["in_flight"]), (1, 1, 0))
+
+
+class FakeServerTest(unittest.TestCase):
+    """The wrapper and the real SDK against the fake Gemini REST server."""
+
+    def _client(self, faults: Faults) -> genai.Client:
+        return genai.Client(api_key="fake", http_options=types.HttpOptions(base_url=serve_gemini(faults)))
+
+    def test_image_request_gets_the_image_back(self):
+        gemini = _gemini(self._client(Faults("gemini", latency=0, error_rate=0)))
+        response = gemini.generate_content(
+            model="m",
+            contents=[types.Part.from_bytes(data=b"pixels", mime_type="image/png"), "retouch"],
+            config=types.GenerateContentConfig(response_modalities=["IMAGE"]),
+        )
+        self.assertEqual(response.candidates[0].content.parts[0].inline_data.data, b"pixels")
+
+    def test_server_errors_are_retried_then_raised(self):
+        faults = Faults("gemini", latency=0, error_rate=1.0)
+        gemini = _gemini(self._client(faults))
+        with self.assertRaises(errors.ServerError):
+            gemini.generate_content(model="m", contents=["x"])
+        self.assertEqual(faults.stats()["calls"], 3)
+
+    def test_slow_server_hits_the_deadline(self):
+        gemini = _gemini(self._client(Faults("gemini", latency=3, error_rate=0)), timeout=1.0, retries=0)
+        started = time.monotonic()
+        with self.assertRaises(Exception) as caught:
+            gemini.generate_content(model="m", contents=["x"])
+        self.assertTrue(is_retryable(caught.exception), caught.exception)
+        self.assertLess(time.monotonic() - started, 2.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
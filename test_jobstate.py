@@ -0,0 +1,106 @@
+"""Tests for the job-state stores and JobEvents merging, against the fake Redis.
+
+Run with: python -m unittest test_jobstate
+"""
+
+import threading
+import time
+import unittest
+
+from events import JobEvents
+from fakes import FakeRedis, serve_redis
+from jobstate import MemoryJobStateStore, RedisJobStateStore
+
+
+class StoreContract:
+    """Tests every job-state store must pass; subclasses provide make_store."""
+
+    def make_store(self, ttl_seconds: float = 60):
+        raise NotImplementedError
+
+    def test_put_get_delete(self):
+        store = self.make_store()
+        self.assertIsNone(store.get("job"))
+        store.put("job", {"status": "queued", "zoom": 1.2, "face": {"x": 1}})
+        self.assertEqual(store.get("job"), {"status": "queued", "zoom": 1.2, "face": {"x": 1}})
+        store.delete("job")
+        self.assertIsNone(store.get("job"))
+
+    def test_merge_sets_and_drops_fields(self):
+        store = self.make_store()
+        store.put("job", {"status": "failed", "error": "boom", "owner": "u"})
+        previous, state = store.merge("job", {"status": "queued"}, drop=("error",))
+        self.assertEqual(previous, {"status": "failed", "error": "boom", "owner": "u"})
+        self.assertEqual(state, {"status": "queued", "owner": "u"})
+        self.assertEqual(store.get("job"), state)
+
+    def test_merge_existing_only_leaves_missing_jobs_alone(self):
+        store = self.make_store()
+        self.assertEqual(store.merge("job", {"preview_url": "x"}, existing_only=True), (None, None))
+        self.assertIsNone(store.get("job"))
+
+    def test_states_expire(self):
+        store = self.make_store(ttl_seconds=1)
+        store.merge("job", {"status": "queued"})
+        time.sleep(1.1)
+        self.assertIsNone(store.get("job"))
+
+
+class MemoryStoreTest(StoreContract, unittest.TestCase):
+    def make_store(self, ttl_seconds: float = 60):
+        return MemoryJobStateStore(ttl_seconds=ttl_seconds)
+
+
+class RedisStoreTest(StoreContract, unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.url = serve_redis(FakeRedis())
+
+    def make_store(self, ttl_seconds: float = 60):
+        return RedisJobStateStore(self.url, ttl_seconds=ttl_seconds, prefix=f"test:{self.id()}:")
+
+    def test_publishers_in_other_processes_keep_each_others_fields(self):
+        # Separate JobEvents and connections stand in for separate processes; their
+        # locks don't exclude each other, so only the store can keep this consistent
+        prefix = f"test:{self.id()}:"
+        publishers = [JobEvents(RedisJobStateStore(self.url, prefix=prefix)) for _ in range(4)]
+        publishers[0].publish("job", "uploading")
+
+        def attach(events: JobEvents, n: int):
+            for i in range(25):
+                events.update("job", **{f"field_{n}_{i}": i})
+
+        threads = [threading.Thread(target=attach, args=(events, n)) for n, events in enumerate(publishers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        state = publishers[0].latest("job")
+        self.assertEqual(state["status"], "uploading")
+        self.assertEqual(len(state), 2 + 4 * 25)
+
+    def test_publish_drops_a_stale_error(self):
+        events = JobEvents(self.make_store())
+        events.publish("job", "failed", error="boom")
+        self.assertEqual(events.latest("job")["error"], "boom")
+        events.publish("job", "queued", owner="u")
+        self.assertEqual(events.latest("job"), {"job_id": "job", "status": "queued", "owner": "u"})
+
+    def test_restart_replaces_the_previous_run(self):
+        events = JobEvents(self.make_store())
+        events.publish("job", "completed", owner="u", render_id="old", retouched_url="x")
+        events.restart("job", "queued", owner="u", render_id="new")
+        self.assertEqual(events.latest("job"), {"job_id": "job", "owner": "u", "render_id": "new", "status": "queued"})
+
+
+class StoreOutageTest(unittest.TestCase):
+    def test_publish_still_reaches_subscribers_without_a_store(self):
+        events = JobEvents(RedisJobStateStore("redis://127.0.0.1:1/0"))
+        heard = []
+        events._notify_locked = lambda job_id, event: heard.append(event)
+        events.publish("job", "cropping", zoom=1.0)
+        self.assertEqual(heard, [{"job_id": "job", "zoom": 1.0, "status": "cropping"}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+"""snapready-worker: run crop/retouch jobs from the durable SQLite queue.
+
+Usage:
+    python worker.py --processes 4
+
+Each process claims jobs with a lease, heartbeats while running and retries
+failures with backoff. Jobs left running by a crashed worker are requeued
+once their lease expires.
+"""
+
+import argparse
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from jobqueue import QUEUE_DB_PATH, SqliteJobQueue
+
+RECOVER_INTERVAL = 30.0  # seconds between orphaned-lease sweeps
+PRUNE_INTERVAL = 3600.0
+
+
+def _record_exhausted(exhausted):
+    from pipeline import record_job_failure
+    for job in exhausted:
+        try:
+            record_job_failure(job.job_id, job.owner, "Processing was interrupted, please try again.")
+        except Exception as e:
+            print(f"[worker] Could not record failure for {job.job_id}: {e}")
+
+
+def _run_one(queue: SqliteJobQueue, job, worker_id: str):
+    from pipeline import run_job
+
+    done = threading.Event()
+
+    def heartbeat():
+        while not done.wait(queue.lease_seconds / 3):
+            try:
+                queue.heartbeat(job, worker_id)
+            except Exception as e:
+                # e.g. "database is locked"; the next beat still lands well within the lease
+                print(f"[worker] Heartbeat for {job.job_id} failed: {e}")
+
+    beat = threading.Thread(target=heartbeat, daemon=True)
+    beat.start()
+    try:
+        run_job(job.kind, job.job_id, job.owner, job.payload, final_attempt=queue.is_final_attempt(job))
+        if not queue.complete(job, worker_id):
+            print(f"[worker] {job.job_id} finished after its lease was lost")
+    except Exception as e:
+        if not queue.fail(job, str(e), worker_id):
+            print(f"[worker] {job.job_id} attempt {job.attempts} failed, will retry")
+    finally:
+        done.set()
+        beat.join()
+
+
+def worker_loop(index: int, db_path: str, poll_interval: float):
+    """Claim and run jobs until SIGTERM/SIGINT. Finishes the current job before exiting."""
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    queue = SqliteJobQueue(db_path)
+    worker_id = f"{os.uname().nodename}:{os.getpid()}:{index}"
+
+    # Importing the pipeline initializes Firebase and the face detector; do it once up front
+    import pipeline  # noqa: F401
+    print(f"[worker] {worker_id} ready")
+
+    last_recover = 0.0
+    while not stop.is_set():
+        if time.monotonic() - last_recover > RECOVER_INTERVAL:
+            _record_exhausted(queue.recover_orphans())
+            last_recover = time.monotonic()
+
+        job = queue.claim(worker_id)
+        if job is None:
+            stop.wait(poll_interval)
+            continue
+        _run_one(queue, job, worker_id)
+
+    print(f"[worker] {worker_id} stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="snapready-worker", description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", "-n", type=int, default=int(os.environ.get("SNAPREADY_WORKER_PROCESSES", os.cpu_count() or 1)))
+    parser.add_argument("--db", default=str(QUEUE_DB_PATH))
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    args = parser.parse_args()
+
+    queue = SqliteJobQueue(args.db)
+    # Jobs orphaned by a previous run come back once their lease expires; live leases may
+    # belong to another supervisor on the same database
+    _record_exhausted(queue.recover_orphans())
+    queue.prune()
+
+    # spawn, not fork: gRPC and MediaPipe don't survive a fork
+    ctx = multiprocessing.get_context("spawn")
+    procs = [
+        ctx.Process(target=worker_loop, args=(i, args.db, args.poll_interval), name=f"snapready-worker-{i}")
+        for i in range(args.processes)
+    ]
+    for p in procs:
+        p.start()
+
+    def forward(signum, _frame):
+        for p in procs:
+            if p.is_alive():
+                os.kill(p.pid, signum)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+
+    last_prune = time.monotonic()
+    while any(p.is_alive() for p in procs):
+        for p in procs:
+            p.join(timeout=1)
+        if time.monotonic() - last_prune > PRUNE_INTERVAL:
+            queue.prune()
+            last_prune = time.monotonic()
+
+
+if __name__ == "__main__":
+    main()